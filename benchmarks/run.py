@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+""" Benchmarks for change detection.
+
+Cases are built from the generators in test/shared.py and the sample CSVs
+in test/resources, so every run measures the same inputs. Each case reports
+the best wall time of a number of repeats, fits and segments (see
+ccd.instrument; every case is a single pixel) and the peak memory
+allocated during one more run.
+
+Results are written as JSON so runs of different commits can be compared:
+
+    $ python benchmarks/run.py run --output before.json
+    $ git checkout my-branch
+    $ python benchmarks/run.py run --output after.json
+    $ python benchmarks/run.py compare before.json after.json
+
+Logging and warnings are disabled while benchmarking; debug messages would
+otherwise dominate the timings.
+"""
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+
+import click
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'test'))
+
+from shared import read_data  # noqa: E402
+from shared import sample_line  # noqa: E402
+from shared import sample_sinusoid  # noqa: E402
+from shared import two_change_data  # noqa: E402
+
+import ccd  # noqa: E402
+from ccd import app  # noqa: E402
+from ccd import instrument  # noqa: E402
+import ccd.change as change  # noqa: E402
+
+LENGTHS = (16, 64, 256, 1024, 4096)
+QUICK_LENGTHS = (16, 64, 256)
+CHANGES = (0, 1, 2, 4, 8)
+BANDS = (5, 6, 8)
+
+
+def interval(length):
+    return 'R{0}/2000-01-01/P16D'.format(length)
+
+
+def with_changes(observations, changes):
+    """Shift the first band up and down changes times, evenly spaced."""
+    shifted = observations.astype(float)
+    bounds = np.linspace(0, shifted.shape[1], changes + 2).astype(int)
+    for ix, (start, stop) in enumerate(zip(bounds[1:-1], bounds[2:])):
+        shifted[0, start:stop] += 500 * ((ix + 1) % 2)
+    return shifted
+
+
+def series_case(name, times, observations, **params):
+    """A case running change.detect on a generated series."""
+    fitter_fn = ccd.fitter()
+
+    def run(stats):
+        return change.detect(times, observations, fitter_fn,
+                             app.MEOW_SIZE, app.PEEK_SIZE,
+                             app.INCREMENTAL_FIT, stats=stats)
+    params.update(observations=len(times), bands=len(observations))
+    return name, params, run
+
+
+def pixel_case(name, pixel, preprocess, **params):
+    """A case running ccd.detect on a sample pixel, all nine rows."""
+    def run(stats):
+        return ccd.detect(*pixel, preprocess=preprocess, stats=stats)
+    params.update(observations=pixel.shape[1], preprocess=preprocess)
+    return name, params, run
+
+
+def cases(lengths):
+    """Generate (name, params, run) for every case."""
+    for length in lengths:
+        times, observations = sample_line(interval(length))
+        yield series_case('line', times, observations, changes=0)
+
+    for length in lengths:
+        times, observations = sample_sinusoid(interval(length))
+        yield series_case('sinusoid', times, observations, changes=0)
+
+    length = max(lengths)
+    times, observations = sample_line(interval(length))
+    for changes in CHANGES:
+        yield series_case('changes', times,
+                          with_changes(observations, changes),
+                          changes=changes)
+
+    for bands in BANDS:
+        times, observations = sample_line(interval(256), bands)
+        yield series_case('bands', times, observations, changes=0)
+
+    yield pixel_case('two_change_data', two_change_data(), False, changes=2)
+
+    for sample in ('sample_1', 'sample_2'):
+        path = os.path.join(ROOT, 'test', 'resources', sample + '.csv')
+        yield pixel_case(sample, read_data(path), True)
+
+
+def measure(run, repeat):
+    """Best wall time of repeat runs, counts of one run and peak memory."""
+    stats = instrument.Stats()
+    results = run(stats)
+
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(None)
+        seconds.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    run(None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': min(seconds),
+            'seconds_all': seconds,
+            'fits': stats.counts['fits'],
+            'tmask': stats.counts['tmask'],
+            'shifts': stats.counts['shifts'],
+            'extensions': stats.counts['extensions'],
+            'iterations': stats.counts['iterations'],
+            'extension_iterations': stats.counts['extension_iterations'],
+            'segments': len(results),
+            'peak_bytes': peak}
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=ROOT,
+                                       stderr=subprocess.DEVNULL
+                                       ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {'revision': revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'fitter': app.FITTER_FN,
+            'incremental': app.INCREMENTAL_FIT,
+            'warm_start': app.WARM_START,
+            'precision': app.PRECISION,
+            'meow_size': app.MEOW_SIZE,
+            'peek_size': app.PEEK_SIZE}
+
+
+def key(case):
+    return json.dumps([case['name'], case['params']], sort_keys=True)
+
+
+@click.group()
+def cli():
+    """Change detection benchmarks."""
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+
+
+@cli.command()
+@click.option('--output', type=click.Path(), default=None,
+              help='Write results to this JSON file, default stdout.')
+@click.option('--repeat', default=3, help='Timed runs of each case.')
+@click.option('--quick', is_flag=True, help='Only short series.')
+@click.option('--fitter', default=None, help='Override app.FITTER_FN.')
+@click.option('--incremental', is_flag=True, help='Set app.INCREMENTAL_FIT.')
+@click.option('--warm-start', is_flag=True, help='Set app.WARM_START.')
+@click.option('--precision', default=None,
+              type=click.Choice(['float64', 'float32']),
+              help='Override app.PRECISION.')
+@click.option('--match', default=None, help='Only cases named like this.')
+def run(output, repeat, quick, fitter, incremental, warm_start, precision,
+        match):
+    """Run the benchmarks."""
+    if fitter:
+        app.FITTER_FN = fitter
+    app.INCREMENTAL_FIT = app.INCREMENTAL_FIT or incremental
+    app.WARM_START = app.WARM_START or warm_start
+    if precision:
+        app.PRECISION = precision
+
+    results = []
+    for name, params, fn in cases(QUICK_LENGTHS if quick else LENGTHS):
+        if match and match not in name:
+            continue
+        measured = measure(fn, repeat)
+        results.append({'name': name, 'params': params,
+                        'results': measured})
+        click.echo('{0:<16} {1:<60} {2:>9.4f}s {3:>7} fits {4:>12,} '
+                   'B'.format(name, json.dumps(params, sort_keys=True),
+                              measured['seconds'], measured['fits'],
+                              measured['peak_bytes']), err=True)
+
+    document = json.dumps({'environment': environment(), 'cases': results},
+                          indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(document)
+    else:
+        click.echo(document)
+
+
+@cli.command()
+@click.argument('before', type=click.File())
+@click.argument('after', type=click.File())
+def compare(before, after):
+    """Compare the results of two runs, case by case."""
+    before, after = json.load(before), json.load(after)
+    previous = {key(case): case['results'] for case in before['cases']}
+    click.echo('{0:<16} {1:<60} {2:>10} {3:>10} {4:>8} {5:>8}'.format(
+        'case', 'params', 'before', 'after', 'speedup', 'fits'))
+    for case in after['cases']:
+        old = previous.get(key(case))
+        if old is None:
+            continue
+        new = case['results']
+        click.echo('{0:<16} {1:<60} {2:>9.4f}s {3:>9.4f}s {4:>7.2f}x '
+                   '{5:>8}'.format(case['name'],
+                                   json.dumps(case['params'], sort_keys=True),
+                                   old['seconds'], new['seconds'],
+                                   old['seconds'] / new['seconds'],
+                                   new['fits'] - old['fits']))
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,7 +1,19 @@
 from ccd.change import detect as __detect
+from ccd.batch import detect as __detect_batch
+from ccd.batch import pack as __pack
+from ccd.data import segments as __segments
+from ccd.executor import detect as __detect_pixel
+from ccd.executor import run as __run
+from ccd.filter import detectable as __detectable
 from ccd.filter import preprocess as __preprocess
+from ccd.filter import preprocess_index as __preprocess_index
+from ccd.kernel import available as __kernel_available
+from ccd.instrument import NULL as __NULL
+from ccd.kernel import detect as __detect_kernel
+from ccd.source import prefetch as __prefetch
 import numpy as np
 from ccd import app
+import functools
 import importlib
 
 # Versions should comply with PEP440.
@@ -30,11 +42,27 @@ def attr_from_str(value):
         return None
 
 
-def __result_to_detection(change_tuple):
-    """Transforms results of change.detect to the detections dict.
+@functools.lru_cache(maxsize=None)
+def __resolved(value):
+    """attr_from_str, looked up once for each value."""
+    return attr_from_str(value)
 
-    Args: A tuple as returned from change.detect
-            (start_day, end_day, models, errors_, magnitudes_)
+
+def fitter():
+    """The fitter function named by app.FITTER_FN.
+
+    The name is resolved once and the function reused by every later call,
+    as long as app.FITTER_FN names it.
+    """
+    return __resolved(app.FITTER_FN)
+
+
+def __result_to_detection(segment):
+    """Transforms a segment of change.detect to the detections dict.
+
+    Args: A row of the structured array returned from change.detect, see
+          ccd.data.segment_dtype. Magnitudes that were not calculated are
+          NaN.
 
     Returns: A dict representing a change detection
 
@@ -72,18 +100,18 @@ def __result_to_detection(change_tuple):
 
     # get the start and end time for each detection period
     detection = {'algorithm': __algorithm__,
-                 'start_day': int(change_tuple[0]),
-                 'end_day': int(change_tuple[1]),
-                 'observation_count': None,  # dummy value for now
+                 'start_day': int(segment['start_day']),
+                 'end_day': int(segment['end_day']),
+                 'observation_count': int(segment['observation_count']),
                  'category': None}           # dummy value for now
 
     # gather the results for each spectra
     for ix, name in spectra:
-        model, error, mags = change_tuple[2], change_tuple[3], change_tuple[4]
-        _band = {'magnitude': float(mags[ix]),
-                 'rmse': float(error[ix]),
-                 'coefficients': tuple([float(x) for x in model[ix].coef_]),
-                 'intercept': float(model[ix].intercept_)}
+        _band = {'magnitude': float(segment['magnitude'][ix]),
+                 'rmse': float(segment['rmse'][ix]),
+                 'coefficients': tuple([float(x) for x in
+                                        segment['coefficients'][ix]]),
+                 'intercept': float(segment['intercept'][ix])}
 
         # assign _band to the subdict
         detection[name] = _band
@@ -92,15 +120,10 @@ def __result_to_detection(change_tuple):
     return detection
 
 
-def __as_detections(detect_tuple):
+def __as_detections(segments):
     """Transforms results of change.detect to the detections namedtuple.
 
-    Args: A tuple of dicts as returned from change.detect
-        (
-            (start_day, end_day, models, errors_, magnitudes_),
-            (start_day, end_day, models, errors_, magnitudes_),
-            (start_day, end_day, models, errors_, magnitudes_)
-        )
+    Args: The structured array of segments returned from change.detect
 
     Returns: A tuple of dicts representing change detections
         (
@@ -109,7 +132,26 @@ def __as_detections(detect_tuple):
     """
     # iterate over each detection, build the result and return as tuple of
     # dicts
-    return tuple([__result_to_detection(t) for t in detect_tuple])
+    return tuple([__result_to_detection(t) for t in segments])
+
+
+def __as_output(segments, output):
+    """Segments as the detections dicts or as the structured array."""
+    if output == 'dict':
+        return __as_detections(segments)
+    if output == 'array':
+        return segments
+    raise ValueError("unknown output {0!r}, use 'dict' or "
+                     "'array'".format(output))
+
+
+def __backend():
+    """Name of the detection backend to use, see app.DETECT_BACKEND."""
+    if app.DETECT_BACKEND == 'numba':
+        if __kernel_available():
+            return 'numba'
+        logger.debug("numba is not installed, using the python backend")
+    return 'python'
 
 
 def __split_dates_spectra(matrix):
@@ -118,7 +160,8 @@ def __split_dates_spectra(matrix):
 
 
 def detect(dates, reds, greens, blues, nirs,
-           swir1s, swir2s, thermals, qas, preprocess=True):
+           swir1s, swir2s, thermals, qas, preprocess=True, output='dict',
+           stats=None):
     """Entry point call to detect change
 
     Args:
@@ -131,9 +174,14 @@ def detect(dates, reds, greens, blues, nirs,
         swir2s:   numpy array of swir2 band values
         thermals: numpy array of thermal band values
         qas:      numpy array of qa band values
+        output:   'dict' for a tuple of detection dicts, 'array' for a
+                  numpy structured array with a row for each segment, see
+                  ccd.data.segment_dtype
+        stats:    ccd.instrument.Stats to add the counts and timings of
+                  change detection to, python backend only
 
     Returns:
-        Tuple of ccd.detections namedtuples
+        Tuple of ccd.detections namedtuples, or the structured array
     """
 
     __matrix = np.array([dates, reds, greens,
@@ -146,9 +194,120 @@ def detect(dates, reds, greens, blues, nirs,
     else:
         __dates, __spectra = __split_dates_spectra(__matrix)
 
-    # load the fitter_fn from app.FITTER_FN
-    __fitter_fn = attr_from_str(app.FITTER_FN)
+    if __backend() == 'numba':
+        return __as_output(__detect_kernel(__dates, __spectra,
+                                           app.MEOW_SIZE, app.PEEK_SIZE),
+                           output)
+
+    # the fitter_fn of app.FITTER_FN, resolved once per process
+    __fitter_fn = fitter()
 
     # call detect and return results as the detections namedtuple
-    return __as_detections(__detect(__dates, __spectra, __fitter_fn,
-                                    app.MEOW_SIZE, app.PEEK_SIZE))
+    return __as_output(__detect(__dates, __spectra, __fitter_fn,
+                                app.MEOW_SIZE, app.PEEK_SIZE,
+                                app.INCREMENTAL_FIT, stats), output)
+
+
+def detect_batch(cube, preprocess=True, output='dict'):
+    """Entry point call to detect change for a batch of pixels
+
+    All pixels are advanced through change detection together, see
+    `ccd.batch` for details. Results are the same as calling detect for
+    each pixel.
+
+    Args:
+        cube: numpy array shaped (pixels, 9, n), each pixel holding the
+              dates, reds, greens, blues, nirs, swir1s, swir2s, thermals
+              and qas rows that detect accepts
+        preprocess: filter each pixel for clear observations within the
+              temperature and saturation range
+        output: 'dict' or 'array', see detect
+
+    Returns:
+        List holding a tuple of ccd.detections, or a structured array, for
+        each pixel
+    """
+
+    # (9, pixels, n) so the filter functions produce an index per pixel
+    __matrix = np.swapaxes(np.asarray(cube), 0, 1)
+
+    if preprocess is True:
+        __criteria = __preprocess_index(__matrix)
+    else:
+        __criteria = np.ones(__matrix.shape[1:], dtype=bool)
+
+    # Pixels without enough observations for any model are triaged here,
+    # before packing and fitting.
+    __viable = np.flatnonzero(__detectable(__matrix[0], __criteria,
+                                           app.MEOW_SIZE))
+    __results = [__segments([], 6, 4) for _ in range(__matrix.shape[1])]
+
+    if len(__viable):
+        __dates, __spectra, __counts = __pack(
+            __matrix[0][__viable],
+            np.swapaxes(__matrix[1:7][:, __viable], 0, 1),
+            __criteria[__viable])
+
+        __fitter_fn = fitter()
+
+        __batch = __detect_batch(__dates, __spectra, __counts, __fitter_fn,
+                                 app.MEOW_SIZE, app.PEEK_SIZE,
+                                 incremental=app.INCREMENTAL_FIT)
+        for ix, results in zip(__viable, __batch):
+            __results[ix] = results
+
+    return [__as_output(results, output) for results in __results]
+
+
+def detect_many(pixels, preprocess=True, executor='serial', workers=None,
+                chunksize=1, ordered=True, output='dict'):
+    """Entry point call to detect change for many pixels
+
+    Args:
+        pixels:     iterable of pixels, each a sequence of the nine arrays
+                    detect accepts (dates, reds, ..., thermals, qas)
+        preprocess: passed through to detect
+        executor:   'serial', 'thread' or 'process', see ccd.executor
+        workers:    number of threads or processes, defaults to the number
+                    of CPUs
+        chunksize:  number of pixels handed to a worker at once
+        ordered:    deliver results in the order of pixels, otherwise as
+                    soon as they complete
+        output:     passed through to detect; 'array' results are much
+                    cheaper to send back from worker processes
+
+    Returns:
+        Generator of (index, detections) pairs, index is the position of
+        the pixel in pixels and detections are what detect returns
+    """
+    return __run(functools.partial(__detect_pixel, preprocess=preprocess,
+                                   output=output),
+                 pixels, executor, workers, chunksize, ordered)
+
+
+def detect_source(source, preprocess=True, output='dict', depth=None,
+                  workers=1, stats=None):
+    """Entry point call to detect change for every block of a data source
+
+    The next blocks are read by reader threads while a block is detected,
+    see ccd.source.prefetch.
+
+    Args:
+        source:     ccd.source.Source, e.g. a ccd.source.DirectorySource
+        preprocess: passed through to detect_batch
+        output:     passed through to detect_batch
+        depth:      number of blocks read ahead, app.PREFETCH_DEPTH if None
+        workers:    number of reader threads
+        stats:      ccd.instrument.Stats to add the number of blocks, the
+                    time blocked on reads (io_wait) and the time spent
+                    detecting blocks (detect_block) to
+
+    Returns:
+        Generator of (key, results) pairs in the order of source.keys(),
+        results are what detect_batch returns for the block
+    """
+    stats = __NULL if stats is None else stats
+    for key, cube in __prefetch(source, depth, workers, stats):
+        with stats.timer('detect_block'):
+            results = detect_batch(cube, preprocess, output)
+        yield key, results
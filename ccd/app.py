@@ -13,6 +13,7 @@ from Flask.
 """
 import logging
 import sys
+import threading
 from cachetools import LRUCache
 
 
@@ -35,7 +36,11 @@ logging.basicConfig(stream=sys.stdout,
 
 
 # configure caching
+# LRUCache isn't thread-safe and detection may run in threads, see
+# ccd.executor; hold cache_lock whenever cache is used, e.g.
+# @cached(cache=app.cache, lock=app.cache_lock)
 cache = LRUCache(maxsize=2000)
+cache_lock = threading.RLock()
 
 ############################
 # Global configuration items
@@ -67,4 +72,55 @@ STABILITY_THRESHOLD = 200.0
 # This is a string.fully.qualified.reference to the fitter function.
 # Cannot import and supply the function directly or we'll get a
 # circular dependency
+#
+# 'ccd.models.lasso.fitted_model' fits each spectrum with sklearn,
+# 'ccd.models.native.fitted_models' fits all spectra at once with NumPy.
 FITTER_FN = 'ccd.models.lasso.fitted_model'
+
+# Fit models from prefix sums of sufficient statistics of the series rather
+# than refitting each window from scratch. Models are then fitted with
+# ccd.models.native whatever FITTER_FN is.
+INCREMENTAL_FIT = False
+
+# Start each fit made while extending a window from the coefficients of the
+# previous one, for fitters that support it (both bundled ones do). Models
+# then differ from refitting from zero within the solver's tolerance.
+WARM_START = False
+
+# Floating point type of design matrices, observations and fits: 'float64',
+# or 'float32' to halve their memory and bandwidth. The time column of
+# float32 matrices counts days from ccd.models.lasso.ORIGIN to keep its
+# precision; reported intercepts are for ordinal days either way. float32
+# results agree with float64 ones within the lasso solver's tolerance.
+# Prefix statistics (INCREMENTAL_FIT, screening) accumulate in float64.
+PRECISION = 'float64'
+
+# Number of start indices initialization screens at once: start indices
+# whose least squares fit is already unstable are passed over without tmask
+# or fitting, see ccd.change.screen. 0 disables screening.
+INITIALIZE_SCREEN = 32
+
+# Backend of ccd.detect: 'python' runs ccd.change; 'numba' runs each pixel
+# as one compiled loop, see ccd.kernel, and falls back to 'python' when numba
+# isn't installed. The numba backend always fits with the
+# ccd.models.native lasso, from zero and in float64.
+DETECT_BACKEND = 'python'
+
+# Number of blocks ccd.detect_source reads ahead of the block being
+# detected, see ccd.source.prefetch. 0 reads each block when it's needed.
+PREFETCH_DEPTH = 2
+
+# Segments a ccd.sink sink buffers before writing them as one batch, and
+# the most memory, in bytes, buffered segments may take before a batch is
+# written regardless.
+SINK_FLUSH_SIZE = 100000
+SINK_MEMORY = 64 * 2 ** 20
+
+# Seconds without a heartbeat after which a ccd.spool claim belongs to a
+# dead worker and its task may be claimed again. Workers beat every third
+# of this.
+SPOOL_TIMEOUT = 300
+
+# Collect counts and timings of every change detection call in the process,
+# see ccd.instrument. Calls given a stats argument are collected regardless.
+INSTRUMENT = False
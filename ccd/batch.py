@@ -0,0 +1,383 @@
+"""Lockstep change detection for a batch of pixels.
+
+The batch module runs the same initialize/extend state machine as
+`ccd.change.detect`, but for many pixels at once. Instead of one Python loop
+per pixel, the `meow_ix` and `end_ix` of every pixel are kept in arrays and
+each step (finding a one year window, tmask, fitting, peeking) is applied to
+all pixels that are still active. Pixels that run out of observations drop
+out of the active set.
+
+Every pixel has its own set of clear observations, so the inputs are padded
+arrays: observations for a pixel are packed at the front of its row and
+`counts` tells how many of them are valid. See `pack` for building these
+arrays from a chip cube.
+
+The segments produced for each pixel are the same as those produced by
+`ccd.change.detect` for that pixel alone.
+"""
+
+import numpy as np
+import ccd.change as change
+import ccd.models.lasso as lasso
+import ccd.models.native as native
+import ccd.tmask as tmask
+from ccd import app
+from ccd import data
+
+log = app.logging.getLogger(__name__)
+
+# States of the per-pixel state machine.
+INITIALIZE = 0
+EXTEND = 1
+DONE = 2
+
+
+def pack(times, observations, criteria):
+    """Move the observations selected by criteria to the front of each row.
+
+    Args:
+        times: (pixels, n) array of ordinal day numbers.
+        observations: (pixels, bands, n) array of spectral values.
+        criteria: (pixels, n) bool array of observations to keep.
+
+    Returns:
+        tuple: packed times, packed observations and the number of valid
+            observations for each pixel. Values past the count are padding
+            and must not be used.
+    """
+    order = np.argsort(~criteria, axis=1, kind='stable')
+    times = np.take_along_axis(times, order, axis=1)
+    observations = np.take_along_axis(observations, order[:, None, :], axis=2)
+    return times, observations, criteria.sum(axis=1)
+
+
+def padded(rows, counts, width, columns):
+    """Stack per pixel matrices into one zero padded array.
+
+    Args:
+        rows: list of (count, columns) matrices, one per pixel.
+        counts: number of rows for each pixel.
+        width: length of the padded time axis.
+        columns: number of columns of each matrix.
+
+    Returns:
+        (pixels, width, columns) array.
+    """
+    result = np.zeros((len(rows), width, columns),
+                      dtype=data.precision())
+    for ix, (row, count) in enumerate(zip(rows, counts)):
+        result[ix, :count] = row
+    return result
+
+
+def window(meow_ix, end_ix, width):
+    """Bool mask of the observations from meow_ix up to and including end_ix.
+
+    Args:
+        meow_ix: (pixels,) start index of each window.
+        end_ix: (pixels,) last index of each window.
+        width: length of the padded time axis.
+
+    Returns:
+        (pixels, width) bool array.
+    """
+    ix = np.arange(width)
+    return (meow_ix[:, None] <= ix) & (ix <= end_ix[:, None])
+
+
+def find_time_index(times, counts, meow_ix, meow_size, day_delta=365):
+    """Find, for each pixel, the index at least day_delta days from meow_ix.
+
+    Vectorized form of `ccd.change.find_time_index`; the search starts at
+    the end of the minimum expected observation window.
+
+    Args:
+        times: (pixels, n) packed ordinal day numbers.
+        counts: (pixels,) number of valid observations.
+        meow_ix: (pixels,) start index of each window.
+        meow_size: offset from meow_ix to begin searching.
+        day_delta: number of days between meow_ix and the time index.
+
+    Returns:
+        (pixels,) array of indices, -1 where no such index exists.
+    """
+    ix = np.arange(times.shape[1])
+    start = np.take_along_axis(times, meow_ix[:, None], axis=1)
+    found = (((times - start) >= day_delta) &
+             (ix >= (meow_ix + meow_size - 1)[:, None]) &
+             (ix < counts[:, None]))
+    return np.where(found.any(axis=1), found.argmax(axis=1), -1)
+
+
+def enough_time(times, counts, meow_ix, day_delta=365):
+    """Vectorized form of `ccd.change.enough_time`."""
+    first = np.take_along_axis(times, meow_ix[:, None], axis=1)[:, 0]
+    last = np.take_along_axis(times, counts[:, None] - 1, axis=1)[:, 0]
+    return (last - first) >= day_delta
+
+
+def tmask_outliers(tmask_matrix, observations, mask, adjusted_rmse,
+                   bands=(1, 4)):
+    """Find outliers in each pixel's window with one batched regression.
+
+    Vectorized form of `ccd.tmask.tmask`: an ordinary least squares fit
+    (with intercept) of the tmask matrix is made for each band in bands,
+    observations whose residual exceeds the adjusted RMSE are outliers.
+
+    Args:
+        tmask_matrix: (pixels, n, 5) robust fit coefficient matrices.
+        observations: (pixels, bands, n) spectral values.
+        mask: (pixels, n) bool array of observations in each window.
+        adjusted_rmse: (pixels, bands) thresholds, paired with bands in
+            order, like `ccd.tmask.tmask`.
+        bands: band indices used for outlier detection.
+
+    Returns:
+        (pixels, n) bool array, True for outliers inside the window.
+    """
+    weight = mask.astype(tmask_matrix.dtype)
+    count = weight.sum(axis=1)
+
+    # Center within the window, as LinearRegression does, then zero out
+    # everything outside of it so the solution only depends on the window.
+    x_mean = np.einsum('pn,pnk->pk', weight, tmask_matrix) / count[:, None]
+    x_centered = tmask_matrix - x_mean[:, None, :]
+    actual = np.swapaxes(observations[:, bands, :], 1,
+                         2).astype(tmask_matrix.dtype)
+    y_mean = np.einsum('pn,pnb->pb', weight, actual) / count[:, None]
+    y_centered = actual - y_mean[:, None, :]
+
+    coefficients = np.matmul(np.linalg.pinv(x_centered * weight[..., None]),
+                             y_centered * weight[..., None])
+    predicted = np.matmul(x_centered, coefficients) + y_mean[:, None, :]
+
+    thresholds = adjusted_rmse[:, None, :len(bands)]
+    outliers = (np.abs(predicted - actual) > thresholds).any(axis=2)
+    return outliers & mask
+
+
+def residuals(model_matrix, observations, coefficients, intercepts):
+    """Difference between predicted and observed values for each pixel.
+
+    Args:
+        model_matrix: (pixels, n, k) lasso coefficient matrices.
+        observations: (pixels, bands, n) spectral values.
+        coefficients: (pixels, bands, k) model coefficients.
+        intercepts: (pixels, bands) model intercepts.
+
+    Returns:
+        (pixels, bands, n) array of residuals.
+    """
+    predicted = np.matmul(coefficients, np.swapaxes(model_matrix, 1, 2))
+    return predicted + intercepts[..., None] - observations
+
+
+def rmse(model_matrix, observations, coefficients, intercepts, mask):
+    """Vectorized form of `ccd.change.rmse` over each pixel's window."""
+    errors = residuals(model_matrix, observations, coefficients, intercepts)
+    squares = np.einsum('pbn,pn->pb', errors ** 2, mask.astype(errors.dtype))
+    return np.sqrt(squares / mask.sum(axis=1)[:, None])
+
+
+def magnitudes(model_matrix, observations, coefficients, intercepts, mask):
+    """Vectorized form of `ccd.change.magnitudes` over each pixel's window."""
+    errors = residuals(model_matrix, observations, coefficients, intercepts)
+    return np.sqrt(np.einsum('pbn,pn->pb', errors ** 2,
+                             mask.astype(errors.dtype)))
+
+
+def detect(times, observations, counts, fitter_fn,
+           meow_size=16, peek_size=3, day_delta=365, incremental=False):
+    """Runs the core change detection algorithm for a batch of pixels.
+
+    The algorithm assumes all pre-processing has been performed on
+    observations and that valid observations are packed at the front of
+    each row (see `pack`).
+
+    Args:
+        times: (pixels, n) array of ordinal day numbers.
+        observations: (pixels, bands, n) array of spectral values.
+        counts: (pixels,) number of valid observations for each pixel.
+        fitter_fn: a function used to fit observation values and
+            acquisition dates for each spectra.
+        meow_size: minimum expected observation window needed to
+            produce a fit.
+        peek_size: number of observations to consider when detecting
+            a change.
+        day_delta: minimum number of days in an initial window.
+        incremental: fit, and compute errors and magnitudes, from prefix
+            statistics of every pixel, see `ccd.change.detect`. Fits for
+            all pixels are then made together by one solver call.
+
+    Returns:
+        list: for each pixel, a structured array of segments like the
+            results of `ccd.change.detect`.
+    """
+    counts = np.asarray(counts)
+    observations = np.asarray(observations, dtype=data.precision())
+    pixels, bands, width = observations.shape
+    log.debug("build batch change model – pixels: {0}, bands: {1}, "
+              "width: {2}".format(pixels, bands, width))
+
+    # Per pixel constants: adjusted RMSE and coefficient matrices, padded
+    # to the same width.
+    adjusted_rmse = np.zeros((pixels, bands))
+    model_rows, tmask_rows = [], []
+    for ix in range(pixels):
+        count = counts[ix]
+        adjusted_rmse[ix] = np.median(np.absolute(observations[ix, :, :count]),
+                                      1) * app.T_CONST
+        model_rows.append(lasso.coefficient_matrix(times[ix, :count]))
+        tmask_rows.append(tmask.robust_fit_coefficient_matrix(
+            times[ix, :count]))
+    model_matrix = padded(model_rows, counts, width, 4)
+    tmask_matrix = padded(tmask_rows, counts, width, 5)
+
+    if incremental:
+        prefix = native.prefix_statistics(model_matrix, observations)
+
+    # State of each pixel. The end index is -1 until initialization finds
+    # one, models are None until the first fit.
+    state = np.full(pixels, INITIALIZE)
+    meow_ix = np.zeros(pixels, dtype=int)
+    end_ix = np.full(pixels, -1)
+    models = [None] * pixels
+    coefficients = np.zeros((pixels, bands, model_matrix.shape[2]),
+                            dtype=model_matrix.dtype)
+    intercepts = np.zeros((pixels, bands), dtype=model_matrix.dtype)
+    errors = np.zeros((pixels, bands))
+    magnitudes_ = [None] * pixels
+    results = [[] for _ in range(pixels)]
+
+    def fit(ix, stop, warm=False):
+        """Fit models for pixels ix over meow_ix up to (excluding) stop,
+        starting from their current coefficients when warm."""
+        if incremental:
+            stats = native.window(prefix, meow_ix[ix], stop, (ix,))
+            coefficients[ix], intercepts[ix], iterations = \
+                native.fit_statistics(stats, initial=coefficients[ix]
+                                      if warm else None)
+            for p, n_iter in zip(ix, iterations):
+                models[p] = native.linear_models(coefficients[p],
+                                                 intercepts[p], n_iter)
+            return
+        for p, s in zip(ix, stop):
+            period = times[p, meow_ix[p]:s]
+            spectra = observations[p, :, meow_ix[p]:s]
+            models[p] = change.fit(fitter_fn, period, spectra,
+                                   model_matrix[p, meow_ix[p]:s],
+                                   coefficients[p] if warm else None)
+            coefficients[p], intercepts[p] = data.model_parameters(models[p])
+
+    def start(ix):
+        """Begin initialization at meow_ix, or finish if it can't be done."""
+        ok = (meow_ix[ix] + meow_size) <= counts[ix]
+        ok[ok] = enough_time(times[ix[ok]], counts[ix[ok]],
+                             meow_ix[ix[ok]], day_delta)
+        state[ix] = np.where(ok, INITIALIZE, DONE)
+        end_ix[ix] = -1
+        for p in ix:
+            models[p] = None
+
+    def close(ix):
+        """Record a segment for pixels ix and start over from end_ix."""
+        for p in ix:
+            result = data.segment(times[p, meow_ix[p]], times[p, end_ix[p]],
+                                  end_ix[p] - meow_ix[p] + 1,
+                                  coefficients[p].copy(),
+                                  lasso.ordinal_intercepts(
+                                      coefficients[p], intercepts[p],
+                                      model_matrix.dtype),
+                                  errors[p].copy(), magnitudes_[p])
+            results[p].append(result)
+        meow_ix[ix] = end_ix[ix]
+        start(ix)
+
+    def begin_extension(ix):
+        """Move initialized pixels to extension, or close them if there
+        are not enough observations left to peek at."""
+        short = (end_ix[ix] + peek_size) > counts[ix]
+        for p in ix:
+            magnitudes_[p] = None
+        close(ix[short])
+        state[ix[~short]] = EXTEND
+
+    start(np.arange(pixels))
+
+    while (state != DONE).any():
+
+        # Initialization: one candidate start index per pixel per step.
+        ix = np.flatnonzero(state == INITIALIZE)
+        if ix.size:
+            # Out of candidates; initialization gives up with whatever the
+            # last attempt produced.
+            exhausted = (meow_ix[ix] + meow_size) > counts[ix]
+            fitted = np.array([models[p] is not None for p in ix], dtype=bool)
+            state[ix[exhausted & ~fitted]] = DONE
+            begin_extension(ix[exhausted & fitted])
+            ix = ix[~exhausted]
+
+            found = find_time_index(times[ix], counts[ix], meow_ix[ix],
+                                    meow_size, day_delta)
+            state[ix[found < 0]] = DONE
+            ix, found = ix[found >= 0], found[found >= 0]
+            end_ix[ix] = found
+
+            # Count outliers in each window; too many means try again.
+            mask = window(meow_ix[ix], end_ix[ix], width)
+            outliers = tmask_outliers(tmask_matrix[ix], observations[ix],
+                                      mask, adjusted_rmse[ix])
+            kept = mask & ~outliers
+            kept_count = kept.sum(axis=1)
+            kept_any = kept_count > 0
+            first = np.where(kept_any, kept.argmax(axis=1), 0)
+            last = np.where(kept_any, width - 1 - kept[:, ::-1].argmax(axis=1),
+                            0)
+            span = (np.take_along_axis(times[ix], last[:, None], 1) -
+                    np.take_along_axis(times[ix], first[:, None], 1))[:, 0]
+            retry = (kept_count < meow_size) | (span < day_delta)
+            meow_ix[ix[retry]] += 1
+            ix, mask = ix[~retry], mask[~retry]
+
+            # Fit each remaining window and check the models are stable.
+            fit(ix, end_ix[ix] + 1)
+            if incremental:
+                stats = native.window(prefix, meow_ix[ix], end_ix[ix] + 1,
+                                      (ix,))
+                squares = native.residual_norms(stats, coefficients[ix],
+                                                intercepts[ix])
+                errors[ix] = np.sqrt(squares / stats.samples[:, None])
+            else:
+                errors[ix] = rmse(model_matrix[ix], observations[ix],
+                                  coefficients[ix], intercepts[ix], mask)
+            stable = (errors[ix] < app.STABILITY_THRESHOLD).all(axis=1)
+            meow_ix[ix[~stable]] += 1
+            begin_extension(ix[stable])
+
+        # Extension: peek past the end of each window.
+        ix = np.flatnonzero(state == EXTEND)
+        if ix.size:
+            exhausted = (end_ix[ix] + peek_size) > counts[ix]
+            close(ix[exhausted])
+            ix = ix[~exhausted]
+
+            peek_ix = end_ix[ix] + peek_size
+            if incremental:
+                stats = native.window(prefix, meow_ix[ix], peek_ix, (ix,))
+                mags = np.sqrt(native.residual_norms(stats, coefficients[ix],
+                                                     intercepts[ix]))
+            else:
+                mask = window(meow_ix[ix], peek_ix - 1, width)
+                mags = magnitudes(model_matrix[ix], observations[ix],
+                                  coefficients[ix], intercepts[ix], mask)
+            for p, m in zip(ix, mags):
+                magnitudes_[p] = list(m)
+            accurate = (mags < 0.99).all(axis=1)
+            close(ix[~accurate])
+            ix, peek_ix = ix[accurate], peek_ix[accurate]
+            fit(ix, peek_ix, app.WARM_START)
+            end_ix[ix] += 1
+
+    log.debug("batch change detection complete")
+    return [data.segments(rows, bands, model_matrix.shape[2])
+            for rows in results]
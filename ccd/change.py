@@ -23,33 +23,111 @@ For more information please refer to the `CCDC Algorithm Description Document`.
    http://landsat.usgs.gov/documents/ccdc_add.pdf
 """
 
+import collections
 import numpy as np
 import ccd.models.lasso as lasso
+import ccd.models.native as native
 import ccd.tmask as tmask
 from ccd import app
+from ccd import data
+from ccd import instrument
 
 log = app.logging.getLogger(__name__)
 
 
+def fit(fitter_fn, times, observations, matrix=None, initial=None):
+    """Fit a model for each spectrum in observations.
+
+    Args:
+        fitter_fn: function used to model observations. It is called once
+            for each spectrum, unless it has a true `vectorized` attribute,
+            in which case it is called once with every spectrum and returns
+            a list of models. A fitter with a `from_matrix` attribute is
+            given rows of the design matrix instead of times, by calling
+            that attribute the same way, when matrix is given. A fitter
+            with a true `warm_start` attribute is also given initial, as
+            an `initial` argument: every spectrum's coefficients when
+            vectorized, otherwise those of the spectrum being fitted.
+        times: list of ordinal day numbers relative to some epoch,
+            the particular epoch does not matter.
+        observations: spectral values, list of spectra -> values
+        matrix: rows of ccd.models.lasso.coefficient_matrix for times,
+            usually a view of the matrix of the whole series.
+        initial: (spectra, k) coefficients to start from, e.g. those of
+            the models of a slightly smaller window. Ignored by fitters
+            that can't start from given coefficients.
+
+    Returns:
+        list: fitted model for each spectrum.
+    """
+    from_matrix = getattr(fitter_fn, 'from_matrix', None)
+    if matrix is not None and from_matrix is not None:
+        fitter_fn, times = from_matrix, matrix
+    vectorized = getattr(fitter_fn, 'vectorized', False)
+    if initial is not None and getattr(fitter_fn, 'warm_start', False):
+        if vectorized:
+            return fitter_fn(times, observations, initial=initial)
+        return [fitter_fn(times, spectrum, initial=start)
+                for spectrum, start in zip(observations, initial)]
+    if vectorized:
+        return fitter_fn(times, observations)
+    return [fitter_fn(times, spectrum) for spectrum in observations]
+
+
+def window_residuals(prefix, models, meow_ix, stop_ix):
+    """Sum of squared residuals of each model over a window.
+
+    Args:
+        prefix: ccd.models.native prefix statistics of the series.
+        models: ccd.data.Models, corresponds to observation spectra.
+        meow_ix: start index of time/observation window
+        stop_ix: end index (exclusive) of time/observation window
+
+    Returns:
+        numpy array: sum of squared residuals for each model, computed in
+        time that does not depend on the size of the window.
+    """
+    stats = native.window(prefix, meow_ix, stop_ix)
+    return native.residual_norms(stats, models.coefficients,
+                                 models.intercepts)
+
+
+def fit_window(prefix, meow_ix, stop_ix, initial=None):
+    """Fit a model for each spectrum over a window, see `window_residuals`.
+
+    Models are fitted with ccd.models.native from prefix statistics,
+    starting from initial coefficients when given.
+
+    Returns:
+        ccd.data.Models
+    """
+    stats = native.window(prefix, meow_ix, stop_ix)
+    return data.Models(*native.fit_statistics(stats, initial=initial))
+
+
+def count_iterations(stats, models, *names):
+    """Add the solver iterations of models to each of the stats names."""
+    if models.iterations is not None:
+        for name in names:
+            stats.count(name, int(np.sum(models.iterations)))
+
+
 def rmse(models, coefficient_matrix, observations):
     """Calculate RMSE for all models; used to determine if models are stable.
 
     Args:
-        models: fitted models, used to predict values, corresponds to
-            observation spectra.
-        coefficient_matrix: TODO
+        models: ccd.data.Models, or fitted models, used to predict values,
+            corresponds to observation spectra.
+        coefficient_matrix: design matrix rows of the observations
         observations: list of spectra corresponding to models
 
     Returns:
-        list: RMSE for each model.
+        numpy array: RMSE for each model.
     """
-    errors = []
-    for model, observed in zip(models, observations):
-        predictions = model.predict(coefficient_matrix)
-        # TODO (jmorton): VERIFY CORRECTNESS
-        error = (np.linalg.norm(predictions - observed) /
-                 np.sqrt(len(predictions)))
-        errors.append(error)
+    # TODO (jmorton): VERIFY CORRECTNESS
+    errors = (data.residual_norms(data.models(models), coefficient_matrix,
+                                  observations) /
+              np.sqrt(len(coefficient_matrix)))
     log.debug("calculate RMSE")
     return errors
 
@@ -81,23 +159,17 @@ def magnitudes(models, coefficient_matrix, observations):
     and observed values.
 
     Args:
-        models: fitted models, used to predict values.
+        models: ccd.data.Models, or fitted models, used to predict values.
         coefficients: pre-calculated model coefficient matrix.
         observations: spectral values, list of spectra -> values
-        threshold: tolerance between detected values and
-            predicted ones.
 
     Returns:
-        list: magnitude of change for each model.
+        numpy array: magnitude of change for each model.
     """
-    magnitudes = []
-
-    for model, observed in zip(models, observations):
-        predicted = model.predict(coefficient_matrix)
-        # TODO (jmorton): VERIFY CORRECTNESS
-        # This approach matches what is done if 2-norm (largest sing. value)
-        magnitude = np.linalg.norm((predicted-observed), ord=2)
-        magnitudes.append(magnitude)
+    # TODO (jmorton): VERIFY CORRECTNESS
+    # This approach matches what is done if 2-norm (largest sing. value)
+    magnitudes = data.residual_norms(data.models(models), coefficient_matrix,
+                                     observations)
     log.debug("calculate magnitudes".format(magnitudes))
     return magnitudes
 
@@ -133,7 +205,39 @@ def end_index(meow_ix, meow_size):
     return meow_ix + meow_size - 1
 
 
-def find_time_index(times, meow_ix, meow_size, day_delta=365):
+def time_index(times, meow_size, day_delta=365):
+    """Find the index of `find_time_index` for every start index at once.
+
+    For ascending times, each index comes from one binary search; other
+    times are searched one start index at a time.
+
+    Args:
+        times: list of ordinal day numbers relative to some epoch,
+            the particular epoch does not matter.
+        meow_size: relative number of observations after each start index
+            to begin searching for a time index
+        day_delta: number of days difference between a start index and
+            its time index
+
+    Returns:
+        numpy array: time index of each start index that has enough
+            samples after it, -1 where there isn't enough time.
+    """
+    times = np.asarray(times)
+    starts = np.arange(max(len(times) - meow_size + 1, 0))
+    if not len(starts):
+        return starts
+    if (np.diff(times) >= 0).all():
+        ends = np.maximum(np.searchsorted(times, times[starts] + day_delta),
+                          end_index(starts, meow_size))
+        ends[(times[-1] - times[starts]) < day_delta] = -1
+        return ends
+    found = [find_time_index(times, ix, meow_size, day_delta)
+             for ix in starts]
+    return np.array([-1 if ix is None else ix for ix in found], dtype=int)
+
+
+def find_time_index(times, meow_ix, meow_size, day_delta=365, ends=None):
     """Find index in times at least one year from time at meow_ix.
     Args:
         times: list of ordinal day numbers relative to some epoch,
@@ -144,14 +248,19 @@ def find_time_index(times, meow_ix, meow_size, day_delta=365):
             begin searching for a time index
         day_delta: number of days difference between meow_ix and
             time index
+        ends: indices from `time_index` for the same meow_size and
+            day_delta, looked up instead of searching times.
     Returns:
         integer: array index of time at least one year from meow_ix,
             or None if it can't be found.
     """
+    if ends is not None:
+        end_ix = ends[meow_ix] if meow_ix < len(ends) else -1
+        return None if end_ix < 0 else int(end_ix)
 
     # If the last time is less than a year, then iterating through
     # times to find an index is futile.
-    if not enough_time(times, meow_ix, day_delta=365):
+    if not enough_time(times, meow_ix, day_delta):
         log.debug("insufficient time ({0} days) after \
                    times[{1}]:{2}".format(day_delta, meow_ix, times[meow_ix]))
         return None
@@ -173,7 +282,7 @@ def find_time_index(times, meow_ix, meow_size, day_delta=365):
     return end_ix
 
 
-def enough_samples(times, meow_ix, meow_size):
+def enough_samples(times, meow_ix, meow_size, ends=None):
     """Change detection requires a minimum number of samples (as specified
     by meow size).
 
@@ -185,15 +294,19 @@ def enough_samples(times, meow_ix, meow_size):
         meow_ix: start index of time/observation window, used with meow_size
             determine if sufficient observations exist.
         meow_size: offset of last time from meow_ix
+        ends: indices from `time_index` for the same meow_size, which
+            has one for each start index with enough samples.
 
     Returns:
         bool: True if times contains enough samples after meow_ix,
         False otherwise.
     """
+    if ends is not None:
+        return meow_ix < len(ends)
     return (meow_ix+meow_size) <= len(times)
 
 
-def enough_time(times, meow_ix, day_delta=365):
+def enough_time(times, meow_ix, day_delta=365, ends=None):
     """Change detection requires a minimum amount of time (as specified by
     day_delta).
 
@@ -207,15 +320,94 @@ def enough_time(times, meow_ix, day_delta=365):
             get a value from time for comparison.
         day_delta: minimum difference between time at meow_ix and most
             recent observation.
+        ends: indices from `time_index` for the same day_delta, -1 where
+            there isn't enough time; meow_ix must have enough samples.
 
     Returns:
         list: RMSE for each model.
     """
+    if ends is not None:
+        return ends[meow_ix] >= 0
     return (times[-1]-times[meow_ix]) >= day_delta
 
 
+# Relative slack on the stability threshold when screening, far above the
+# rounding error of least squares residuals computed from prefix sums.
+SCREEN_MARGIN = 1e-6
+
+# Machine epsilons of data.precision() added to SCREEN_MARGIN. Models of
+# initialization are fitted, and their RMSE computed, in that precision,
+# with rounding that builds up over the observations and columns of a
+# window; in float32 it is far above SCREEN_MARGIN.
+SCREEN_EPSILONS = 1024
+
+
+def screen_margin(dtype=None):
+    """Relative slack on the stability threshold when screening.
+
+    Args:
+        dtype: floating point type models are fitted in, data.precision()
+            if None
+
+    Returns:
+        float
+    """
+    dtype = data.precision() if dtype is None else np.dtype(dtype)
+    return SCREEN_MARGIN + SCREEN_EPSILONS * float(np.finfo(dtype).eps)
+
+
+def screen(prefix, times, meow_ix, meow_size, day_delta=365,
+           count=app.INITIALIZE_SCREEN, threshold=app.STABILITY_THRESHOLD,
+           ends=None):
+    """Screen consecutive start indices of initialization in one pass.
+
+    The RMSE of a least squares fit over a window is a lower bound for that
+    of any model fitted by initialization, which is linear in the same
+    columns. Where the bound already reaches the stability threshold, the
+    window can't be stable and initialization can pass over its start index
+    without tmask or fitting.
+
+    Args:
+        prefix: ccd.models.native prefix statistics of the series.
+        times: list of ordinal day numbers.
+        meow_ix: first start index to screen.
+        meow_size: offset from meow_ix, determines initial window size
+        day_delta: minimum number of days in an initial window.
+        count: maximum number of start indices to screen.
+        threshold: stability threshold of the RMSE.
+        ends: indices from `time_index`, see `find_time_index`.
+
+    Returns:
+        dict: start index -> (end index, True if it can't be stable). A
+            start index without an end index maps to (None, False) and is
+            the last one.
+    """
+    starts, stops = [], []
+    for ix in range(meow_ix, min(meow_ix + count, len(times) - meow_size + 1)):
+        end_ix = find_time_index(times, ix, meow_size, day_delta, ends)
+        if end_ix is None:
+            break
+        starts.append(ix)
+        stops.append(end_ix + 1)
+
+    screened = {}
+    if starts:
+        stats = native.window(prefix, np.array(starts), np.array(stops))
+        squares = native.least_squares_norms(stats)
+        bounds = np.sqrt(squares / stats.samples[:, None])
+        margin = screen_margin()
+        unstable = (bounds >= threshold * (1 + margin)).any(axis=1)
+        screened = dict(zip(starts, zip([stop - 1 for stop in stops],
+                                        unstable)))
+    if len(starts) < count:
+        screened[meow_ix + len(starts)] = (None, False)
+    return screened
+
+
 def initialize(times, observations, fitter_fn,  model_matrix, tmask_matrix,
-               meow_ix, meow_size, adjusted_rmse, day_delta=365):
+               meow_ix, meow_size, adjusted_rmse, day_delta=365,
+               prefix=None, stats=instrument.NULL, screen_prefix=None,
+               ends=None):
     """Determine the window indices, models, and errors for observations.
 
     Args:
@@ -223,26 +415,84 @@ def initialize(times, observations, fitter_fn,  model_matrix, tmask_matrix,
             the particular epoch does not matter.
         observations: spectral values, list of spectra -> values
         model_matrix: TODO
-        tmask_matrix: TODO
+        tmask_matrix: robust fit coefficient matrix of times, its window
+            bases are cached, see `ccd.tmask.basis`.
         meow_ix: start index of time/observation window
         meow_size: offset from meow_ix, determines initial window size
         day_delta: minimum difference between time at meow_ix and most
             recent observation
+        prefix: ccd.models.native prefix statistics of the series; when
+            given, models and errors are computed from them instead of
+            fitter_fn and the observations.
+        stats: ccd.instrument.Stats counting tmask calls, fits and shifts.
+        screen_prefix: ccd.models.native prefix statistics of the series;
+            when given, start indices are screened app.INITIALIZE_SCREEN
+            at a time and those that can't be stable are passed over, see
+            `screen`. The start index chosen is the same either way.
+        ends: time index of every start index from `time_index` for the
+            same meow_size and day_delta, computed when not given.
 
     Returns:
         tuple: start, end, models, errors
     """
+    if ends is None:
+        ends = time_index(times, meow_size, day_delta)
 
     # Guard...
-    if not enough_samples(times, meow_ix, meow_size):
+    if not enough_samples(times, meow_ix, meow_size, ends):
         log.debug("failed, insufficient clear observations")
         return meow_ix, None, None, None
 
-    if not enough_time(times, meow_ix, day_delta):
+    if not enough_time(times, meow_ix, day_delta, ends):
         log.debug("failed, insufficient time range")
         return meow_ix, None, None, None
 
-    while (meow_ix+meow_size) <= len(times):
+    series = tmask.series_key(times, tmask_matrix.dtype)
+
+    def tmasked(meow_ix, end_ix):
+        # Count outliers in the window, too many outliers and the window
+        # is passed over.
+        kept = np.flatnonzero(
+            tmask.tmask_index(observations[:, meow_ix:end_ix+1],
+                              tmask_matrix[meow_ix:end_ix+1, :],
+                              adjusted_rmse, stats=stats,
+                              key=(series, meow_ix, end_ix+1))) + meow_ix
+        return ((len(kept) < meow_size) or
+                ((times[kept[-1]] - times[kept[0]]) < day_delta))
+
+    def fitted(meow_ix, end_ix):
+        # Each spectra, although analyzed independently, all share
+        # a common time-frame. Consequently, it doesn't make sense
+        # to analyze one spectrum in it's entirety.
+        period = times[meow_ix:end_ix+1]
+        matrix = model_matrix[meow_ix:end_ix+1]
+        spectra = observations[:, meow_ix:end_ix+1]
+        stats.count('fits')
+        with stats.timer('fit'):
+            if prefix is None:
+                models = data.models(fit(fitter_fn, period, spectra,
+                                         matrix))
+            else:
+                models = fit_window(prefix, meow_ix, end_ix+1)
+        count_iterations(stats, models, 'iterations')
+        log.debug("update change models")
+
+        # TODO (jmorton): The error of a model is calculated during
+        # initialization, but isn't subsequently updated. Determine
+        # if this is correct.
+        if prefix is None:
+            errors_ = rmse(models, matrix, spectra)
+        else:
+            squares = window_residuals(prefix, models, meow_ix, end_ix+1)
+            errors_ = np.sqrt(squares / len(period))
+        return models, errors_
+
+    models = errors_ = None
+    screened = {}
+    # Windows passed over by screening since the last fit.
+    passed = []
+
+    while enough_samples(times, meow_ix, meow_size, ends):
         log.debug("initialize from {0}..{1}".format(meow_ix,
                                                     meow_ix+meow_size))
 
@@ -251,47 +501,53 @@ def initialize(times, observations, fitter_fn,  model_matrix, tmask_matrix,
         # will increment if the model isn't stable, incrementing
         # the window of in lock-step does not guarantee a 1-year+
         # time-range.
-        end_ix = find_time_index(times, meow_ix, meow_size, day_delta)
+        if screen_prefix is None:
+            end_ix, unstable = (find_time_index(times, meow_ix, meow_size,
+                                                day_delta, ends), False)
+        else:
+            if meow_ix not in screened:
+                screened = screen(screen_prefix, times, meow_ix, meow_size,
+                                  day_delta, app.INITIALIZE_SCREEN,
+                                  ends=ends)
+            end_ix, unstable = screened[meow_ix]
         if end_ix is None:
             break
 
-        # Count outliers in the window, if there are too many outliers then
-        # try again.
-        times_, observations_ = tmask.tmask(times[meow_ix:end_ix+1],
-                                            observations[:, meow_ix:end_ix+1],
-                                            tmask_matrix[meow_ix:end_ix+1, :],
-                                            adjusted_rmse)
+        if unstable:
+            log.debug("continue, least squares fit is unstable")
+            stats.count('screened')
+            stats.count('shifts')
+            passed.append((meow_ix, end_ix))
+            meow_ix += 1
+            continue
 
-        if (len(times_) < meow_size) or ((times_[-1] - times_[0]) < day_delta):
-            log.debug("continue, not enough observations \
-                       ({0}) after tmask".format(len(times_)))
+        if tmasked(meow_ix, end_ix):
+            log.debug("continue, not enough observations after tmask")
+            stats.count('shifts')
             meow_ix += 1
             continue
 
-        # Each spectra, although analyzed independently, all share
-        # a common time-frame. Consequently, it doesn't make sense
-        # to analyze one spectrum in it's entirety.
-        period = times[meow_ix:end_ix+1]
-        matrix = model_matrix[meow_ix:end_ix+1]
-        spectra = observations[:, meow_ix:end_ix+1]
-        models = [fitter_fn(period, spectrum) for spectrum in spectra]
-        log.debug("update change models")
-
-        # TODO (jmorton): The error of a model is calculated during
-        # initialization, but isn't subsequently updated. Determine
-        # if this is correct.
-        errors_ = rmse(models, matrix, spectra)
+        models, errors_ = fitted(meow_ix, end_ix)
+        passed = []
 
         # If a model is not stable, then it is possible that a disturbance
         # exists somewhere in the observation window. The window shifts
         # forward in time, and begins initialization again.
         if not stable(errors_):
             log.debug("unstable model, shift start time and retry")
+            stats.count('shifts')
             meow_ix += 1
             continue
         else:
             log.debug("stable model, done.")
             break
+    else:
+        # Out of start indices: the models returned are those of the last
+        # window that passed tmask, which may have been passed over.
+        for window in reversed(passed):
+            if not tmasked(*window):
+                models, errors_ = fitted(*window)
+                break
 
     log.debug("initialize complete, meow_ix: {0}, end_ix: {1}".format(meow_ix,
                                                                       end_ix))
@@ -299,9 +555,15 @@ def initialize(times, observations, fitter_fn,  model_matrix, tmask_matrix,
 
 
 def extend(times, observations, coefficients,
-           meow_ix, end_ix, peek_size, fitter_fn, models):
+           meow_ix, end_ix, peek_size, fitter_fn, models, prefix=None,
+           stats=instrument.NULL):
     """Increase observation window until change is detected.
 
+    When prefix statistics are given, magnitudes and updated models are
+    computed from the statistics of the window using `ccd.models.native`,
+    regardless of fitter_fn, so each step costs the same however long the
+    window is.
+
     Args:
         times: list of ordinal day numbers relative to some epoch,
             the particular epoch does not matter.
@@ -311,9 +573,10 @@ def extend(times, observations, coefficients,
         end_ix: end index of time/observation window
         peek_size: looked ahead for detecting change
         fitter_fn: function used to model observations
-        models: previously generated models, used to calculate magnitude
-        day_delta: minimum difference between time at meow_ix and most
-            recent observation
+        models: ccd.data.Models generated previously, used to calculate
+            magnitude
+        prefix: ccd.models.native prefix statistics of the series.
+        stats: ccd.instrument.Stats counting fits and extension steps.
 
     Returns:
         tuple: end index, models, and change magnitude.
@@ -346,13 +609,31 @@ def extend(times, observations, coefficients,
         coefficient_slice = coefficients[meow_ix:peek_ix]
         spectra_slice = observations[:, meow_ix:peek_ix]
 
-        magnitudes_ = magnitudes(models, coefficient_slice, spectra_slice)
+        if prefix is None:
+            magnitudes_ = magnitudes(models, coefficient_slice, spectra_slice)
+        else:
+            squares = window_residuals(prefix, models, meow_ix, peek_ix)
+            magnitudes_ = np.sqrt(squares)
+
         if accurate(magnitudes_):
             log.debug("errors below threshold {0}..{1}+{2}".format(meow_ix,
                                                                    end_ix,
                                                                    peek_size))
-            models = [fitter_fn(time_slice, spectrum) for spectrum in spectra_slice]
+            # The window grew by one observation, so the current models
+            # are a close starting point for the new ones.
+            initial = models.coefficients if app.WARM_START else None
+            stats.count('fits')
+            with stats.timer('fit'):
+                if prefix is None:
+                    models = data.models(fit(fitter_fn, time_slice,
+                                             spectra_slice,
+                                             coefficient_slice, initial))
+                else:
+                    models = fit_window(prefix, meow_ix, peek_ix, initial)
+            count_iterations(stats, models, 'iterations',
+                             'extension_iterations')
             log.debug("change model updated")
+            stats.count('extensions')
             end_ix += 1
         else:
             log.debug("errors above threshold – change detected {0}..{1}+{2}".format(meow_ix, end_ix, peek_size))
@@ -363,8 +644,141 @@ def extend(times, observations, coefficients,
     return end_ix, models, magnitudes_
 
 
+def run(times, observations, fitter_fn, model_matrix, tmask_matrix,
+        adjusted_rmse, meow_size, peek_size, prefix=None,
+        stats=instrument.NULL, meow_ix=0, end_ix=None, models=None,
+        errors_=None, magnitudes_=None, screen_prefix=None):
+    """Initialize and extend segments from meow_ix to the end of the series.
+
+    A segment is closed once extension detects a change; more observations
+    can't alter it. What follows the last closed segment is open: either a
+    segment that ran out of observations to extend with, or a start index
+    that initialization hasn't found a stable model for yet.
+
+    Args:
+        times: list of ordinal day numbers.
+        observations: spectral values, list of spectra -> values
+        fitter_fn: function used to model observations
+        model_matrix: lasso coefficient matrix of times
+        tmask_matrix: robust fit coefficient matrix of times
+        adjusted_rmse: tmask thresholds for each spectrum
+        meow_size: minimum expected observation window needed to
+            produce a fit.
+        peek_size: number of observations to consider when detecting
+            a change.
+        prefix: ccd.models.native prefix statistics of the series, see
+            `detect`.
+        stats: ccd.instrument.Stats for the counts and timings.
+        meow_ix: start index of the first segment.
+        end_ix: end index of the first segment when its extension is to
+            be continued with models and errors_, None to initialize it.
+        models: ccd.data.Models of the first segment, when end_ix is given.
+        errors_: errors of the first segment, when end_ix is given.
+        magnitudes_: last magnitudes of the first segment, when end_ix is
+            given.
+        screen_prefix: prefix statistics for screening start indices, see
+            `initialize`.
+
+    Returns:
+        tuple: segment rows (see ccd.data.segment), the number of leading
+            rows that are closed, and the open part as a (meow_ix, end_ix,
+            models, errors, magnitudes) tuple, end_ix None unless extension
+            is to be continued.
+    """
+    results = []
+    closed = None
+    open_part = (meow_ix, None, None, None, None)
+    ends = time_index(times, meow_size)
+
+    # Only build models as long as sufficient data exists. The observation
+    # window starts at meow_ix and is fixed until the change model no longer
+    # fits new observations, i.e. a change is detected. The meow_ix updated
+    # at the end of each iteration using an end index, so it is possible
+    # it will become None.
+    while (meow_ix is not None) and (meow_ix+meow_size) <= len(times):
+
+        # Step 1: Initialize -- find an initial stable time-frame, unless
+        # the extension of a previous call is continued.
+        continued = end_ix is not None
+        if not continued:
+            log.debug("initialize change model")
+            with stats.timer('initialize'):
+                meow_ix, end_ix, models, errors_ = initialize(
+                    times, observations, fitter_fn, model_matrix,
+                    tmask_matrix, meow_ix, meow_size, adjusted_rmse,
+                    prefix=prefix, stats=stats,
+                    screen_prefix=screen_prefix, ends=ends)
+        initialized = ((end_ix is not None) and
+                       (meow_ix+meow_size) <= len(times))
+
+        # Step 2: Extension -- expand time-frame until a change is detected.
+        log.debug("extend change model")
+        with stats.timer('extend'):
+            end_ix, models, extended = extend(
+                times, observations, model_matrix, meow_ix, end_ix,
+                peek_size, fitter_fn, models, prefix, stats=stats)
+        # A continued extension without new observations to peek at keeps
+        # the magnitudes it had.
+        if extended is not None or not continued:
+            magnitudes_ = extended
+
+        # After initialization and extension, the change models for each
+        # spectra are complete for a period of time. If meow_ix and end_ix
+        # are not present, then not enough observations exist for a useful
+        # model to be produced, so nothing is appened to results.
+        if (meow_ix is not None) and (end_ix is not None):
+            result = data.segment(times[meow_ix], times[end_ix],
+                                  end_ix - meow_ix + 1,
+                                  models.coefficients,
+                                  lasso.ordinal_intercepts(
+                                      models.coefficients, models.intercepts,
+                                      model_matrix.dtype),
+                                  errors=errors_, magnitudes=magnitudes_)
+            results.append(result)
+
+        # Everything up to the first segment that isn't closed is final.
+        if closed is None:
+            if not initialized:
+                closed = len(results)
+                open_part = (meow_ix, None, None, None, None)
+                if results and end_ix is not None:
+                    closed -= 1
+            elif (end_ix+peek_size) > len(times):
+                # Extension ran out of observations, not into a change.
+                closed = len(results) - 1
+                open_part = (meow_ix, end_ix, models, errors_, magnitudes_)
+            else:
+                open_part = (end_ix, None, None, None, None)
+
+        log.debug("accumulate results, {} so far".format(len(results)))
+        # Step 4: Iterate. The meow_ix is moved to the end of the current
+        # timeframe and a new model is generated. It is possible for end_ix
+        # to be None, in which case iteration stops.
+        meow_ix, end_ix = end_ix, None
+
+    if closed is None:
+        closed = len(results)
+    return results, closed, open_part
+
+
+def __instrumented(stats):
+    """Stats for one call, NULL when nothing is collected."""
+    if stats is not None or app.INSTRUMENT:
+        return instrument.Stats()
+    return instrument.NULL
+
+
+def __collect(call_stats, stats, segments):
+    """Add the counts and timings of a call to stats and process totals."""
+    if call_stats is not instrument.NULL:
+        call_stats.count('segments', segments)
+        instrument.aggregate(call_stats)
+        if stats is not None:
+            stats.merge(call_stats)
+
+
 def detect(times, observations, fitter_fn,
-           meow_size=16, peek_size=3):
+           meow_size=16, peek_size=3, incremental=False, stats=None):
     """Runs the core change detection algorithm.
 
     The algorithm assumes all pre-processing has been performed on
@@ -381,71 +795,217 @@ def detect(times, observations, fitter_fn,
             produce a fit.
         peek_size: number of observations to consider when detecting
             a change.
+        incremental: compute models, errors and magnitudes from prefix
+            sums of the sufficient statistics of the series, so each
+            window costs the same however long it is. Models are fitted
+            with ccd.models.native regardless of fitter_fn.
+        stats: ccd.instrument.Stats to add the counts and timings of this
+            call to. They are collected when stats is given or
+            app.INSTRUMENT is set, and also added to the process totals.
 
     Returns:
-        list: Change models for each observation of each spectra.
+        numpy structured array with a row for each segment, see
+        ccd.data.segment_dtype.
     """
+    model_matrix, _, _, results, _, _ = __detect(times, observations,
+                                                 fitter_fn, meow_size,
+                                                 peek_size, incremental,
+                                                 stats)
+    return data.segments(results, len(observations), model_matrix.shape[1])
+
+
+# State of a resumable detection, see `start` and `resume`.
+#
+# segments: structured array of the closed segments.
+# times, observations: the series from the start of the open part on.
+# end_ix: end index of the open segment within times, None if it is still
+#     to be initialized.
+# coefficients, intercepts, errors, magnitudes: arrays of the open
+#     segment's models and its last change magnitudes.
+# adjusted_rmse: tmask thresholds of the first call.
+# prefix: prefix statistics of times and observations, None unless
+#     incremental.
+State = collections.namedtuple('State', ['segments', 'times', 'observations',
+                                         'end_ix', 'coefficients',
+                                         'intercepts', 'errors', 'magnitudes',
+                                         'adjusted_rmse', 'prefix'])
+
+
+def __state(times, observations, model_matrix, adjusted_rmse, prefix,
+            results, closed, open_part):
+    """State from the results of `run`."""
+    meow_ix, end_ix, models, errors_, magnitudes_ = open_part
+    coefficients = intercepts = None
+    if end_ix is not None:
+        coefficients, intercepts = models.coefficients, models.intercepts
+        errors_ = np.asarray(errors_, dtype=float)
+        if magnitudes_ is not None:
+            magnitudes_ = np.asarray(magnitudes_, dtype=float)
+        end_ix -= meow_ix
+    if prefix is not None:
+        prefix = native.Statistics(None, prefix.x_origin, prefix.y_origin,
+                                   *[values[meow_ix:].copy()
+                                     for values in prefix[3:]])
+    segments = data.segments(results[:closed], len(observations),
+                             model_matrix.shape[1])
+    return State(segments, np.array(times[meow_ix:]),
+                 np.array(observations[:, meow_ix:]), end_ix, coefficients,
+                 intercepts, errors_, magnitudes_, adjusted_rmse, prefix)
+
+
+def __screen_prefix(prefix, model_matrix, observations):
+    """Prefix statistics for screening start indices, None if disabled."""
+    if not app.INITIALIZE_SCREEN:
+        return None
+    if prefix is None:
+        prefix = native.prefix_statistics(model_matrix, observations)
+    return prefix
+
 
+def __detect(times, observations, fitter_fn, meow_size, peek_size,
+             incremental, stats):
+    """Run detection over a whole series, see `detect` and `start`."""
     log.debug("build change model – time: {0}, obs: {1}, {2}, \
                meow_size: {3}, peek_size: {4}".format(
               times.shape, observations.shape,
               fitter_fn, meow_size, peek_size))
 
-    # Accumulator for models. This is a list of lists; each top-level list
-    # corresponds to a particular spectra.
-    results = ()
+    call_stats = __instrumented(stats)
+    with call_stats.timer('detect'):
+        # calculate the adjusted RMSE
+        # Is this correct?
+        # np.median(np.abs(np.diff(observations, n=1, axis=1)), axis=1)
+        # ...or is this correct?
+        observations = np.asarray(observations, dtype=data.precision())
+        adjusted_rmse = np.median(np.absolute(observations), 1) * app.T_CONST
+
+        # pre-calculate coefficient matrix for all time values; this
+        # calculation needs to be performed only once, but the lasso and
+        # tmask matrices are different.
+        model_matrix = lasso.coefficient_matrix(times)
+        tmask_matrix = tmask.robust_fit_coefficient_matrix(times)
+
+        # Cumulative X^T X, X^T y and y^T y of the whole series; the
+        # statistics of any window are the difference of two entries.
+        if incremental:
+            prefix = native.prefix_statistics(model_matrix, observations)
+        else:
+            prefix = None
 
-    # The starting point for initialization. Used to as reference point for
-    # taking a range of times and spectral values.
-    meow_ix = 0
+        results, closed, open_part = run(
+            times, observations, fitter_fn, model_matrix, tmask_matrix,
+            adjusted_rmse, meow_size, peek_size, prefix, call_stats,
+            screen_prefix=__screen_prefix(prefix, model_matrix, observations))
+    __collect(call_stats, stats, len(results))
+    log.debug("change detection complete")
+    return (model_matrix, adjusted_rmse, prefix, results, closed,
+            open_part)
 
-    # calculate the adjusted RMSE
-    # Is this correct?
-    # np.median(np.abs(np.diff(observations, n=1, axis=1)), axis=1)
-    # ...or is this correct?
-    adjusted_rmse = np.median(np.absolute(observations), 1) * app.T_CONST
 
-    # pre-calculate coefficient matrix for all time values; this calculation
-    # needs to be performed only once, but the lasso and tmask matrices are
-    # different.
-    model_matrix = lasso.coefficient_matrix(times)
-    tmask_matrix = tmask.robust_fit_coefficient_matrix(times)
+def start(times, observations, fitter_fn, meow_size=16, peek_size=3,
+          incremental=False, stats=None):
+    """Detect change and keep what is needed to resume with new data.
 
-    # Only build models as long as sufficient data exists. The observation
-    # window starts at meow_ix and is fixed until the change model no longer
-    # fits new observations, i.e. a change is detected. The meow_ix updated
-    # at the end of each iteration using an end index, so it is possible
-    # it will become None.
-    while (meow_ix is not None) and (meow_ix+meow_size) <= len(times):
+    Args:
+        times, observations, fitter_fn, meow_size, peek_size, incremental,
+            stats: see `detect`.
 
-        # Step 1: Initialize -- find an initial stable time-frame.
-        log.debug("initialize change model")
-        meow_ix, end_ix, models, errors_ = initialize(times, observations,
-                                                      fitter_fn, model_matrix,
-                                                      tmask_matrix,
-                                                      meow_ix, meow_size,
-                                                      adjusted_rmse)
+    Returns:
+        State, see `resume` and `segments`.
+    """
+    # The state keeps observations in the precision its models are in.
+    observations = np.asarray(observations, dtype=data.precision())
+    return __state(times, observations,
+                   *__detect(times, observations, fitter_fn, meow_size,
+                             peek_size, incremental, stats))
 
-        # Step 2: Extension -- expand time-frame until a change is detected.
-        log.debug("extend change model")
-        end_ix, models, magnitudes_ = extend(times, observations, model_matrix,
-                                             meow_ix, end_ix, peek_size,
-                                             fitter_fn, models)
 
-        # After initialization and extension, the change models for each
-        # spectra are complete for a period of time. If meow_ix and end_ix
-        # are not present, then not enough observations exist for a useful
-        # model to be produced, so nothing is appened to results.
-        if (meow_ix is not None) and (end_ix is not None):
-            result = (times[meow_ix], times[end_ix],
-                      models, errors_, magnitudes_)
-            results += (result,)
+def resume(state, times, observations, fitter_fn, meow_size=16, peek_size=3,
+           stats=None):
+    """Continue change detection with new observations only.
 
-        log.debug("accumulate results, {} so far".format(len(results)))
-        # Step 4: Iterate. The meow_ix is moved to the end of the current
-        # timeframe and a new model is generated. It is possible for end_ix
-        # to be None, in which case iteration stops.
-        meow_ix = end_ix
+    Closed segments are kept as they are; the open segment's extension
+    continues where it left off, or initialization is retried from the
+    start of the open part. Work is proportional to the open part and the
+    new observations, not the whole history.
 
-    log.debug("change detection complete")
-    return results
+    The tmask thresholds (adjusted RMSE) of the first call are kept and the
+    tmask matrix is built for the open part, so segments initialized after
+    resuming may differ from those of a single `detect` over the whole
+    series where tmask removes outliers.
+
+    Args:
+        state: State from `start` or `resume`.
+        times: ordinal days of the new observations, after those of state.
+        observations: new values for each spectrum.
+        fitter_fn, meow_size, peek_size, stats: see `detect`; incremental
+            is that of the state.
+
+    Returns:
+        State
+    """
+    if len(times) and len(state.times) and times[0] <= state.times[-1]:
+        raise ValueError("new observations must come after the last "
+                         "observation of the state")
+
+    call_stats = __instrumented(stats)
+    with call_stats.timer('detect'):
+        # Models of the state are those of its precision.
+        dtype = state.observations.dtype
+        matrix = lasso.coefficient_matrix(times, dtype)
+        all_times = np.concatenate((state.times, times))
+        all_observations = np.concatenate(
+            (state.observations, np.asarray(observations, dtype=dtype)),
+            axis=1)
+        model_matrix = np.concatenate((lasso.coefficient_matrix(state.times,
+                                                                dtype),
+                                       matrix))
+        tmask_matrix = tmask.robust_fit_coefficient_matrix(all_times, dtype)
+
+        prefix = state.prefix
+        if prefix is not None:
+            prefix = native.extend_prefix(prefix, matrix, observations)
+
+        models = None
+        if state.end_ix is not None:
+            models = data.Models(state.coefficients, state.intercepts)
+
+        results, closed, open_part = run(all_times, all_observations,
+                                         fitter_fn, model_matrix,
+                                         tmask_matrix, state.adjusted_rmse,
+                                         meow_size, peek_size, prefix,
+                                         call_stats, 0, state.end_ix, models,
+                                         state.errors, state.magnitudes,
+                                         __screen_prefix(prefix, model_matrix,
+                                                         all_observations))
+    __collect(call_stats, stats, len(results))
+
+    resumed = __state(all_times, all_observations, model_matrix,
+                      state.adjusted_rmse, prefix, results, closed, open_part)
+    return resumed._replace(segments=np.concatenate((state.segments,
+                                                     resumed.segments)))
+
+
+def segments(state):
+    """Closed segments of a state and the open one, if it is extending.
+
+    For the same observations, these are the segments `detect` returns,
+    except for a last segment initialization gave up on.
+
+    Args:
+        state: State from `start` or `resume`.
+
+    Returns:
+        numpy structured array with a row for each segment.
+    """
+    if state.end_ix is None:
+        return state.segments
+    # The open segment's extension ran out of observations.
+    row = data.segment(state.times[0], state.times[state.end_ix],
+                       state.end_ix + 1, state.coefficients,
+                       lasso.ordinal_intercepts(state.coefficients,
+                                                state.intercepts,
+                                                state.observations.dtype),
+                       state.errors, state.magnitudes)
+    return np.concatenate((state.segments,
+                           data.segments([row], *state.coefficients.shape)))
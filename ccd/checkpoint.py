@@ -0,0 +1,248 @@
+"""Checkpointed chip runs, resumed where they stopped after a restart.
+
+A chip run detects change for every pixel of a ccd.store.ChipStore, a
+block of pixels at a time, writing each block's results to its own
+directory of the output directory with ccd.sink.write_block (the layout of
+a ccd.spool chip job, so ccd.sink.read_blocks reads both). A run is
+described by output/manifest.json, written once when the run starts:
+
+    {"config": {"MEOW_SIZE": 16, ...},
+     "input": {"pixels": 10000, "length": 540, "dates": "<sha1>", ...}}
+
+"config" holds the ccd.app parameters that change results, see
+PARAMETERS, and "input" the shape and date index of the store and the
+blocks it is split into. Completed blocks are appended to output/completed,
+one line each, so recording a block costs the same however many are done:
+
+    0 100
+    100 200
+    ...
+
+A run given an output directory holding a manifest skips the blocks
+recorded as completed and carries on, compacting the record first, see
+`compact`; if either fingerprint differs, the results so far would not
+match the rest, so it refuses to resume with a ValueError naming what
+changed.
+"""
+import hashlib
+import json
+import os
+import uuid
+import ccd
+import ccd.sink as sink
+import ccd.source as source
+import ccd.spool as spool
+import ccd.store as chips
+from ccd import app
+from ccd import instrument
+
+log = app.logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+COMPLETED = 'completed'
+
+# ccd.app parameters that change the results of a run. Results of blocks
+# detected with different values are never mixed.
+PARAMETERS = ('MEOW_SIZE', 'PEEK_SIZE', 'STABILITY_THRESHOLD', 'FITTER_FN',
+              'T_CONST', 'CHANGE_PROBABILITY', 'CLEAR_OBSERVATION_PCT',
+              'CLEAR_OBSERVATION_THRESHOLD', 'PERMANENT_SNOW_THRESHOLD',
+              'MINIMUM_CLEAR_OBSERVATION_COUNT', 'COEFFICIENT_CATEGORIES',
+              'FILL_VALUE', 'INCREMENTAL_FIT', 'WARM_START', 'PRECISION')
+
+
+def config_fingerprint():
+    """Current values of PARAMETERS and the algorithm version."""
+    config = {name: getattr(app, name) for name in PARAMETERS}
+    config['algorithm'] = ccd.__algorithm__
+    # As read back from the manifest, e.g. tuples as lists.
+    return json.loads(json.dumps(config))
+
+
+def input_fingerprint(store, size, start=None, stop=None):
+    """Shape and date index of a store and the blocks a run splits it into.
+
+    Args:
+        store: ccd.store.ChipStore
+        size, start, stop: see `run`.
+
+    Returns:
+        dict
+    """
+    return {'pixels': store.pixels, 'length': store.length,
+            'dtype': store.dtype.str,
+            'dates': hashlib.sha1(store.dates().tobytes()).hexdigest(),
+            'size': size, 'start': start, 'stop': stop}
+
+
+def changes(recorded, current):
+    """Names of values that differ between two fingerprints, sorted."""
+    return sorted(name for name in set(recorded) | set(current)
+                  if recorded.get(name) != current.get(name))
+
+
+def read_manifest(output):
+    """The manifest of a run, None if it has none.
+
+    Returns:
+        dict, holding the completed blocks as 'blocks', see `completed`.
+    """
+    try:
+        with open(os.path.join(output, MANIFEST)) as f:
+            recorded = json.load(f)
+    except FileNotFoundError:
+        return None
+    recorded['blocks'] = completed(output)
+    return recorded
+
+
+def __replace(path, text):
+    """Write text to path, renaming it into place once complete."""
+    temporary = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+    with open(temporary, 'w') as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+
+def write_manifest(output, manifest):
+    """Write the config and input fingerprints of a run's manifest."""
+    __replace(os.path.join(output, MANIFEST),
+              json.dumps({'config': manifest['config'],
+                          'input': manifest['input']}))
+
+
+def completed(output):
+    """Blocks recorded as completed in output, in the order recorded.
+
+    A line cut short by an interruption, without its newline, is ignored;
+    its block is detected again.
+
+    Returns:
+        list of [first, last] pixel ranges
+    """
+    try:
+        with open(os.path.join(output, COMPLETED)) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    return [[int(value) for value in line.split()]
+            for line in lines if line.endswith('\n')]
+
+
+def record(f, first, last):
+    """Append a completed block to the open completed file f of a run."""
+    f.write('{0} {1}\n'.format(first, last))
+    f.flush()
+
+
+def compact(output):
+    """Rewrite the completed blocks of a run without duplicates or a line
+    cut short, in pixel order.
+
+    Returns:
+        list of [first, last] pixel ranges
+    """
+    blocks = sorted(set(tuple(block) for block in completed(output)))
+    __replace(os.path.join(output, COMPLETED),
+              ''.join('{0} {1}\n'.format(*block) for block in blocks))
+    return [list(block) for block in blocks]
+
+
+def manifest(output, config, inputs):
+    """The manifest to continue a run with, created if there is none.
+
+    Args:
+        output: output directory of the run.
+        config: see `config_fingerprint`.
+        inputs: see `input_fingerprint`.
+
+    Returns:
+        dict
+
+    Raises:
+        ValueError: the recorded fingerprints differ from these.
+    """
+    recorded = read_manifest(output)
+    if recorded is None:
+        recorded = {'config': config, 'input': inputs, 'blocks': []}
+        os.makedirs(output, exist_ok=True)
+        # Nothing is completed yet, whatever a stray file says.
+        __replace(os.path.join(output, COMPLETED), '')
+        write_manifest(output, recorded)
+        return recorded
+
+    changed = ['{0} ({1!r} -> {2!r})'.format(name,
+                                             recorded['config'].get(name),
+                                             config.get(name))
+               for name in changes(recorded['config'], config)]
+    changed += ['input {0}'.format(name)
+                for name in changes(recorded['input'], inputs)]
+    if changed:
+        raise ValueError("can't resume the run in {0}, changed: "
+                         "{1}".format(output, ', '.join(changed)))
+    recorded['blocks'] = compact(output)
+    return recorded
+
+
+class Remaining(source.Source):
+    """Blocks of a source except those with the given keys."""
+
+    def __init__(self, blocks, done):
+        self.blocks = blocks
+        self.done = done
+
+    def keys(self):
+        return [key for key in self.blocks.keys() if key not in self.done]
+
+    def read(self, key):
+        return self.blocks.read(key)
+
+
+def run(store, output, size=100, start=None, stop=None, depth=None,
+        limit=None, stats=instrument.NULL):
+    """Detect change for every pixel of a chip store, resuming a previous
+    run into output.
+
+    Args:
+        store: directory of a ccd.store.ChipStore.
+        output: directory results and the manifest are written to, created
+            if needed.
+        size: number of pixels in each block.
+        start: first ordinal date, None for the first acquisition.
+        stop: last ordinal date, None for the last acquisition.
+        depth: see ccd.source.prefetch.
+        limit: most blocks to detect, no limit if None.
+        stats: ccd.instrument.Stats, additionally counting 'skipped_blocks'.
+
+    Returns:
+        number of blocks detected by this call
+
+    Raises:
+        ValueError: output holds a run with other parameters or input.
+    """
+    chip = chips.open_store(store)
+    blocks = source.StoreSource(chip, size, start, stop)
+    recorded = manifest(output, config_fingerprint(),
+                        input_fingerprint(chip, size, start, stop))
+    done = set(tuple(key) for key in recorded['blocks'])
+    stats.count('skipped_blocks', len(done))
+    log.debug("{0} of {1} blocks already done".format(len(done),
+                                                      len(blocks.keys())))
+
+    detected = 0
+    if limit is not None and limit < 1:
+        return detected
+    results = ccd.detect_source(Remaining(blocks, done), output='array',
+                                depth=depth, stats=stats)
+    with open(os.path.join(output, COMPLETED), 'a') as f:
+        for (first, last), block in results:
+            # A block written before an interruption that kept it from
+            # being recorded is already complete, and kept as it is.
+            sink.write_block(os.path.join(output,
+                                          spool.block_name(first, last)),
+                             range(first, last), block)
+            record(f, first, last)
+            detected += 1
+            if detected == limit:
+                results.close()
+                break
+    return detected
@@ -2,21 +2,38 @@
 """ Command line interface to Python Continuous Change Detection. """
 
 from ccd import app
+import ccd.checkpoint as checkpoint
+import ccd.executor as executor
+import ccd.spool as spool
+import ccd.stream as stream
 import ccd
 from click_plugins import with_plugins
 from pkg_resources import iter_entry_points
 import click
+import functools
 import json
+import logging
+import sys
 import numpy as np
 
 
 logger = app.logging.getLogger(__name__)
 
 
+def log_to_stderr():
+    """Move log handlers writing to stdout, as app configures them, over to
+    stderr, leaving stdout to the results of the commands."""
+    for handler in logging.getLogger().handlers:
+        if type(handler) is logging.StreamHandler and \
+                handler.stream in (sys.stdout, sys.__stdout__):
+            handler.setStream(sys.stderr)
+
+
 @with_plugins(iter_entry_points('core_package.cli_plugins'))
 @click.group()
 def cli():
     """Commandline interface for yourpackage."""
+    log_to_stderr()
     logger.info("CLI running...")
 
 
@@ -40,6 +57,95 @@ def sample(path, format):
     logger.debug("Done...")
 
 
+@cli.command(name='stream')
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--output', type=click.File('w'), default='-',
+              help='NDJSON results, default stdout.')
+@click.option('--format', default=None, type=click.Choice(['csv', 'ndjson']),
+              help='Input format, default from the file extension.')
+@click.option('--preprocess/--no-preprocess', default=True)
+@click.option('--executor', 'backend', default='serial',
+              type=click.Choice(sorted(executor.BACKENDS)))
+@click.option('--workers', default=None, type=int)
+@click.option('--chunksize', default=1)
+def stream_command(source, output, format, preprocess, backend, workers,
+                   chunksize):
+    """Detect change for every pixel of a long format CSV or NDJSON file.
+
+    Results are written as NDJSON, a line per pixel, as soon as each pixel
+    is complete. See ccd.stream for the input formats.
+    """
+    if format is None:
+        format = 'ndjson' if source.name.endswith(('.ndjson', '.jsonl')) \
+            else 'csv'
+    rows = stream.ndjson_rows(source) if format == 'ndjson' \
+        else stream.csv_rows(source)
+
+    detect = functools.partial(stream.detect, preprocess=preprocess)
+    results = executor.run(detect, stream.pixels(rows), backend, workers,
+                           chunksize)
+    try:
+        for _, (pixel_id, detections) in results:
+            output.write(stream.ndjson(pixel_id, detections) + '\n')
+            output.flush()
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@cli.group(name='spool')
+def spool_group():
+    """Share a chip job between workers through a spool directory."""
+
+
+@spool_group.command(name='create')
+@click.argument('store', type=click.Path(exists=True))
+@click.argument('path', type=click.Path())
+@click.argument('output', type=click.Path())
+@click.option('--size', default=100, help='Pixels in each task.')
+def spool_create(store, path, output, size):
+    """Spool a task for every block of pixels of a chip store.
+
+    Workers write the results of each block to a directory under OUTPUT,
+    see ccd.spool.
+    """
+    count = spool.create(path, spool.chip_tasks(store, output, size))
+    click.echo('{0} tasks spooled'.format(count))
+
+
+@spool_group.command(name='work')
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--timeout', default=None, type=float,
+              help='Seconds before a claim is stale, see app.SPOOL_TIMEOUT.')
+def spool_work(path, timeout):
+    """Run tasks of a spool until none is pending."""
+    count = spool.work(path, spool.detect_task, timeout=timeout)
+    click.echo('{0} tasks completed'.format(count))
+
+
+@spool_group.command(name='status')
+@click.argument('path', type=click.Path(exists=True))
+def spool_status(path):
+    """Number of pending, claimed and done tasks."""
+    click.echo(json.dumps(spool.Spool(path).status(), sort_keys=True))
+
+
+@cli.command(name='chip')
+@click.argument('store', type=click.Path(exists=True))
+@click.argument('output', type=click.Path())
+@click.option('--size', default=100, help='Pixels in each block.')
+def chip_command(store, output, size):
+    """Detect change for every pixel of a chip store, block by block.
+
+    Completed blocks are recorded in OUTPUT/completed; run again with
+    the same OUTPUT to resume an interrupted run, see ccd.checkpoint.
+    """
+    try:
+        count = checkpoint.run(store, output, size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo('{0} blocks detected'.format(count))
+
+
 @cli.command()
 def another_subcommand():
     """Another Subcommand that does something."""
@@ -1,6 +1,148 @@
-""" General data functions """
+""" General data functions
 
+Change detection results are kept as NumPy structured arrays with one row
+(a segment) per period of time covered by a change model. Every field holds
+plain numbers; fitted models are reduced to their coefficients and
+intercepts as soon as a segment is complete.
 
-def nomodel(ccd_results):
-   """Removes models from ccd_results"""
-   return ccd_results._replace(mod)
+While a segment is being built, the models of its spectra are kept stacked
+as Models, so predictions for every spectrum take one matrix product.
+"""
+import collections
+import numpy as np
+from ccd import app
+
+# Fitted linear models of every spectrum over the same window: (spectra, k)
+# coefficients, (spectra,) intercepts and (spectra,) solver iterations, None
+# when the fitter doesn't report them.
+Models = collections.namedtuple('Models', ['coefficients', 'intercepts',
+                                           'iterations'])
+Models.__new__.__defaults__ = (None,)
+
+
+def precision():
+    """Floating point type of design matrices, observations and fits, see
+    app.PRECISION."""
+    return np.dtype(app.PRECISION)
+
+
+def segment_dtype(bands=6, coefficients=4):
+    """Structured dtype of a segment.
+
+    Args:
+        bands: number of spectra
+        coefficients: number of model coefficients for each spectrum
+
+    Returns:
+        numpy.dtype with the fields start_day, end_day,
+        observation_count, magnitude, rmse, coefficients and intercept.
+        The last four hold a value (or row of values) for each spectrum.
+    """
+    return np.dtype([('start_day', np.int64),
+                     ('end_day', np.int64),
+                     ('observation_count', np.int64),
+                     ('magnitude', np.float64, (bands,)),
+                     ('rmse', np.float64, (bands,)),
+                     ('coefficients', np.float64, (bands, coefficients)),
+                     ('intercept', np.float64, (bands,))])
+
+
+def segment(start_day, end_day, observation_count, coefficients, intercepts,
+            errors, magnitudes):
+    """Values of one segment, in the order of segment_dtype.
+
+    Args:
+        start_day: first day covered by the models
+        end_day: last day covered by the models
+        observation_count: number of observations in the period
+        coefficients: model coefficients for each spectrum
+        intercepts: model intercept for each spectrum
+        errors: RMSE for each spectrum
+        magnitudes: change magnitude for each spectrum, None if no change
+            magnitude was calculated; stored as NaN
+
+    Returns:
+        tuple of values matching segment_dtype
+    """
+    if magnitudes is None:
+        magnitudes = np.full(len(errors), np.nan)
+    return (start_day, end_day, observation_count, magnitudes, errors,
+            coefficients, intercepts)
+
+
+def model_parameters(models):
+    """Coefficients and intercepts of fitted models as arrays.
+
+    Args:
+        models: fitted model for each spectrum, anything with coef_ and
+            intercept_ attributes
+
+    Returns:
+        tuple: (spectra, k) coefficients and (spectra,) intercepts
+    """
+    dtype = precision()
+    return (np.array([model.coef_ for model in models], dtype=dtype),
+            np.array([model.intercept_ for model in models], dtype=dtype))
+
+
+def models(fitted):
+    """Models of fitted models, see `model_parameters`.
+
+    Args:
+        fitted: fitted model for each spectrum, or Models, which are
+            returned as they are.
+
+    Returns:
+        Models
+    """
+    if isinstance(fitted, Models):
+        return fitted
+    iterations = [getattr(model, 'n_iter_', None) for model in fitted]
+    if None in iterations:
+        iterations = None
+    else:
+        iterations = np.array(iterations, dtype=int)
+    return Models(*model_parameters(fitted), iterations=iterations)
+
+
+def predict(models, matrix):
+    """Predictions of every model, with one matrix product.
+
+    Args:
+        models: Models
+        matrix: (n, k) design matrix rows to predict values for
+
+    Returns:
+        (spectra, n) predicted values
+    """
+    return (np.dot(models.coefficients, np.transpose(matrix)) +
+            models.intercepts[:, None])
+
+
+def residual_norms(models, matrix, observations):
+    """2-norm of the residuals of every model.
+
+    Args:
+        models: Models
+        matrix: (n, k) design matrix rows of the observations
+        observations: (spectra, n) observed values
+
+    Returns:
+        (spectra,) norms
+    """
+    residuals = predict(models, matrix) - observations
+    return np.sqrt(np.einsum('bn,bn->b', residuals, residuals))
+
+
+def segments(rows, bands=6, coefficients=4):
+    """Structured array of segments.
+
+    Args:
+        rows: sequence of tuples from segment
+        bands: number of spectra
+        coefficients: number of model coefficients for each spectrum
+
+    Returns:
+        numpy structured array with segment_dtype
+    """
+    return np.array(list(rows), dtype=segment_dtype(bands, coefficients))
@@ -0,0 +1,148 @@
+"""Executors for running a function over many pixels.
+
+Pixels are grouped into chunks and each chunk is handed to a backend:
+
+    - serial: chunks are processed one after another in this thread.
+    - thread: chunks are processed by a concurrent.futures thread pool.
+    - process: chunks are processed by a concurrent.futures process pool.
+
+Every backend yields (index, result) pairs, where index is the position of
+the pixel in the input. Results are delivered in input order when ordered
+is True, otherwise as soon as each chunk completes.
+
+Only a bounded number of chunks are in flight at any time, so the input may
+be a generator that is much larger than memory.
+"""
+import collections
+import concurrent.futures as futures
+import importlib
+import itertools
+import os
+from ccd import app
+
+log = app.logging.getLogger(__name__)
+
+
+def chunked(items, size):
+    """Group items into lists of (index, item) pairs.
+
+    Args:
+        items: iterable of items.
+        size: maximum number of items in each chunk.
+
+    Returns:
+        generator producing lists of (index, item)
+    """
+    iterator = enumerate(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def apply(fn, chunk):
+    """Apply fn to each item in a chunk, keeping the index of each item."""
+    return [(ix, fn(item)) for ix, item in chunk]
+
+
+def detect(pixel, preprocess=True, output='dict'):
+    """Detect change for a single pixel.
+
+    Args:
+        pixel: sequence of the nine arrays ccd.detect accepts, or a
+            (9, n) array.
+        preprocess: passed through to ccd.detect
+        output: passed through to ccd.detect
+
+    Returns:
+        Tuple of ccd.detections or a structured array, plain values only
+        so they are cheap to send back from a worker process.
+    """
+    # ccd imports this module, so ccd is imported here instead.
+    import ccd
+    return ccd.detect(*pixel, preprocess=preprocess, output=output)
+
+
+def initialize():
+    """Import the fitter module once when a worker process starts."""
+    module, _ = app.FITTER_FN.rsplit('.', 1)
+    importlib.import_module(module)
+
+
+def serial(fn, chunks, workers=None, ordered=True):
+    """Process each chunk in turn in the calling thread."""
+    for chunk in chunks:
+        for result in apply(fn, chunk):
+            yield result
+
+
+def pooled(executor, fn, chunks, workers, ordered):
+    """Submit chunks to executor, keeping at most 2 * workers in flight."""
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(executor.submit(apply, fn, chunk))
+        if len(pending) < 2 * workers:
+            continue
+        if ordered:
+            done = [pending.popleft()]
+        else:
+            done, _ = futures.wait(pending,
+                                   return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+        for future in done:
+            for result in future.result():
+                yield result
+
+    if not ordered:
+        pending = futures.as_completed(pending)
+    for future in pending:
+        for result in future.result():
+            yield result
+
+
+def threads(fn, chunks, workers=None, ordered=True):
+    """Process chunks with a thread pool."""
+    workers = workers or os.cpu_count()
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in pooled(executor, fn, chunks, workers, ordered):
+            yield result
+
+
+def processes(fn, chunks, workers=None, ordered=True):
+    """Process chunks with a process pool, fn must be picklable."""
+    workers = workers or os.cpu_count()
+    with futures.ProcessPoolExecutor(max_workers=workers,
+                                     initializer=initialize) as executor:
+        for result in pooled(executor, fn, chunks, workers, ordered):
+            yield result
+
+
+BACKENDS = {'serial': serial, 'thread': threads, 'process': processes}
+
+
+def run(fn, items, backend='serial', workers=None, chunksize=1,
+        ordered=True):
+    """Apply fn to every item with the named backend.
+
+    Args:
+        fn: function of one item, must be picklable for the process
+            backend.
+        items: iterable of items.
+        backend: one of 'serial', 'thread' or 'process'.
+        workers: number of threads or processes, defaults to the number
+            of CPUs.
+        chunksize: number of items handed to a worker at once.
+        ordered: deliver results in input order, otherwise in completion
+            order.
+
+    Returns:
+        generator producing (index, result) pairs
+    """
+    if backend not in BACKENDS:
+        raise ValueError("unknown executor backend {0}, expected one "
+                         "of {1}".format(backend, sorted(BACKENDS)))
+    log.debug("run with {0} backend, workers: {1}, chunksize: {2}, "
+              "ordered: {3}".format(backend, workers, chunksize, ordered))
+    return BACKENDS[backend](fn, chunked(items, chunksize), workers, ordered)
@@ -8,7 +8,22 @@ This module currently uses explicit values from the Landsat CFMask:
     - 3: snow
     - 4: cloud
     - 255: fill
+
+Functions taking a quality band also accept a (pixels, n) array of a whole
+chip where noted, and return an array with a value for each pixel.
 """
+import collections
+import numpy as np
+from ccd import app
+
+# Categories of `categorize`.
+STANDARD = 0
+SNOW = 1
+INSUFFICIENT = 2
+
+# Counts of `chip_counts`, each a value per pixel.
+QualityCounts = collections.namedtuple('QualityCounts',
+                                       ['clear', 'snow', 'fill', 'total'])
 
 
 def count_clear_or_water(quality):
@@ -181,10 +196,41 @@ def temperature_index(observations, min_kelvin=179.95, max_kelvin=343.85):
             (observations[7, :] <= max_kelvin))
 
 
-def categorize(qa):
-    """ determine the category to use for detecting change """
+def chip_counts(quality):
+    """Count clear or water, snow, fill and non-fill data of every pixel.
+
+    Vectorized form of `count_clear_or_water`, `count_snow`, `count_fill`
+    and `count_total`: the QA values of all pixels are counted with one
+    np.bincount, each pixel using its own range of bins.
+
+    Arguments:
+        quality: (..., n) CFMask quality band values, e.g. (pixels, n).
+            Values other than the integers 0..255 are counted in total
+            only.
+
+    Returns:
+        QualityCounts of (...) arrays.
     """
-    IF clear_pct IS LESS THAN CLEAR_OBSERVATION_THRESHOLD
+    quality = np.asarray(quality)
+    values = quality.reshape(-1, quality.shape[-1])
+    valid = (values >= 0) & (values <= 255) & (values == np.floor(values))
+    bins = np.where(valid, values, 256).astype(np.intp)
+    bins += 257 * np.arange(values.shape[0])[:, None]
+    histogram = np.bincount(bins.ravel(), minlength=257 * values.shape[0])
+    histogram = histogram.reshape(quality.shape[:-1] + (257,))
+
+    fill = histogram[..., 255]
+    return QualityCounts(clear=histogram[..., 0] + histogram[..., 1],
+                         snow=histogram[..., 4], fill=fill,
+                         total=quality.shape[-1] - fill)
+
+
+def categorize(qa, clear_pct=app.CLEAR_OBSERVATION_PCT,
+               snow_pct=app.PERMANENT_SNOW_THRESHOLD,
+               minimum=app.MINIMUM_CLEAR_OBSERVATION_COUNT):
+    """Determine the category to use for detecting change.
+
+    IF clear_pct IS LESS THAN CLEAR_OBSERVATION_PCT
     THEN
 
         IF permanent_snow_pct IS GREATER THAN PERMANENT_SNOW_THRESHOLD
@@ -197,13 +243,88 @@ def categorize(qa):
 
     ELSE
         DO NORMAL CHANGE DETECTION
+
+    Ratios are those of `ratio_clear` and `ratio_snow`; a pixel without
+    any non-fill data has none of either.
+
+    Arguments:
+        qa: (..., n) CFMask quality band values, e.g. (pixels, n) for a
+            chip.
+        clear_pct: minimum ratio of clear to non-fill data for normal
+            change detection.
+        snow_pct: minimum ratio of snow to clear and snow data for snow
+            based change detection.
+        minimum: minimum number of snow observations for snow based
+            change detection.
+
+    Returns:
+        (...) int array: STANDARD, SNOW or INSUFFICIENT for each pixel.
+    """
+    counts = chip_counts(qa)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        clear = np.where(counts.total > 0, counts.clear / counts.total, 0)
+        snowy = counts.clear + counts.snow
+        snow = np.where(snowy > 0, counts.snow / snowy, 0)
+
+    return np.select([clear >= clear_pct,
+                      (snow >= snow_pct) & (counts.snow >= minimum)],
+                     [STANDARD, SNOW], INSUFFICIENT)
+
+
+def preprocess_index(matrix):
+    """bool index of clear observations within temp/saturation range.
+
+    Arguments:
+        matrix: time/spectra/qa major nd-array, assumed to be shaped as
+            (9,n-moments) of unscaled data. A (9,pixels,n-moments) array
+            produces an index for every pixel.
     """
-    pass
+    return (clear_index(matrix)
+            & temperature_index(matrix)
+            & unsaturated_index(matrix))
 
 
 def preprocess(matrix):
     """Filter matrix for clear pixels within temp/saturation range."""
-    criteria = (clear_index(matrix)
-                & temperature_index(matrix)
-                & unsaturated_index(matrix))
-    return matrix[:, criteria]
+    return matrix[:, preprocess_index(matrix)]
+
+
+def chip_index(cube):
+    """`preprocess_index` of every pixel of a chip.
+
+    Arguments:
+        cube: (pixels, 9, n-moments) array, each pixel holding the rows of
+            the matrix `preprocess_index` accepts.
+
+    Returns:
+        (pixels, n-moments) bool array.
+    """
+    return preprocess_index(np.swapaxes(np.asarray(cube), 0, 1))
+
+
+def detectable(dates, index, meow_size=app.MEOW_SIZE, day_delta=365):
+    """Which pixels could produce any change model from their observations.
+
+    Change detection needs at least meow_size observations, and the last
+    must be at least day_delta days after the first; without them a pixel
+    produces no models, so it can be skipped before any fitting.
+
+    Arguments:
+        dates: (pixels, n-moments) ordinal dates.
+        index: (pixels, n-moments) bool index of the observations change
+            detection is given, e.g. from `chip_index`.
+        meow_size: minimum expected observation window.
+        day_delta: minimum number of days in an initial window.
+
+    Returns:
+        (pixels,) bool array.
+    """
+    dates, index = np.asarray(dates), np.asarray(index)
+    if not index.shape[-1]:
+        return np.zeros(index.shape[:-1], dtype=bool)
+    # Positions of the first and last observation of each pixel.
+    first = index.argmax(axis=-1)[..., None]
+    last = index.shape[-1] - 1 - index[..., ::-1].argmax(axis=-1)[..., None]
+    span = (np.take_along_axis(dates, last, axis=-1) -
+            np.take_along_axis(dates, first, axis=-1))[..., 0]
+    return (index.sum(axis=-1) >= meow_size) & (span >= day_delta)
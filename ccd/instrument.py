@@ -0,0 +1,131 @@
+"""Counters and phase timers for the change detection hot path.
+
+Instrumentation is opt-in. Pass a `Stats` to `ccd.change.detect` (or
+`ccd.detect`) to collect the counts and timings of that call, or set
+`app.INSTRUMENT` to collect them for every call. Either way the results of
+each instrumented call are also added to the totals of the process, see
+`totals`.
+
+When instrumentation is off, functions are handed `NULL`, whose methods do
+nothing, so the hot path pays for a method call per event and nothing
+else.
+
+Counts:
+    fits: models fitted for a window, all spectra at once count as one
+    tmask: calls to ccd.tmask.tmask_index
+    shifts: times initialization moved the start of the window forward
+    extensions: observations added to a window during extension
+    segments: segments produced
+    blocks: blocks of pixels read by ccd.source.prefetch
+
+Timers, in seconds:
+    detect, initialize, extend, fit, tmask
+    io_wait: time ccd.source.prefetch callers were blocked on reads
+    detect_block: ccd.detect_source detecting blocks
+"""
+import collections
+import threading
+import time
+
+
+class Stats(object):
+    """Counts and seconds spent, by name."""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.seconds = collections.Counter()
+
+    def count(self, name, n=1):
+        """Add n to the count of name."""
+        self.counts[name] += n
+
+    def timer(self, name):
+        """Context manager adding the time spent within to seconds[name]."""
+        return _Timer(self.seconds, name)
+
+    def merge(self, other):
+        """Add the counts and seconds of other to these."""
+        self.counts.update(other.counts)
+        self.seconds.update(other.seconds)
+
+    def as_dict(self):
+        """Plain dict of counts and seconds."""
+        return {'counts': dict(self.counts), 'seconds': dict(self.seconds)}
+
+    def __repr__(self):
+        return 'Stats({0!r})'.format(self.as_dict())
+
+
+class _Timer(object):
+
+    __slots__ = ('seconds', 'name', 'start')
+
+    def __init__(self, seconds, name):
+        self.seconds = seconds
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.seconds[self.name] += time.perf_counter() - self.start
+
+
+class _NullTimer(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+class _Null(object):
+    """Stats that records nothing."""
+
+    __slots__ = ()
+
+    __timer = _NullTimer()
+
+    def count(self, name, n=1):
+        pass
+
+    def timer(self, name):
+        return self.__timer
+
+    def merge(self, other):
+        pass
+
+
+NULL = _Null()
+
+# Totals of every instrumented call in this process.
+__totals = Stats()
+__totals_lock = threading.Lock()
+
+
+def aggregate(stats):
+    """Add stats to the totals of the process."""
+    with __totals_lock:
+        __totals.merge(stats)
+
+
+def totals():
+    """Copy of the totals of the process.
+
+    Returns:
+        Stats
+    """
+    copy = Stats()
+    with __totals_lock:
+        copy.merge(__totals)
+    return copy
+
+
+def reset():
+    """Clear the totals of the process."""
+    with __totals_lock:
+        __totals.counts.clear()
+        __totals.seconds.clear()
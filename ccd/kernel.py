@@ -0,0 +1,297 @@
+"""Change detection for one pixel as a single compiled loop.
+
+The functions here implement the same state machine as `ccd.change.run`
+(initialize, tmask, fit, extend) over plain arrays, with explicit loops
+instead of lists, models and log calls. When numba is installed they are
+compiled with numba.njit, so a whole pixel runs without returning to the
+interpreter. Select this backend with app.DETECT_BACKEND = 'numba'.
+
+Models are fitted with the lasso of `ccd.models.native`, so results match
+`ccd.change.detect` with the 'ccd.models.native.fitted_models' fitter,
+whatever app.FITTER_FN is. Models are always refitted over each window in
+float64, app.INCREMENTAL_FIT and app.PRECISION do not apply.
+
+Without numba the same functions run as plain Python; that is far slower
+than `ccd.change`, so `detect` callers fall back to `ccd.change.detect`
+instead, see `available`.
+"""
+import numpy as np
+from ccd import app
+from ccd import data
+from ccd.models import lasso
+import ccd.tmask as tmask
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+log = app.logging.getLogger(__name__)
+
+
+def jit(fn):
+    """numba.njit when numba is installed, otherwise fn itself."""
+    if numba is None:
+        return fn
+    return numba.njit(cache=True, nogil=True)(fn)
+
+
+def available():
+    """Is the compiled backend available?"""
+    return numba is not None
+
+
+@jit
+def find_time_index(times, meow_ix, meow_size, day_delta):
+    """See `ccd.change.find_time_index`, -1 if it can't be found."""
+    n = times.shape[0]
+    if times[n - 1] - times[meow_ix] < day_delta:
+        return -1
+    end_ix = meow_ix + meow_size - 1
+    while end_ix < n:
+        if times[end_ix] - times[meow_ix] >= day_delta:
+            break
+        end_ix += 1
+    return end_ix
+
+
+@jit
+def tmask_kept(times, observations, tmask_matrix, adjusted_rmse, start, stop):
+    """See `ccd.tmask.tmask_index` with bands 1 and 4.
+
+    Returns:
+        tuple: number of observations kept and the days from the first
+            to the last of them.
+    """
+    n, k = stop - start, tmask_matrix.shape[1]
+    matrix = np.ones((n, k + 1))
+    for j in range(k):
+        mean = 0.0
+        for i in range(n):
+            mean += tmask_matrix[start + i, j]
+        mean /= n
+        for i in range(n):
+            matrix[i, j] = tmask_matrix[start + i, j] - mean
+    q, _ = np.linalg.qr(matrix)
+
+    outlier = np.zeros(n, dtype=np.bool_)
+    bands = (1, 4)
+    for b in range(2):
+        actual = observations[bands[b], start:stop].copy()
+        projected = np.dot(np.dot(actual, q), q.T)
+        for i in range(n):
+            if abs(projected[i] - actual[i]) > adjusted_rmse[b]:
+                outlier[i] = True
+
+    kept, first, last = 0, -1, -1
+    for i in range(n):
+        if not outlier[i]:
+            kept += 1
+            if first < 0:
+                first = i
+            last = i
+    if kept == 0:
+        return 0, 0
+    return kept, times[start + last] - times[start + first]
+
+
+@jit
+def lasso_fit(matrix, spectra, start, stop, coefficients, intercepts,
+              alpha=0.1, max_iter=1000, tol=1e-4):
+    """See `ccd.models.native.fit`, results are written to coefficients and
+    intercepts."""
+    n, k = stop - start, matrix.shape[1]
+    x_mean = np.zeros(k)
+    for i in range(start, stop):
+        for j in range(k):
+            x_mean[j] += matrix[i, j]
+    x_mean /= n
+    x = matrix[start:stop] - x_mean
+    gram = np.dot(x.T, x)
+    l1_reg = alpha * n
+
+    for b in range(spectra.shape[0]):
+        y_mean = 0.0
+        for i in range(start, stop):
+            y_mean += spectra[b, i]
+        y_mean /= n
+        y = spectra[b, start:stop] - y_mean
+        covariance = np.dot(y, x)
+        norm = np.dot(y, y)
+        w = np.zeros(k)
+
+        for n_iter in range(max_iter):
+            w_max = 0.0
+            d_w_max = 0.0
+            for ii in range(k):
+                if gram[ii, ii] == 0:
+                    continue
+                w_ii = w[ii]
+                tmp = covariance[ii] - np.dot(gram[ii], w) + \
+                    gram[ii, ii] * w_ii
+                updated = np.sign(tmp) * max(abs(tmp) - l1_reg, 0.0) / \
+                    gram[ii, ii]
+                d_w_max = max(d_w_max, abs(updated - w_ii))
+                w_max = max(w_max, abs(updated))
+                w[ii] = updated
+
+            if (w_max == 0 or d_w_max / w_max < tol or
+                    n_iter == max_iter - 1):
+                # Duality gap, as computed by sklearn.
+                h = np.dot(gram, w)
+                q_dot_w = np.dot(covariance, w)
+                dual_norm = np.max(np.abs(covariance - h))
+                r_norm2 = norm + np.dot(w, h) - 2 * q_dot_w
+                if dual_norm > l1_reg:
+                    const = l1_reg / dual_norm
+                    gap = 0.5 * (r_norm2 + r_norm2 * const ** 2)
+                else:
+                    const = 1.0
+                    gap = r_norm2
+                gap += l1_reg * np.sum(np.abs(w)) - const * (norm - q_dot_w)
+                if gap < tol * norm or d_w_max == 0:
+                    break
+
+        coefficients[b] = w
+        intercepts[b] = y_mean - np.dot(w, x_mean)
+
+
+@jit
+def residual_norms(matrix, spectra, coefficients, intercepts, start, stop,
+                   norms):
+    """2-norm of each spectrum's residuals over a window, into norms."""
+    for b in range(spectra.shape[0]):
+        predicted = np.dot(matrix[start:stop], coefficients[b]) + \
+            intercepts[b]
+        norms[b] = np.sqrt(np.sum((predicted - spectra[b, start:stop]) ** 2))
+
+
+@jit
+def detect_pixel(times, observations, model_matrix, tmask_matrix,
+                 adjusted_rmse, meow_size, peek_size, day_delta,
+                 stability_threshold):
+    """Change detection for one pixel, see `ccd.change.run`.
+
+    Returns:
+        tuple of arrays with a row for each segment: start and end index,
+        magnitudes (NaN if not calculated), rmse, coefficients and
+        intercepts.
+    """
+    n, bands, k = times.shape[0], observations.shape[0], model_matrix.shape[1]
+    capacity = n + 1
+    starts = np.zeros(capacity, dtype=np.int64)
+    ends = np.zeros(capacity, dtype=np.int64)
+    magnitudes = np.full((capacity, bands), np.nan)
+    errors = np.zeros((capacity, bands))
+    all_coefficients = np.zeros((capacity, bands, k))
+    all_intercepts = np.zeros((capacity, bands))
+    count = 0
+
+    coefficients = np.zeros((bands, k))
+    intercepts = np.zeros(bands)
+    rmse = np.zeros(bands)
+    norms = np.zeros(bands)
+
+    meow_ix = 0
+    while meow_ix + meow_size <= n and count < capacity:
+
+        # Initialize. A stale end index and models are kept when
+        # initialization runs out of start indices, like ccd.change.
+        if times[n - 1] - times[meow_ix] < day_delta:
+            break
+        end_ix = -1
+        fitted = False
+        while meow_ix + meow_size <= n:
+            found = find_time_index(times, meow_ix, meow_size, day_delta)
+            if found < 0:
+                end_ix = -1
+                break
+            end_ix = found
+
+            kept, span = tmask_kept(times, observations, tmask_matrix,
+                                    adjusted_rmse, meow_ix, end_ix + 1)
+            if kept < meow_size or span < day_delta:
+                meow_ix += 1
+                continue
+
+            lasso_fit(model_matrix, observations, meow_ix, end_ix + 1,
+                      coefficients, intercepts)
+            fitted = True
+            residual_norms(model_matrix, observations, coefficients,
+                           intercepts, meow_ix, end_ix + 1, norms)
+            stable = True
+            for b in range(bands):
+                rmse[b] = norms[b] / np.sqrt(end_ix + 1 - meow_ix)
+                if not rmse[b] < stability_threshold:
+                    stable = False
+            if not stable:
+                meow_ix += 1
+                continue
+            break
+
+        if end_ix < 0 or not fitted:
+            break
+
+        # Extend.
+        calculated = False
+        while end_ix + peek_size <= n:
+            peek_ix = end_ix + peek_size
+            residual_norms(model_matrix, observations, coefficients,
+                           intercepts, meow_ix, peek_ix, norms)
+            calculated = True
+            accurate = True
+            for b in range(bands):
+                if not norms[b] < 0.99:
+                    accurate = False
+            if not accurate:
+                break
+            lasso_fit(model_matrix, observations, meow_ix, peek_ix,
+                      coefficients, intercepts)
+            end_ix += 1
+
+        starts[count] = meow_ix
+        ends[count] = end_ix
+        if calculated:
+            magnitudes[count] = norms
+        errors[count] = rmse
+        all_coefficients[count] = coefficients
+        all_intercepts[count] = intercepts
+        count += 1
+
+        meow_ix = end_ix
+
+    return (starts[:count], ends[:count], magnitudes[:count], errors[:count],
+            all_coefficients[:count], all_intercepts[:count])
+
+
+def detect(times, observations, meow_size=16, peek_size=3, day_delta=365):
+    """Runs change detection for one pixel with the compiled kernel.
+
+    Args:
+        times: ordinal day numbers.
+        observations: (bands, n) values, pre-processed.
+        meow_size: minimum expected observation window needed to
+            produce a fit.
+        peek_size: number of observations to consider when detecting
+            a change.
+        day_delta: minimum number of days in an initial window.
+
+    Returns:
+        numpy structured array with a row for each segment, see
+        ccd.data.segment_dtype.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    observations = np.asarray(observations, dtype=float)
+    adjusted_rmse = np.median(np.absolute(observations), 1) * app.T_CONST
+    model_matrix = lasso.coefficient_matrix(times, np.float64)
+
+    starts, ends, magnitudes, errors, coefficients, intercepts = \
+        detect_pixel(times, observations, model_matrix,
+                     tmask.robust_fit_coefficient_matrix(times, np.float64),
+                     adjusted_rmse, meow_size, peek_size, day_delta,
+                     app.STABILITY_THRESHOLD)
+
+    rows = [(times[s], times[e], e - s + 1, m, r, c, i)
+            for s, e, m, r, c, i in zip(starts, ends, magnitudes, errors,
+                                        coefficients, intercepts)]
+    return data.segments(rows, observations.shape[0], model_matrix.shape[1])
@@ -0,0 +1,86 @@
+"""Harmonic terms shared by the design matrices of the models.
+
+Every design matrix starts from the annual cycle, sin and cos of
+2*pi*t/365.25 for each ordinal date t. Landsat acquisitions fall on the same
+days for every pixel of every chip, so for integral dates, of any dtype,
+these values are looked up in a table shared by the whole process; each
+date is computed only once. The table spans at most TABLE_SIZE consecutive
+dates. Other terms are computed for every date in one vectorized pass.
+"""
+import threading
+import numpy as np
+
+# Most consecutive dates held by the table, about 2870 years of ordinal
+# days in 16 MiB. Dates spanning more are computed directly.
+TABLE_SIZE = 1 << 20
+
+# First ordinal date in the table, followed by sin and cos of its annual
+# cycle for consecutive dates. Replaced, never modified in place, so readers
+# don't need the lock.
+__table = (0, np.empty(0), np.empty(0))
+__table_lock = threading.Lock()
+
+
+def __annual(days):
+    angles = 2 * np.pi * days / 365.25
+    return np.sin(angles), np.cos(angles)
+
+
+def __grow(first, last):
+    """Make sure the table covers first..last, return the table."""
+    global __table
+    with __table_lock:
+        start, sin, cos = __table
+        if sin.size and start <= first and last < start + sin.size:
+            return __table
+        if sin.size:
+            merged = min(first, start), max(last, start + sin.size - 1)
+            # Past TABLE_SIZE, the old dates make way for the new.
+            if merged[1] - merged[0] < TABLE_SIZE:
+                first, last = merged
+        sin, cos = __annual(np.arange(first, last + 1))
+        __table = (first, sin, cos)
+        return __table
+
+
+def annual(dates):
+    """sin and cos of the annual cycle, 2*pi*t/365.25, for each date.
+
+    Args:
+        dates: ordinal dates; integral-valued dates, such as float dates
+            read from text or cast to the working precision, use the shared
+            table.
+
+    Returns:
+        tuple: sin and cos arrays, shaped like dates.
+    """
+    dates = np.asarray(dates)
+    if dates.size == 0:
+        return __annual(dates)
+    if not np.issubdtype(dates.dtype, np.integer):
+        if not np.all(dates == np.round(dates)):
+            return __annual(dates)
+    if dates.max() - dates.min() >= TABLE_SIZE:
+        return __annual(dates)
+    dates = dates.astype(np.int64, copy=False)
+
+    first, last = int(dates.min()), int(dates.max())
+    start, sin, cos = __table
+    if not (sin.size and start <= first and last < start + sin.size):
+        start, sin, cos = __grow(first, last)
+    index = dates - start
+    return sin[index], cos[index]
+
+
+def cycle(dates, frequency):
+    """cos and sin of frequency * t for each date, in one pass.
+
+    Args:
+        dates: ordinal dates.
+        frequency: angular frequency, radians per day.
+
+    Returns:
+        tuple: cos and sin arrays, shaped like dates.
+    """
+    angles = frequency * np.asarray(dates)
+    return np.cos(angles), np.sin(angles)
@@ -1,37 +1,87 @@
 from sklearn import linear_model
 import numpy as np
-from cachetools import cached
-from cachetools import LRUCache
+from ccd import data
+from ccd.models import harmonic
 
-cache = LRUCache(maxsize=1000)
+# Ordinal day (2000-01-01) the time column of design matrices counts from
+# when they are less precise than float64. Ordinal days are around 730000,
+# where float32 only resolves 1/16 of a day; days from ORIGIN keep the
+# precision of the slope.
+ORIGIN = 730120
 
 
-def __coefficient_cache_key(observation_dates):
-    return tuple(observation_dates)
+def origin(dtype=None):
+    """Ordinal day the time column of coefficient_matrix counts from.
+
+    Args:
+        dtype: floating point type of the matrix, data.precision() if None
+
+    Returns:
+        ORIGIN for types less precise than float64, otherwise 0
+    """
+    dtype = data.precision() if dtype is None else np.dtype(dtype)
+    return 0 if dtype.itemsize >= 8 else ORIGIN
 
 
-@cached(cache=cache, key=__coefficient_cache_key)
-def coefficient_matrix(observation_dates):
+def coefficient_matrix(observation_dates, dtype=None):
     """c1 * sin(t/365.25) + c2 * cos(t/365.25) + c3*t + c4 * 1
 
+    Change detection builds this once for a whole series and fits windows
+    of it, see `matrix_model`.
+
     Args:
         observation_dates: list of ordinal dates
+        dtype: floating point type of the matrix, data.precision() if None;
+            t counts from `origin` of it.
 
     Returns:
         Populated numpy array with coefficient values
     """
-    # c1 = np.array([np.sin(t/365.25) for t in observation_dates])
-    # c2 = np.array([np.cos(t/365.25) for t in observation_dates])
-    # c3 = np.array([t for t in observation_dates])
-    # c4 = np.ones(len(c1))
-
-    matrix = np.ones(shape=(len(observation_dates), 4))
-    matrix[:, 0] = [np.sin(2*np.pi*t/365.25) for t in observation_dates]
-    matrix[:, 1] = [np.cos(2*np.pi*t/365.25) for t in observation_dates]
-    matrix[:, 2] = [t for t in observation_dates]
+    dtype = data.precision() if dtype is None else np.dtype(dtype)
+    matrix = np.ones(shape=(len(observation_dates), 4), dtype=dtype)
+    matrix[:, 0], matrix[:, 1] = harmonic.annual(observation_dates)
+    matrix[:, 2] = np.asarray(observation_dates) - origin(dtype)
     return matrix
 
 
+def ordinal_intercepts(coefficients, intercepts, dtype=None):
+    """Intercepts of models of coefficient_matrix rows, for t in ordinal
+    days whatever the matrix counts from.
+
+    Args:
+        coefficients: (..., 4) model coefficients
+        intercepts: (...) model intercepts
+        dtype: floating point type of the matrix, see `origin`
+
+    Returns:
+        (...) float64 intercepts, never a view of the given ones
+    """
+    intercepts = np.array(intercepts, dtype=float)
+    days = origin(dtype)
+    if not days:
+        return intercepts
+    return intercepts - np.asarray(coefficients, dtype=float)[..., 2] * days
+
+
+def matrix_model(matrix, observations, initial=None):
+    """Create a fully fitted lasso model from rows of the design matrix.
+
+    Args:
+        matrix: rows of coefficient_matrix for the observation dates,
+            e.g. a view of the matrix of a whole series.
+        observations: list of values corresponding to the rows
+        initial: coefficients to start from, e.g. those of the previous
+            window, with sklearn's warm_start
+
+    Returns:
+        sklearn.linear_model.Lasso().fit(matrix, observations)
+    """
+    lasso = linear_model.Lasso(alpha=0.1, warm_start=initial is not None)
+    if initial is not None:
+        lasso.coef_ = np.array(initial, dtype=matrix.dtype)
+    return lasso.fit(matrix, observations)
+
+
 def fitted_model(observation_dates, observations):
     """Create a fully fitted lasso model.
 
@@ -45,6 +95,10 @@ def fitted_model(observation_dates, observations):
     Example:
         fitted_model(dates, obs).predict(...)
     """
-    # pmodel = partial_model(observation_dates)
-    lasso = linear_model.Lasso(alpha=0.1)
-    return lasso.fit(coefficient_matrix(observation_dates), observations)
+    return matrix_model(coefficient_matrix(observation_dates), observations)
+
+
+# Fits rows of a precomputed design matrix, from initial coefficients when
+# given, see ccd.change.fit
+fitted_model.from_matrix = matrix_model
+matrix_model.warm_start = True
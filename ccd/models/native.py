@@ -0,0 +1,453 @@
+"""Lasso models for small problems, fitted with NumPy.
+
+Change detection fits a lasso model to each of six spectra over the same
+window, using a design matrix with only four columns. For problems this
+small, building and validating a `sklearn.linear_model.Lasso` for every
+spectrum costs far more than the math. This module solves all of the
+spectra at once, with the same algorithm sklearn uses: cyclic coordinate
+descent on centered data, stopped by the same duality gap rule.
+
+The coordinate updates are written against the Gram matrix (X^T X) and the
+covariances (X^T y) rather than residuals, so the cost of an iteration does
+not depend on the number of observations, and any number of problems can
+be solved together by stacking their Gram matrices.
+
+Coefficients, intercepts and predictions agree with
+`sklearn.linear_model.Lasso(alpha=0.1)` to a relative tolerance of 1e-6;
+both solvers follow the same sequence of updates, the differences are
+rounding. One deliberate difference: a problem stops as soon as a full pass
+leaves every coefficient unchanged (e.g. a constant spectrum), where sklearn
+keeps iterating until max_iter without changing the result.
+
+Since only X^T X, X^T y and y^T y are needed, a fit can also be made from
+sufficient statistics of a window (see `statistics`) that are updated as
+observations join it, without revisiting earlier observations. Cumulative
+statistics of a whole series (see `prefix_statistics`) give the statistics of
+any window from two entries.
+"""
+import collections
+import numpy as np
+from ccd.models import lasso
+
+
+# Sufficient statistics of a window of observations. Rows are accumulated
+# relative to the first row of the window (the origin) so the sums stay small
+# and keep their precision, e.g. for ordinal dates.
+Statistics = collections.namedtuple('Statistics',
+                                    ['samples', 'x_origin', 'y_origin',
+                                     'x_sum', 'y_sum', 'xx', 'xy', 'yy'])
+
+
+class LinearModel(collections.namedtuple('LinearModel',
+                                         ['coef_', 'intercept_', 'n_iter_'])):
+    """Fitted linear model, a drop in for a fitted sklearn model."""
+    __slots__ = ()
+
+    def predict(self, X):
+        return np.dot(X, self.coef_) + self.intercept_
+
+
+def coordinate_descent(gram, covariance, norm, samples, alpha=0.1,
+                       max_iter=1000, tol=1e-4, initial=None):
+    """Minimize (1 / (2 * samples)) * ||y - Xw||^2 + alpha * ||w||_1.
+
+    Every argument may hold a stack of problems; they are broadcast
+    against each other and solved together. All arguments are for
+    centered data.
+
+    Args:
+        gram: (..., k, k) X^T X.
+        covariance: (..., k) X^T y.
+        norm: (...) y^T y.
+        samples: (...) number of observations.
+        alpha: l1 penalty.
+        max_iter: maximum number of passes over the coefficients.
+        tol: tolerance for the duality gap, relative to y^T y.
+        initial: (..., k) coefficients to start from, e.g. those of a
+            slightly smaller window (a warm start), zeros if None.
+
+    Returns:
+        tuple: (..., k) coefficients and (...) number of iterations
+            performed for each problem.
+    """
+    shape = np.broadcast(gram[..., 0, 0], covariance[..., 0],
+                         norm, samples).shape
+    k = covariance.shape[-1]
+    # float32 problems are solved in float32.
+    dtype = np.result_type(gram, covariance, norm, np.float32)
+    gram = np.broadcast_to(gram, shape + (k, k))
+    covariance = np.broadcast_to(covariance, shape + (k,))
+    norm = np.broadcast_to(norm, shape)
+
+    l1_reg = (alpha * np.broadcast_to(samples, shape)).astype(dtype)
+    d_w_tol = tol
+    tol = tol * norm
+    diagonal = np.diagonal(gram, axis1=-2, axis2=-1)
+
+    if initial is None:
+        coefficients = np.zeros(shape + (k,), dtype=dtype)
+    else:
+        coefficients = np.array(np.broadcast_to(initial, shape + (k,)),
+                                dtype=dtype)
+    active = np.ones(shape, dtype=bool)
+    iterations = np.full(shape, max_iter)
+
+    for n_iter in range(max_iter):
+        w_max = np.zeros(shape, dtype=dtype)
+        d_w_max = np.zeros(shape, dtype=dtype)
+
+        for ii in range(k):
+            updatable = active & (diagonal[..., ii] != 0)
+            w_ii = coefficients[..., ii]
+            tmp = (covariance[..., ii] -
+                   np.einsum('...j,...j->...', gram[..., ii, :],
+                             coefficients) +
+                   diagonal[..., ii] * w_ii)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                shrunk = (np.sign(tmp) *
+                          np.maximum(np.abs(tmp) - l1_reg, 0) /
+                          diagonal[..., ii])
+            updated = np.where(updatable, shrunk, w_ii)
+
+            d_w_max = np.maximum(d_w_max, np.abs(updated - w_ii))
+            w_max = np.maximum(w_max, np.abs(updated))
+            coefficients[..., ii] = updated
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            small = (w_max == 0) | (d_w_max / w_max < d_w_tol)
+        if n_iter == max_iter - 1:
+            small[...] = True
+        check = active & small
+        if check.any():
+            gap = duality_gap(gram, covariance, norm, l1_reg, coefficients)
+            # A pass that changes nothing will never change anything, stop
+            # there rather than spinning until max_iter like sklearn.
+            converged = check & ((gap < tol) | (d_w_max == 0))
+            iterations[converged] = n_iter + 1
+            active &= ~converged
+        if not active.any():
+            break
+
+    return coefficients, iterations
+
+
+def duality_gap(gram, covariance, norm, l1_reg, coefficients):
+    """Duality gap of the lasso problem, as computed by sklearn."""
+    h = np.einsum('...ij,...j->...i', gram, coefficients)
+    q_dot_w = np.einsum('...i,...i->...', covariance, coefficients)
+    dual_norm = np.abs(covariance - h).max(axis=-1)
+    r_norm2 = (norm + np.einsum('...i,...i->...', coefficients, h) -
+               2 * q_dot_w)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        const = np.where(dual_norm > l1_reg, l1_reg / dual_norm, 1.0)
+    gap = np.where(dual_norm > l1_reg,
+                   0.5 * (r_norm2 + r_norm2 * const ** 2), r_norm2)
+    l1_norm = np.abs(coefficients).sum(axis=-1)
+    return gap + l1_reg * l1_norm - const * (norm - q_dot_w)
+
+
+def fit(matrix, spectra, alpha=0.1, initial=None):
+    """Fit a lasso model with intercept to each spectrum in spectra.
+
+    Args:
+        matrix: (n, k) design matrix shared by every spectrum.
+        spectra: (bands, n) observed values.
+        alpha: l1 penalty.
+        initial: (bands, k) coefficients to start from, see
+            `coordinate_descent`.
+
+    Returns:
+        tuple: (bands, k) coefficients, (bands,) intercepts and (bands,)
+            iteration counts.
+    """
+    x_mean = matrix.mean(axis=0)
+    y_mean = spectra.mean(axis=1)
+    x_centered = matrix - x_mean
+    y_centered = spectra - y_mean[:, None]
+
+    coefficients, iterations = coordinate_descent(
+        np.dot(x_centered.T, x_centered),
+        np.dot(y_centered, x_centered),
+        np.einsum('bn,bn->b', y_centered, y_centered),
+        matrix.shape[0], alpha, initial=initial)
+
+    intercepts = y_mean - np.dot(coefficients, x_mean)
+    return coefficients, intercepts, iterations
+
+
+def statistics(matrix, spectra):
+    """Sufficient statistics of a window for fitting every spectrum.
+
+    Args:
+        matrix: (n, k) design matrix of the window, n must be at least 1.
+        spectra: (bands, n) observed values.
+
+    Returns:
+        Statistics
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    spectra = np.asarray(spectra, dtype=float)
+    x_origin, y_origin = matrix[0], spectra[:, 0]
+    empty = Statistics(0, x_origin, y_origin,
+                       np.zeros(matrix.shape[1]), np.zeros(spectra.shape[0]),
+                       np.zeros((matrix.shape[1], matrix.shape[1])),
+                       np.zeros((spectra.shape[0], matrix.shape[1])),
+                       np.zeros(spectra.shape[0]))
+    return update(empty, matrix, spectra)
+
+
+def update(stats, matrix, spectra):
+    """Add observations to a window's sufficient statistics.
+
+    The cost depends on the number of observations added, not on the
+    number already in the window.
+
+    Args:
+        stats: Statistics of the window.
+        matrix: (m, k) design matrix rows of the new observations.
+        spectra: (bands, m) observed values.
+
+    Returns:
+        Statistics
+    """
+    x = np.asarray(matrix, dtype=float) - stats.x_origin
+    y = np.asarray(spectra, dtype=float) - stats.y_origin[:, None]
+    return stats._replace(samples=stats.samples + x.shape[0],
+                          x_sum=stats.x_sum + x.sum(axis=0),
+                          y_sum=stats.y_sum + y.sum(axis=1),
+                          xx=stats.xx + np.dot(x.T, x),
+                          xy=stats.xy + np.dot(y, x),
+                          yy=stats.yy + np.einsum('bn,bn->b', y, y))
+
+
+def prefix_statistics(matrix, spectra):
+    """Cumulative sufficient statistics over a whole series.
+
+    Entry i of each sum covers the first i observations, so the statistics
+    of any window are the difference of two entries, see `window`. Sums are
+    relative to the first observation of the series.
+
+    Args:
+        matrix: (..., n, k) design matrix of the series.
+        spectra: (..., bands, n) observed values; leading dimensions hold
+            separate series (e.g. pixels) and must match matrix.
+
+    Returns:
+        Statistics, where samples is unused and each sum has a leading
+        axis of length n + 1.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    spectra = np.asarray(spectra, dtype=float)
+    x_origin, y_origin = matrix[..., 0, :], spectra[..., :, 0]
+
+    # Series axis first, then any leading dimensions.
+    x = np.moveaxis(matrix - x_origin[..., None, :], -2, 0)
+    y = np.moveaxis(spectra - y_origin[..., None], -1, 0)
+
+    def cumulative(values):
+        zero = np.zeros((1,) + values.shape[1:])
+        return np.concatenate((zero, np.cumsum(values, axis=0)))
+
+    return Statistics(None, x_origin, y_origin,
+                      cumulative(x), cumulative(y),
+                      cumulative(x[..., :, None] * x[..., None, :]),
+                      cumulative(y[..., :, None] * x[..., None, :]),
+                      cumulative(y * y))
+
+
+def extend_prefix(prefix, matrix, spectra):
+    """Prefix statistics of a series with observations added to its end.
+
+    Only the new observations are summed; sums stay relative to the origin
+    of prefix.
+
+    Args:
+        prefix: Statistics from `prefix_statistics` of a single series.
+        matrix: (m, k) design matrix of the new observations.
+        spectra: (bands, m) new observed values.
+
+    Returns:
+        Statistics, each sum has m more entries.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    spectra = np.asarray(spectra, dtype=float)
+    x = matrix - prefix.x_origin
+    y = (spectra - prefix.y_origin[:, None]).T
+
+    def cumulative(last, values):
+        return np.concatenate((last, last[-1] + np.cumsum(values, axis=0)))
+
+    return Statistics(None, prefix.x_origin, prefix.y_origin,
+                      cumulative(prefix.x_sum, x),
+                      cumulative(prefix.y_sum, y),
+                      cumulative(prefix.xx, x[:, :, None] * x[:, None, :]),
+                      cumulative(prefix.xy, y[:, :, None] * x[:, None, :]),
+                      cumulative(prefix.yy, y * y))
+
+
+def window(prefix, start, stop, index=()):
+    """Sufficient statistics of a window, from prefix statistics.
+
+    Args:
+        prefix: Statistics from `prefix_statistics`.
+        start: index of the first observation in the window.
+        stop: index past the last observation in the window.
+        index: for a prefix of several series, a tuple of index arrays
+            selecting the series; start and stop then hold a value for
+            each selected series.
+
+    Returns:
+        Statistics of the window(s)
+    """
+    def delta(values):
+        return values[(stop,) + index] - values[(start,) + index]
+
+    return Statistics(np.asarray(stop) - start,
+                      prefix.x_origin[index], prefix.y_origin[index],
+                      delta(prefix.x_sum), delta(prefix.y_sum),
+                      delta(prefix.xx), delta(prefix.xy), delta(prefix.yy))
+
+
+def fit_statistics(stats, alpha=0.1, initial=None):
+    """Fit a lasso model with intercept to each spectrum of a window.
+
+    Gives the same models as `fit` over the window's observations. Stacked
+    statistics, e.g. from `window` with an index, are fitted together.
+
+    Args:
+        stats: Statistics of the window(s).
+        alpha: l1 penalty.
+        initial: (..., bands, k) coefficients to start from, see
+            `coordinate_descent`.
+
+    Returns:
+        tuple: (..., bands, k) coefficients, (..., bands) intercepts and
+            (..., bands) iteration counts.
+    """
+    # Constant columns (e.g. the intercept) are exactly zero once shifted
+    # by the origin, so they are skipped just like centered ones in `fit`.
+    samples = np.asarray(stats.samples)
+    x_mean = stats.x_sum / samples[..., None]
+    y_mean = stats.y_sum / samples[..., None]
+    gram = stats.xx - (samples[..., None, None] *
+                       x_mean[..., :, None] * x_mean[..., None, :])
+    covariance = stats.xy - (samples[..., None, None] *
+                             y_mean[..., :, None] * x_mean[..., None, :])
+    norm = stats.yy - samples[..., None] * y_mean ** 2
+
+    coefficients, iterations = coordinate_descent(
+        gram[..., None, :, :], covariance, norm, samples[..., None], alpha,
+        initial=initial)
+
+    intercepts = (y_mean + stats.y_origin -
+                  np.einsum('...bk,...k->...b', coefficients,
+                            x_mean + stats.x_origin))
+    return coefficients, intercepts, iterations
+
+
+def residual_norms(stats, coefficients, intercepts):
+    """Sum of squared residuals of each spectrum's model over a window.
+
+    Args:
+        stats: Statistics of the window(s).
+        coefficients: (..., bands, k) model coefficients.
+        intercepts: (..., bands) model intercepts.
+
+    Returns:
+        (..., bands) sum of squared residuals.
+    """
+    # Residuals in terms of the shifted rows: y' - x'w - offset
+    offset = (np.einsum('...bk,...k->...b', coefficients, stats.x_origin) +
+              intercepts - stats.y_origin)
+    xw = np.einsum('...bk,...k->...b', coefficients, stats.x_sum)
+    squares = (stats.yy -
+               2 * np.einsum('...bk,...bk->...b', coefficients, stats.xy) -
+               2 * offset * stats.y_sum +
+               np.einsum('...bk,...kj,...bj->...b', coefficients, stats.xx,
+                         coefficients) +
+               2 * offset * xw +
+               np.asarray(stats.samples)[..., None] * offset ** 2)
+    return np.maximum(squares, 0)
+
+
+def least_squares_norms(stats):
+    """Sum of squared residuals of the least squares fit of each spectrum.
+
+    The fit has an intercept and no penalty, so no linear model over the
+    same columns, e.g. a lasso fit, has smaller residuals over the window.
+
+    Args:
+        stats: Statistics of the window(s).
+
+    Returns:
+        (..., bands) sum of squared residuals.
+    """
+    samples = np.asarray(stats.samples)
+    x_mean = stats.x_sum / samples[..., None]
+    y_mean = stats.y_sum / samples[..., None]
+    gram = stats.xx - (samples[..., None, None] *
+                       x_mean[..., :, None] * x_mean[..., None, :])
+    covariance = stats.xy - (samples[..., None, None] *
+                             y_mean[..., :, None] * x_mean[..., None, :])
+    norm = stats.yy - samples[..., None] * y_mean ** 2
+
+    # Scale columns to unit norm, dates would otherwise dwarf the harmonics.
+    # Constant columns are zero once centered and stay zero.
+    scale = np.sqrt(np.diagonal(gram, axis1=-2, axis2=-1))
+    scale = np.where(scale > 0, scale, 1)
+    gram = gram / (scale[..., :, None] * scale[..., None, :])
+    covariance = covariance / scale[..., None, :]
+
+    explained = np.einsum('...bk,...kj,...bj->...b', covariance,
+                          np.linalg.pinv(gram), covariance)
+    return np.maximum(norm - explained, 0)
+
+
+def linear_models(coefficients, intercepts, iterations):
+    """LinearModel for each spectrum, e.g. from the results of `fit`."""
+    return [LinearModel(*model)
+            for model in zip(coefficients, intercepts, iterations)]
+
+
+def fitted_models(observation_dates, spectra):
+    """Create fully fitted lasso models for every spectrum.
+
+    Args:
+        observation_dates: list of ordinal observation dates
+        spectra: (bands, n) values corresponding to observation_dates
+
+    Returns:
+        list of LinearModel, one for each spectrum
+
+    Example:
+        fitted_models(dates, spectra)[0].predict(...)
+    """
+    return matrix_models(lasso.coefficient_matrix(observation_dates),
+                         spectra)
+
+
+def matrix_models(matrix, spectra, initial=None):
+    """Create fully fitted lasso models from rows of the design matrix.
+
+    Args:
+        matrix: (n, k) rows of ccd.models.lasso.coefficient_matrix, e.g. a
+            view of the matrix of a whole series.
+        spectra: (bands, n) values corresponding to the rows
+        initial: (bands, k) coefficients to start from, e.g. those of the
+            previous window
+
+    Returns:
+        list of LinearModel, one for each spectrum
+    """
+    return linear_models(*fit(matrix,
+                              np.asarray(spectra, dtype=matrix.dtype),
+                              initial=initial))
+
+
+# Fits every spectrum in one call, from rows of a precomputed design matrix,
+# see ccd.change.fit
+fitted_models.vectorized = True
+matrix_models.vectorized = True
+matrix_models.warm_start = True
+fitted_models.from_matrix = matrix_models
@@ -0,0 +1,327 @@
+"""Bulk output of change detection results.
+
+A sink takes the segments of many pixels, as the structured arrays that
+ccd.detect and ccd.detect_batch return with output='array', buffers them
+and writes them in large batches:
+
+    - NpzSink: a directory of part-NNNNN.npz files, a file per batch, with
+      an array per segment field (columnar) plus the pixel of each segment.
+    - SqliteSink: a SQLite table with one segment per row; fields holding
+      a value per band (or per band and coefficient) get a column per value,
+      e.g. rmse_0 or coefficients_2_1.
+
+A batch is written once it holds `flush_size` segments or `memory` bytes,
+see app.SINK_FLUSH_SIZE and app.SINK_MEMORY. Pixels without segments are
+only recorded by their id: the `empty` array of each part, or the
+empty_pixels table.
+
+Pixel ids are integers, e.g. positions within a chip:
+
+    with sink.NpzSink('results') as results:
+        for (first, stop), block in ccd.detect_source(
+                source.StoreSource(chip), output='array'):
+            results.write_many(range(first, stop), block)
+"""
+import abc
+import os
+import shutil
+import sqlite3
+import uuid
+import numpy as np
+from ccd import app
+from ccd import data
+
+log = app.logging.getLogger(__name__)
+
+PIXEL = 'pixel'
+
+
+def columns(dtype):
+    """Names of the columns of a segment dtype, a column per value.
+
+    Args:
+        dtype: structured dtype of segments, see ccd.data.segment_dtype
+
+    Returns:
+        list of (column name, field name, index within the field) triples
+    """
+    result = []
+    for name in dtype.names:
+        shape = dtype[name].shape
+        if not shape:
+            result.append((name, name, ()))
+            continue
+        for index in np.ndindex(*shape):
+            column = '_'.join([name] + [str(ix) for ix in index])
+            result.append((column, name, index))
+    return result
+
+
+class Sink(abc.ABC):
+    """Buffers segments and writes them in batches, see `store`.
+
+    Args:
+        flush_size: number of buffered segments that triggers a write,
+            app.SINK_FLUSH_SIZE if None.
+        memory: bytes of buffered segments that trigger a write,
+            app.SINK_MEMORY if None.
+    """
+
+    def __init__(self, flush_size=None, memory=None):
+        self.flush_size = app.SINK_FLUSH_SIZE if flush_size is None \
+            else flush_size
+        self.memory = app.SINK_MEMORY if memory is None else memory
+        self.segments = []
+        self.pixels = []
+        self.empty = []
+        self.buffered = 0
+        self.bytes = 0
+        self.batches = 0
+
+    def write(self, pixel, segments):
+        """Add the segments of a pixel.
+
+        Args:
+            pixel: integer id of the pixel.
+            segments: structured array of its segments, may be empty.
+        """
+        if len(segments) == 0:
+            self.empty.append(pixel)
+            self.bytes += 8
+        else:
+            self.segments.append(segments)
+            self.pixels.append(np.full(len(segments), pixel, dtype=np.int64))
+            self.buffered += len(segments)
+            self.bytes += segments.nbytes + 8 * len(segments)
+        if self.buffered >= self.flush_size or self.bytes >= self.memory:
+            self.flush()
+
+    def write_many(self, pixels, results):
+        """Add the segments of several pixels, e.g. the results of
+        ccd.detect_batch and the pixel id of each."""
+        for pixel, segments in zip(pixels, results):
+            self.write(pixel, segments)
+
+    def flush(self):
+        """Write everything buffered as one batch."""
+        if not self.segments and not self.empty:
+            return
+        segments = np.concatenate(self.segments) if self.segments \
+            else data.segments([])
+        pixels = np.concatenate(self.pixels) if self.pixels \
+            else np.empty(0, dtype=np.int64)
+        self.store(pixels, segments, np.array(self.empty, dtype=np.int64))
+        log.debug("wrote batch {0}: {1} segments, {2} empty "
+                  "pixels".format(self.batches, len(segments),
+                                  len(self.empty)))
+        self.batches += 1
+        self.segments, self.pixels, self.empty = [], [], []
+        self.buffered = self.bytes = 0
+
+    @abc.abstractmethod
+    def store(self, pixels, segments, empty):
+        """Write a batch.
+
+        Args:
+            pixels: (n,) pixel of each segment.
+            segments: (n,) structured array of segments.
+            empty: ids of pixels without segments.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Write what is left."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NpzSink(Sink):
+    """Batches as part-NNNNN.npz files of a directory, see the module
+    documentation.
+
+    Args:
+        path: directory, created if needed.
+        compress: write compressed .npz files.
+        flush_size, memory: see Sink.
+    """
+
+    def __init__(self, path, compress=False, flush_size=None, memory=None):
+        super(NpzSink, self).__init__(flush_size, memory)
+        self.path = path
+        self.compress = compress
+        os.makedirs(path, exist_ok=True)
+        # Continue after parts already in the directory.
+        self.batches = len(parts(path))
+
+    def store(self, pixels, segments, empty):
+        arrays = {name: segments[name] for name in segments.dtype.names}
+        arrays[PIXEL] = pixels
+        arrays['empty'] = empty
+        name = os.path.join(self.path, 'part-{0:05d}'.format(self.batches))
+        # Written under another name first, so a part is either complete
+        # or missing.
+        with open(name + '.tmp', 'wb') as f:
+            if self.compress:
+                np.savez_compressed(f, **arrays)
+            else:
+                np.savez(f, **arrays)
+        os.replace(name + '.tmp', name + '.npz')
+
+
+def parts(path):
+    """Part files of an NpzSink directory, in order."""
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.startswith('part-') and name.endswith('.npz'))
+
+
+def read_npz(path):
+    """Everything written by an NpzSink.
+
+    Args:
+        path: directory of the sink.
+
+    Returns:
+        tuple: pixel of each segment, structured array of segments and ids
+            of pixels without segments.
+    """
+    pixels, segments, empty = [], [], []
+    for name in parts(path):
+        with np.load(name) as part:
+            pixels.append(part[PIXEL])
+            empty.append(part['empty'])
+            rows = np.empty(len(part[PIXEL]),
+                            dtype=data.segment_dtype(
+                                *part['coefficients'].shape[1:]))
+            for field in rows.dtype.names:
+                rows[field] = part[field]
+            segments.append(rows)
+    if not segments:
+        return (np.empty(0, dtype=np.int64), data.segments([]),
+                np.empty(0, dtype=np.int64))
+    return np.concatenate(pixels), np.concatenate(segments), \
+        np.concatenate(empty)
+
+
+def write_block(path, pixels, results, compress=False):
+    """Write the results of a block of pixels as a new NpzSink directory.
+
+    Results are written to a temporary directory that is renamed to path
+    once complete, so path holds all of them or doesn't exist.
+
+    Args:
+        path: directory to create.
+        pixels: id of each pixel.
+        results: structured array of segments of each pixel.
+        compress: see NpzSink.
+
+    Returns:
+        False if path already existed; it is left as it is.
+    """
+    if os.path.exists(path):
+        return False
+    temporary = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+    with NpzSink(temporary, compress) as written:
+        written.write_many(pixels, results)
+    try:
+        os.rename(temporary, path)
+    except OSError:
+        # Written by someone else meanwhile.
+        shutil.rmtree(temporary)
+        return False
+    return True
+
+
+def read_blocks(path):
+    """Everything written by `write_block` to directories within path.
+
+    Args:
+        path: directory holding the block directories.
+
+    Returns:
+        tuple: pixel of each segment, structured array of segments and ids
+            of pixels without segments, ordered by block name, see
+            `read_npz`.
+    """
+    blocks = [read_npz(os.path.join(path, name))
+              for name in sorted(os.listdir(path))
+              if not name.endswith('.tmp') and
+              os.path.isdir(os.path.join(path, name))]
+    if not blocks:
+        return read_npz(path)
+    return tuple(np.concatenate(values) for values in zip(*blocks))
+
+
+class SqliteSink(Sink):
+    """Batches as rows of a SQLite table, see the module documentation.
+
+    Each batch is written in one transaction.
+
+    Args:
+        path: database file, created if needed.
+        table: name of the segments table.
+        bands: number of spectra of segments.
+        coefficients: number of model coefficients of each spectrum.
+        flush_size, memory: see Sink.
+    """
+
+    def __init__(self, path, table='segments', bands=6, coefficients=4,
+                 flush_size=None, memory=None):
+        super(SqliteSink, self).__init__(flush_size, memory)
+        self.table = table
+        self.columns = columns(data.segment_dtype(bands, coefficients))
+        self.connection = sqlite3.connect(path)
+        names = [PIXEL] + [column for column, _, _ in self.columns]
+        self.insert = 'insert into {0} ({1}) values ({2})'.format(
+            table, ', '.join(names), ', '.join('?' * len(names)))
+        with self.connection:
+            self.connection.execute(
+                'create table if not exists {0} ({1} integer, {2})'.format(
+                    table, PIXEL, ', '.join(
+                        '{0} {1}'.format(column, 'integer' if not index
+                                         else 'real')
+                        for column, _, index in self.columns)))
+            self.connection.execute('create table if not exists '
+                                    'empty_pixels ({0} integer)'.format(PIXEL))
+
+    def store(self, pixels, segments, empty):
+        values = [pixels] + [segments[name][(slice(None),) + index]
+                             for _, name, index in self.columns]
+        # Plain Python values, one tuple per segment.
+        rows = zip(*[column.tolist() for column in values])
+        with self.connection:
+            self.connection.executemany(self.insert, rows)
+            self.connection.executemany(
+                'insert into empty_pixels values (?)',
+                [(pixel,) for pixel in empty.tolist()])
+
+    def close(self):
+        super(SqliteSink, self).close()
+        self.connection.close()
+
+
+def read_sqlite(path, table='segments', bands=6, coefficients=4):
+    """Everything written by a SqliteSink, see `read_npz`."""
+    dtype = data.segment_dtype(bands, coefficients)
+    layout = columns(dtype)
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute('select {0}, {1} from {2} order by '
+                                  'rowid'.format(PIXEL, ', '.join(
+                                      column for column, _, _ in layout),
+                                      table)).fetchall()
+        empty = [pixel for pixel, in connection.execute(
+            'select {0} from empty_pixels order by rowid'.format(PIXEL))]
+    finally:
+        connection.close()
+
+    values = np.array(rows, dtype=float).reshape(len(rows), len(layout) + 1)
+    segments = np.empty(len(rows), dtype=dtype)
+    for ix, (_, name, index) in enumerate(layout, 1):
+        segments[name][(slice(None),) + index] = values[:, ix]
+    return (values[:, 0].astype(np.int64), segments,
+            np.array(empty, dtype=np.int64))
@@ -0,0 +1,135 @@
+"""Sources of pixel blocks for change detection, read ahead of detection.
+
+A source splits the pixels to detect change for into blocks, each a
+(pixels, 9, n) cube like ccd.detect_batch accepts, and reads a block given
+its key. Reading and detecting alternate when done one after the other;
+`prefetch` instead reads the next blocks in a pool of reader threads while
+the current block is detected, keeping at most `depth` blocks read ahead.
+
+Reference sources:
+
+    - DirectorySource: a directory of .npy files, a block per file.
+    - StoreSource: blocks of pixels of a ccd.store.ChipStore.
+
+Other sources implement `Source.keys` and `Source.read`; read is called
+from reader threads, so it must be safe to call concurrently.
+"""
+import abc
+import collections
+import concurrent.futures as futures
+import itertools
+import os
+import numpy as np
+from ccd import app
+from ccd import instrument
+
+log = app.logging.getLogger(__name__)
+
+
+class Source(abc.ABC):
+    """Blocks of pixels, see the module documentation."""
+
+    @abc.abstractmethod
+    def keys(self):
+        """Key of every block, in the order blocks are detected."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def read(self, key):
+        """The (pixels, 9, n) cube of the block with key, in memory."""
+        raise NotImplementedError
+
+
+class DirectorySource(Source):
+    """Every .npy file of a directory, a (pixels, 9, n) block per file.
+
+    Args:
+        path: directory holding the files.
+        suffix: file name suffix of blocks.
+    """
+
+    def __init__(self, path, suffix='.npy'):
+        self.path = path
+        self.suffix = suffix
+
+    def keys(self):
+        """File names of blocks, in sorted order."""
+        return sorted(name for name in os.listdir(self.path)
+                      if name.endswith(self.suffix))
+
+    def read(self, key):
+        return np.load(os.path.join(self.path, key))
+
+
+class StoreSource(Source):
+    """Blocks of consecutive pixels of a chip store.
+
+    Args:
+        store: ccd.store.ChipStore
+        size: number of pixels in each block.
+        start: first ordinal date, None for the first acquisition.
+        stop: last ordinal date, None for the last acquisition.
+    """
+
+    def __init__(self, store, size=100, start=None, stop=None):
+        self.store = store
+        self.size = size
+        self.start = start
+        self.stop = stop
+
+    def keys(self):
+        """(first, stop) pixel index of each block."""
+        return [(first, min(first + self.size, self.store.pixels))
+                for first in range(0, self.store.pixels, self.size)]
+
+    def read(self, key):
+        # A copy, so the reader thread pays for the I/O and not detection
+        # touching pages of the memmap.
+        return np.array(self.store.read(slice(*key), self.start, self.stop))
+
+
+def prefetch(source, depth=None, workers=1, stats=instrument.NULL):
+    """Blocks of source, read ahead while the caller works on each one.
+
+    Args:
+        source: Source
+        depth: number of blocks read ahead of the one handed to the
+            caller, app.PREFETCH_DEPTH if None. 0 reads each block when
+            the caller asks for it.
+        workers: number of reader threads.
+        stats: ccd.instrument.Stats counting 'blocks' and timing
+            'io_wait', the time the caller was blocked on reads.
+
+    Returns:
+        generator producing (key, cube) pairs in the order of source.keys
+    """
+    depth = app.PREFETCH_DEPTH if depth is None else depth
+    keys = iter(source.keys())
+    log.debug("prefetch {0} blocks ahead with {1} "
+              "readers".format(depth, workers))
+
+    if depth < 1:
+        for key in keys:
+            with stats.timer('io_wait'):
+                cube = source.read(key)
+            stats.count('blocks')
+            yield key, cube
+        return
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque((key, executor.submit(source.read, key))
+                                    for key in itertools.islice(keys, depth))
+        try:
+            while pending:
+                key, future = pending.popleft()
+                with stats.timer('io_wait'):
+                    cube = future.result()
+                # Keep depth blocks reading while the caller has this one.
+                for following in itertools.islice(keys, 1):
+                    pending.append((following,
+                                    executor.submit(source.read, following)))
+                stats.count('blocks')
+                yield key, cube
+        finally:
+            for _, future in pending:
+                future.cancel()
@@ -0,0 +1,322 @@
+"""A work spool: a job's tasks in a directory shared by many workers.
+
+Workers on any number of hosts coordinate only through the filesystem, so
+a shared filesystem is all that is needed. Each task is a small JSON
+document that moves between three directories by atomic rename:
+
+    pending/NAME.json           waiting for a worker
+    claimed/NAME.json@WORKER    claimed by WORKER, mtime is its heartbeat
+    done/NAME.json              complete
+
+Only one of several workers renaming the same pending task succeeds, the
+rest find it gone and try the next one. A worker touches its claim while
+working on it (see `heartbeat`); a claim whose heartbeat is older than the
+timeout belongs to a dead worker and is renamed back to pending by whoever
+notices first (see `reclaim`). A worker that was only slow then finds its
+claim gone when completing; its task is run again, so tasks must write
+their results idempotently, e.g. by renaming complete results into place
+like `detect_task` does.
+
+A chip job splits the pixels of a ccd.store.ChipStore into blocks, a task
+per block, see `chip_tasks`, `detect_task` and `work`.
+"""
+import collections
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import numpy as np
+import ccd
+import ccd.sink as sink
+import ccd.store as chips
+from ccd import app
+
+log = app.logging.getLogger(__name__)
+
+PENDING, CLAIMED, DONE = 'pending', 'claimed', 'done'
+
+SUFFIX = '.json'
+
+# Separates the task from the worker in the name of a claim.
+SEPARATOR = '@'
+
+# A claimed task: its name, the path of the claim and the task document.
+Task = collections.namedtuple('Task', ['name', 'claim', 'payload'])
+
+
+class Lost(Exception):
+    """The claim of a task was reclaimed from this worker."""
+
+
+def worker_id():
+    """Name of this worker, unique across hosts and processes."""
+    return '{0}.{1}.{2}'.format(socket.gethostname(), os.getpid(),
+                                uuid.uuid4().hex[:8])
+
+
+def __write(path, payload):
+    """Write a JSON document, renaming it into place once complete."""
+    temporary = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+    with open(temporary, 'w') as f:
+        json.dump(payload, f)
+    os.replace(temporary, path)
+
+
+def create(path, tasks):
+    """Create a spool holding tasks, all pending.
+
+    Args:
+        path: directory of the spool, created if needed, must not hold a
+            spool already.
+        tasks: iterable of JSON serializable task documents; tasks are
+            named, and claimed, in this order.
+
+    Returns:
+        number of tasks
+    """
+    if os.path.exists(os.path.join(path, PENDING)):
+        raise ValueError("a spool already exists at {0}".format(path))
+    for state in (CLAIMED, DONE, PENDING):
+        os.makedirs(os.path.join(path, state), exist_ok=True)
+    count = 0
+    for count, payload in enumerate(tasks, 1):
+        __write(os.path.join(path, PENDING,
+                             '{0:08d}{1}'.format(count - 1, SUFFIX)),
+                payload)
+    return count
+
+
+class Spool(object):
+    """Claims and completes the tasks of a spool directory.
+
+    Args:
+        path: directory of the spool, see `create`.
+        worker: name of this worker, see `worker_id`.
+        timeout: seconds without a heartbeat after which a claim is stale,
+            app.SPOOL_TIMEOUT if None.
+    """
+
+    def __init__(self, path, worker=None, timeout=None):
+        self.path = path
+        self.worker = worker or worker_id()
+        self.timeout = app.SPOOL_TIMEOUT if timeout is None else timeout
+
+    def __names(self, state):
+        return sorted(name for name in os.listdir(os.path.join(self.path,
+                                                               state))
+                      if not name.endswith('.tmp'))
+
+    def status(self):
+        """Number of pending, claimed and done tasks."""
+        return {state: len(self.__names(state))
+                for state in (PENDING, CLAIMED, DONE)}
+
+    def claim(self):
+        """Claim a pending task, reclaiming stale claims if none is left.
+
+        Returns:
+            Task, None when no task is pending.
+        """
+        for _ in range(2):
+            for name in self.__names(PENDING):
+                task = self.__claim(name)
+                if task is not None:
+                    return task
+            if not self.reclaim():
+                return None
+        return None
+
+    def __claim(self, name):
+        claim = os.path.join(self.path, CLAIMED,
+                             name + SEPARATOR + self.worker)
+        pending = os.path.join(self.path, PENDING, name)
+        try:
+            # Rename keeps the mtime, which must not look stale once
+            # claimed, so the heartbeat starts before.
+            os.utime(pending)
+            os.rename(pending, claim)
+        except FileNotFoundError:
+            # Another worker claimed it first.
+            return None
+        with open(claim) as f:
+            payload = json.load(f)
+        log.debug("{0} claimed {1}".format(self.worker, name))
+        return Task(name[:-len(SUFFIX)], claim, payload)
+
+    def heartbeat(self, task):
+        """Mark a task as still being worked on.
+
+        Raises:
+            Lost: the task was reclaimed.
+        """
+        try:
+            os.utime(task.claim)
+        except FileNotFoundError:
+            raise Lost(task.name)
+
+    def complete(self, task):
+        """Mark a claimed task as done.
+
+        Returns:
+            False if the task was reclaimed from this worker meanwhile; it
+            is then pending or claimed by another worker.
+        """
+        try:
+            os.rename(task.claim, os.path.join(self.path, DONE,
+                                               task.name + SUFFIX))
+        except FileNotFoundError:
+            log.debug("{0} lost {1}".format(self.worker, task.name))
+            return False
+        return True
+
+    def release(self, task):
+        """Return a claimed task to pending, e.g. after it failed."""
+        try:
+            os.rename(task.claim, os.path.join(self.path, PENDING,
+                                               task.name + SUFFIX))
+        except FileNotFoundError:
+            pass
+
+    def reclaim(self):
+        """Return stale claims to pending.
+
+        Returns:
+            number of claims this call returned
+        """
+        reclaimed = 0
+        oldest = time.time() - self.timeout
+        for claim in self.__names(CLAIMED):
+            path = os.path.join(self.path, CLAIMED, claim)
+            try:
+                if os.stat(path).st_mtime >= oldest:
+                    continue
+                name = claim.rsplit(SEPARATOR, 1)[0]
+                os.rename(path, os.path.join(self.path, PENDING, name))
+            except FileNotFoundError:
+                # Completed or reclaimed meanwhile.
+                continue
+            log.debug("{0} reclaimed {1}".format(self.worker, claim))
+            reclaimed += 1
+        return reclaimed
+
+
+class Heartbeat(object):
+    """Context manager touching a task's claim from a thread until exit.
+
+    Args:
+        spool: Spool
+        task: claimed Task
+        interval: seconds between heartbeats, a third of the spool's
+            timeout if None.
+    """
+
+    def __init__(self, spool, task, interval=None):
+        self.spool = spool
+        self.task = task
+        self.interval = spool.timeout / 3.0 if interval is None \
+            else interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__beat, daemon=True)
+
+    def __beat(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.spool.heartbeat(self.task)
+            except Lost:
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def work(path, fn, worker=None, timeout=None, limit=None):
+    """Claim and run tasks until none is pending.
+
+    A task that raises is returned to pending and the error re-raised.
+
+    Args:
+        path: directory of the spool.
+        fn: function of a task document, e.g. `detect_task`.
+        worker: name of this worker, see `worker_id`.
+        timeout: see Spool.
+        limit: most tasks to run, no limit if None.
+
+    Returns:
+        number of tasks this worker completed
+    """
+    spool = Spool(path, worker, timeout)
+    completed = 0
+    while limit is None or completed < limit:
+        task = spool.claim()
+        if task is None:
+            break
+        try:
+            with Heartbeat(spool, task):
+                fn(task.payload)
+        except BaseException:
+            spool.release(task)
+            raise
+        completed += spool.complete(task)
+    log.debug("{0} completed {1} tasks".format(spool.worker, completed))
+    return completed
+
+
+def chip_tasks(store, output, size=100, start=None, stop=None):
+    """Tasks detecting change for blocks of pixels of a chip store.
+
+    Args:
+        store: directory of a ccd.store.ChipStore.
+        output: directory results are written to, a directory per task.
+        size: number of pixels in each block.
+        start: first ordinal date, None for the first acquisition.
+        stop: last ordinal date, None for the last acquisition.
+
+    Returns:
+        list of task documents for `create` and `detect_task`
+    """
+    pixels = chips.open_store(store).pixels
+    return [{'store': store, 'output': output, 'first': first,
+             'stop': min(first + size, pixels), 'start': start,
+             'end': stop}
+            for first in range(0, pixels, size)]
+
+
+def block_name(first, stop):
+    """Name of the results directory of pixels first to stop."""
+    return '{0:08d}-{1:08d}'.format(first, stop)
+
+
+def detect_task(payload):
+    """Detect change for a block of pixels, see `chip_tasks`.
+
+    Results are written to output/FIRST-STOP with ccd.sink.write_block, so
+    a task run again doesn't duplicate them.
+    """
+    first, stop = payload['first'], payload['stop']
+    final = os.path.join(payload['output'], block_name(first, stop))
+    if os.path.exists(final):
+        return
+    cube = np.array(chips.open_store(payload['store']).read(
+        slice(first, stop), payload['start'], payload['end']))
+    sink.write_block(final, range(first, stop),
+                     ccd.detect_batch(cube, output='array'))
+
+
+def chip_results(output):
+    """Results of every completed task of a chip job.
+
+    Args:
+        output: directory the tasks wrote to.
+
+    Returns:
+        tuple: pixel of each segment, structured array of segments and ids
+            of pixels without segments, see `ccd.sink.read_blocks`.
+    """
+    return sink.read_blocks(output)
@@ -0,0 +1,222 @@
+"""On-disk store of time-series cubes for a chip of pixels.
+
+A store is a directory holding a cube shaped (pixel, 9, time), the nine
+rows being the dates, reds, greens, blues, nirs, swir1s, swir2s, thermals
+and qas that ccd.detect accepts. Pixels of a chip share acquisitions, so
+the dates of the chip are also kept once, as the date index.
+
+The time axis is split into chunk files of a fixed number of acquisitions,
+each a raw C-ordered array opened with numpy.memmap. New acquisitions are
+appended by filling the last chunk and adding new ones; existing chunks are
+never rewritten. Reads of a date range only touch the chunks that hold it,
+and reads within one chunk are memmap views, not copies.
+
+    meta.json       pixels, chunk size, dtype and number of acquisitions
+    dates.i8        date index, int64 ordinal dates, ascending
+    chunk-NNNNN.dat (pixels, 9, chunk) cube of each chunk
+
+meta.json is replaced last when appending, so a store interrupted during
+an append still opens with the acquisitions it had before.
+"""
+import json
+import os
+import numpy as np
+from ccd import app
+
+log = app.logging.getLogger(__name__)
+
+ROWS = 9
+
+FORMAT = 1
+
+
+class ChipStore(object):
+    """A store directory, see the module documentation.
+
+    Args:
+        path: store directory, see `create` for new stores.
+        mode: 'r' for reading only, 'r+' to also append.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != FORMAT:
+            raise ValueError("unsupported store format "
+                             "{0}".format(meta.get('format')))
+        self.pixels = meta['pixels']
+        self.chunk = meta['chunk']
+        self.dtype = np.dtype(meta['dtype'])
+        self.length = meta['length']
+        self.__chunks = {}
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def shape(self):
+        return self.pixels, ROWS, self.length
+
+    def dates(self):
+        """Date index, the ordinal date of each acquisition."""
+        if self.length == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.memmap(os.path.join(self.path, 'dates.i8'), mode='r',
+                         dtype=np.int64, shape=(self.length,))
+
+    def index(self, start=None, stop=None):
+        """Acquisitions from start to stop, inclusive, as a slice.
+
+        Args:
+            start: first ordinal date, None for the first acquisition.
+            stop: last ordinal date, None for the last acquisition.
+
+        Returns:
+            slice of the time axis
+        """
+        dates = self.dates()
+        first = 0 if start is None else int(np.searchsorted(dates, start))
+        last = self.length if stop is None else \
+            int(np.searchsorted(dates, stop, side='right'))
+        return slice(first, max(first, last))
+
+    def __chunk_path(self, number):
+        return os.path.join(self.path, 'chunk-{0:05d}.dat'.format(number))
+
+    def __open_chunk(self, number, mode=None):
+        if mode is None and number in self.__chunks:
+            return self.__chunks[number]
+        cube = np.memmap(self.__chunk_path(number), dtype=self.dtype,
+                         mode=mode or self.mode,
+                         shape=(self.pixels, ROWS, self.chunk))
+        self.__chunks[number] = cube
+        return cube
+
+    def blocks(self, pixels=slice(None), start=None, stop=None):
+        """Views of the cube for a date range, one per chunk.
+
+        Args:
+            pixels: index of the pixel axis, a slice keeps views.
+            start: first ordinal date, None for the first acquisition.
+            stop: last ordinal date, None for the last acquisition.
+
+        Returns:
+            generator producing (pixels, 9, t) arrays in date order
+        """
+        times = self.index(start, stop)
+        position = times.start
+        while position < times.stop:
+            number, offset = divmod(position, self.chunk)
+            end = min(times.stop - number * self.chunk, self.chunk)
+            yield self.__open_chunk(number)[pixels, :, offset:end]
+            position = number * self.chunk + end
+
+    def read(self, pixels=slice(None), start=None, stop=None):
+        """The cube for a date range.
+
+        A range within one chunk is a view of the memmap, ranges spanning
+        chunks are copied into one array.
+
+        Args:
+            pixels: index of the pixel axis.
+            start: first ordinal date, None for the first acquisition.
+            stop: last ordinal date, None for the last acquisition.
+
+        Returns:
+            (pixels, 9, t) array, ready for ccd.detect_batch
+        """
+        blocks = list(self.blocks(pixels, start, stop))
+        if len(blocks) == 1:
+            return blocks[0]
+        if not blocks:
+            count = len(np.arange(self.pixels)[pixels])
+            return np.empty((count, ROWS, 0), dtype=self.dtype)
+        return np.concatenate(blocks, axis=2)
+
+    def append(self, cube):
+        """Add acquisitions to the end of the time axis.
+
+        Args:
+            cube: (pixels, 9, t) array. The date row must be the same for
+                every pixel and come after the last stored date, in
+                ascending order.
+        """
+        if self.mode != 'r+':
+            raise ValueError("store opened read only")
+        cube = np.asarray(cube)
+        if cube.ndim != 3 or cube.shape[:2] != (self.pixels, ROWS):
+            raise ValueError("expected a ({0}, {1}, t) cube, got "
+                             "{2}".format(self.pixels, ROWS, cube.shape))
+        if (cube.astype(self.dtype) != cube).any():
+            raise ValueError("values don't fit the store dtype "
+                             "{0}".format(self.dtype))
+        dates = cube[0, 0].astype(np.int64)
+        if (cube[:, 0] != cube[0, 0]).any():
+            raise ValueError("pixels of a chip must share dates")
+        if (np.diff(dates) <= 0).any():
+            raise ValueError("dates must be ascending")
+        if self.length and dates.size and dates[0] <= self.dates()[-1]:
+            raise ValueError("dates must come after the last stored date")
+
+        position = self.length
+        while position < self.length + dates.size:
+            number, offset = divmod(position, self.chunk)
+            end = min(self.length + dates.size - number * self.chunk,
+                      self.chunk)
+            exists = os.path.exists(self.__chunk_path(number))
+            target = self.__open_chunk(number, 'r+' if exists else 'w+')
+            source = position - self.length
+            target[:, :, offset:end] = \
+                cube[:, :, source:source + end - offset]
+            target.flush()
+            position = number * self.chunk + end
+
+        # Drop dates of an interrupted append before adding these.
+        with open(os.path.join(self.path, 'dates.i8'), 'r+b') as f:
+            f.truncate(self.length * 8)
+            f.seek(0, os.SEEK_END)
+            f.write(dates.tobytes())
+
+        self.length += dates.size
+        write_meta(self.path, self.pixels, self.chunk, self.dtype,
+                   self.length)
+        log.debug("appended {0} acquisitions to {1}, {2} "
+                  "stored".format(dates.size, self.path, self.length))
+
+
+def write_meta(path, pixels, chunk, dtype, length):
+    """Atomically replace meta.json of the store at path."""
+    meta = {'format': FORMAT, 'pixels': pixels, 'chunk': chunk,
+            'dtype': np.dtype(dtype).str, 'length': length}
+    temporary = os.path.join(path, 'meta.json.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(meta, f)
+    os.replace(temporary, os.path.join(path, 'meta.json'))
+
+
+def create(path, pixels, chunk=256, dtype=np.int32):
+    """Create an empty store.
+
+    Args:
+        path: directory for the store, created if needed, must not already
+            hold a store.
+        pixels: number of pixels.
+        chunk: number of acquisitions in each chunk file.
+        dtype: type of every value, must hold ordinal dates.
+
+    Returns:
+        ChipStore opened for appending
+    """
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        raise ValueError("a store already exists at {0}".format(path))
+    os.makedirs(path, exist_ok=True)
+    open(os.path.join(path, 'dates.i8'), 'wb').close()
+    write_meta(path, pixels, chunk, dtype, 0)
+    return ChipStore(path, 'r+')
+
+
+def open_store(path, mode='r'):
+    """Open an existing store, see ChipStore."""
+    return ChipStore(path, mode)
@@ -0,0 +1,143 @@
+"""Streaming input and output for many pixels.
+
+Input is long format, one observation per row, keyed by a pixel id:
+
+    - CSV with a header naming the columns pixel, date, red, green, blue,
+      nir, swir1, swir2, thermal and qa, in any order.
+    - NDJSON with one object per line holding the same keys.
+
+Rows of a pixel must be contiguous; a pixel ends when the id changes, and
+an id that appears again is a ValueError.
+Dates within a pixel may be in any order. Only the rows of the current
+pixel are held in memory, so memory stays constant however large the input.
+
+Output is NDJSON, one object per pixel:
+
+    {"pixel": id, "results": [detection, ...]}
+
+where each detection is a dict as returned by ccd.detect. Magnitudes that
+were not calculated are null.
+"""
+import csv
+import itertools
+import json
+import math
+import numpy as np
+import ccd
+from ccd import app
+
+log = app.logging.getLogger(__name__)
+
+# Rows of the (9, n) matrix ccd.detect accepts, in order.
+COLUMNS = ('date', 'red', 'green', 'blue', 'nir',
+           'swir1', 'swir2', 'thermal', 'qa')
+
+PIXEL = 'pixel'
+
+
+def __missing(row, columns):
+    return [name for name in columns if name not in row]
+
+
+def __checked(row, line):
+    missing = __missing(row, (PIXEL,) + COLUMNS)
+    if missing:
+        raise ValueError("line {0}: missing {1}".format(line,
+                                                        ', '.join(missing)))
+    return row
+
+
+def csv_rows(lines):
+    """Observations of a long format CSV.
+
+    Args:
+        lines: iterable of text lines, starting with the header.
+
+    Returns:
+        generator producing (pixel id, values) pairs, values ordered as
+        COLUMNS.
+    """
+    reader = csv.DictReader(lines)
+    missing = __missing(reader.fieldnames or (), (PIXEL,) + COLUMNS)
+    if missing:
+        raise ValueError("header is missing {0}".format(', '.join(missing)))
+    for row in reader:
+        yield row[PIXEL], [float(row[name]) for name in COLUMNS]
+
+
+def ndjson_rows(lines):
+    """Observations of an NDJSON file, one object per line.
+
+    Args:
+        lines: iterable of text lines, blank lines are skipped.
+
+    Returns:
+        generator producing (pixel id, values) pairs, values ordered as
+        COLUMNS.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        row = __checked(json.loads(line), number)
+        yield row[PIXEL], [float(row[name]) for name in COLUMNS]
+
+
+def pixels(rows):
+    """Group observations by pixel.
+
+    Args:
+        rows: iterable of (pixel id, values) pairs, rows of a pixel are
+            contiguous.
+
+    Returns:
+        generator producing (pixel id, matrix) pairs, matrix is the
+        (9, n) array ccd.detect accepts, sorted by date.
+
+    Raises:
+        ValueError: rows of a pixel aren't contiguous.
+    """
+    seen = set()
+    for pixel_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        if pixel_id in seen:
+            raise ValueError("rows of pixel {0} aren't contiguous".format(
+                pixel_id))
+        seen.add(pixel_id)
+        matrix = np.array([values for _, values in group]).T
+        log.debug("pixel {0}, {1} observations".format(pixel_id,
+                                                       matrix.shape[1]))
+        yield pixel_id, matrix[:, np.argsort(matrix[0], kind='mergesort')]
+
+
+def detect(item, preprocess=True):
+    """Detect change for one (pixel id, matrix) pair.
+
+    Returns:
+        (pixel id, tuple of ccd.detections)
+    """
+    pixel_id, matrix = item
+    return pixel_id, ccd.detect(*matrix, preprocess=preprocess)
+
+
+def __finite(value):
+    return value if math.isfinite(value) else None
+
+
+def ndjson(pixel_id, detections):
+    """One NDJSON line for the detections of a pixel.
+
+    Args:
+        pixel_id: id of the pixel, written as given.
+        detections: tuple of ccd.detections dicts.
+
+    Returns:
+        str without the trailing newline
+    """
+    results = []
+    for detection in detections:
+        detection = dict(detection)
+        for name, value in detection.items():
+            if isinstance(value, dict) and 'magnitude' in value:
+                detection[name] = dict(value,
+                                       magnitude=__finite(value['magnitude']))
+        results.append(detection)
+    return json.dumps({PIXEL: pixel_id, 'results': results})
@@ -1,15 +1,29 @@
+import hashlib
+import threading
 import numpy as np
-import sklearn.linear_model as lm
 import ccd.app as app
+from ccd import data
+from ccd import instrument
+from cachetools import LRUCache
+from ccd.models import harmonic
+from ccd.models import lasso
 
 log = app.logging.getLogger(__name__)
 
+# Bases of windows by (series key, start, stop), see `series_key`. Pixels of
+# a chip sharing clear acquisitions have the same series and windows, so
+# their factorizations are shared.
+cache = LRUCache(maxsize=1000)
+cache_lock = threading.RLock()
 
-def robust_fit_coefficient_matrix(observation_dates):
+
+def robust_fit_coefficient_matrix(observation_dates, dtype=None):
     """c1 * sin(t/365.25) + c2 * cos(t/365.25) + c3*t + c4 * 1
 
     Args:
         observation_dates: list of ordinal dates
+        dtype: floating point type of the matrix, data.precision() if None;
+            t counts from `ccd.models.lasso.origin` of it.
 
     Returns:
         Populated numpy array with coefficient values
@@ -18,52 +32,113 @@ def robust_fit_coefficient_matrix(observation_dates):
     annual_cycle = 2*np.pi/365.25
     observation_cycle = annual_cycle / len(observation_dates)
 
-    matrix = np.ones(shape=(len(observation_dates), 5))
-    matrix[:, 0] = [np.cos(annual_cycle*t) for t in observation_dates]
-    matrix[:, 1] = [np.sin(annual_cycle*t) for t in observation_dates]
-    matrix[:, 2] = [np.cos(observation_cycle*t) for t in observation_dates]
-    matrix[:, 3] = [np.sin(observation_cycle*t) for t in observation_dates]
-    matrix[:, 4] = [t for t in observation_dates]
+    dtype = data.precision() if dtype is None else np.dtype(dtype)
+    matrix = np.ones(shape=(len(observation_dates), 5), dtype=dtype)
+    matrix[:, 1], matrix[:, 0] = harmonic.annual(observation_dates)
+    matrix[:, 2], matrix[:, 3] = harmonic.cycle(observation_dates,
+                                                observation_cycle)
+    matrix[:, 4] = np.asarray(observation_dates) - lasso.origin(dtype)
     return matrix
 
 
+def series_key(times, dtype=None):
+    """Key of the robust fit coefficient matrix of a series, computed once
+    per series; with the start and stop of a window it keys `basis`.
+
+    Args:
+        times: list of ordinal dates of the series.
+        dtype: floating point type of the matrix, data.precision() if None
+
+    Returns:
+        tuple
+    """
+    dtype = data.precision() if dtype is None else np.dtype(dtype)
+    times = np.ascontiguousarray(times)
+    return (dtype.str, times.dtype.str, len(times),
+            hashlib.sha1(times.tobytes()).hexdigest())
+
+
+def basis(tmask_matrix, key=None):
+    """Orthonormal basis of the tmask matrix columns and an intercept.
+
+    Projecting observations onto the basis gives the predictions of an
+    ordinary least squares fit with intercept, like
+    sklearn.linear_model.LinearRegression, for any number of bands.
+
+    Args:
+        tmask_matrix: (n, k) robust fit coefficient matrix of a window.
+        key: (series key, start, stop) of the window, see `series_key`;
+            bases are cached by key when given.
+
+    Returns:
+        (n, k+1) numpy array, read-only when cached.
+    """
+    if key is None:
+        return __basis(tmask_matrix)
+    with cache_lock:
+        q = cache.get(key)
+    if q is None:
+        q = __basis(tmask_matrix)
+        q.flags.writeable = False
+        with cache_lock:
+            cache[key] = q
+    return q
+
+
+def __basis(tmask_matrix):
+    # Columns are centered first, as LinearRegression does; ordinal dates
+    # are otherwise nearly parallel to the intercept.
+    matrix = np.ones(shape=(tmask_matrix.shape[0], tmask_matrix.shape[1]+1),
+                     dtype=tmask_matrix.dtype)
+    matrix[:, :-1] = tmask_matrix - tmask_matrix.mean(axis=0)
+    q, _ = np.linalg.qr(matrix)
+    return q
+
+
 # TODO (jmorton) have a set of constants for array
 # indexes based on what is passed in.
 
-def tmask(times, observations, tmask_matrix, adjusted_rmse, bands=(1, 4)):
+def tmask_index(observations, tmask_matrix, adjusted_rmse, bands=(1, 4),
+                stats=instrument.NULL, key=None):
     """Produce an index for filtering outliers.
 
+    Each band is fit against the tmask matrix, observations where the delta
+    between predicted and actual values exceeds the threshold of any band
+    are outliers. All bands are fit together from one factorization of
+    the tmask matrix.
+
     Arguments:
-        observations: time/spectra/qa major nd-array, assumed to be
-            shaped as (9,n-moments) of unscaled data.
+        observations: spectral values, (bands, n-moments).
+        tmask_matrix: robust fit coefficient matrix for observations.
+        adjusted_rmse: thresholds, paired with bands in order.
         bands: list of band indices used for outlier detection, by default
             bands 2 and 5.
-        thresholds: list of values corresponding to bands
-            used for outlier deterction.
+        stats: ccd.instrument.Stats counting and timing calls.
+        key: key of the window, see `basis`.
 
-    Return: indexed array, excluding outlier observations.
+    Return: bool index, True for observations that aren't outliers.
     """
+    stats.count('tmask')
+    with stats.timer('tmask'):
+        q = basis(tmask_matrix, key)
+        actual = np.asarray(observations[list(bands), :], dtype=q.dtype)
+        predicted = np.dot(np.dot(actual, q), q.T)
+        thresholds = np.asarray(adjusted_rmse[:len(bands)])[:, None]
+        outliers = (np.abs(predicted - actual) > thresholds).any(axis=0)
+    return ~outliers
 
-    # TODO (jmorton) Determine how to use year parameter from original matlab
-    #                code... currently using all observations.
-    # TODO (jmorton) Determine suitable defaults for thresholds, the values
-    #                are completely arbitrary.
-
-    # Time and expected values using a four-part matrix of coefficients.
-    regression = lm.LinearRegression()
-
-    # Accumulator for outliers. This starts off as a list of False values
-    # because we don't assume anything is an outlier.
-    _, sample_count = observations.shape
-    outliers = np.zeros(sample_count, dtype=bool)
-
-    # For each band, determine if the delta between predeicted and actual
-    # values exceeds the threshold. If it does, then it is an outlier.
-    for band_ix, armse in zip(bands, adjusted_rmse):
-        actual = observations[band_ix, :]
-        fit = regression.fit(tmask_matrix, actual)
-        predicted = fit.predict(tmask_matrix)
-        outliers = outliers + (abs(predicted-actual) > armse)
-
-    # Keep all observations that aren't outliers.
-    return np.array(times)[~outliers], observations[:, ~outliers]
+
+def tmask(times, observations, tmask_matrix, adjusted_rmse, bands=(1, 4)):
+    """Filter outliers from times and observations, see `tmask_index`.
+
+    Arguments:
+        times: list of ordinal day numbers.
+        observations: spectral values, (bands, n-moments).
+        tmask_matrix: robust fit coefficient matrix for observations.
+        adjusted_rmse: thresholds, paired with bands in order.
+        bands: list of band indices used for outlier detection.
+
+    Return: times and observations, excluding outlier observations.
+    """
+    index = tmask_index(observations, tmask_matrix, adjusted_rmse, bands)
+    return np.array(times)[index], observations[:, index]
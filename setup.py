@@ -93,6 +93,7 @@ setup(
                  'pytest-profiling>=1.1.1',
                  'gprof2dot>=2015.12.1',
                  'pytest-watch>=4.1.0'],
+        'jit': ['numba>=0.50'],
     },
 
     setup_requires=['pytest-runner', 'pip'],
@@ -118,6 +119,7 @@ setup(
     entry_points='''
         [core_package.cli_plugins]
         sample=ccd.cli:sample
+        stream=ccd.cli:stream_command
         another_subcommand=ccd.cli:another_subcommand
     ''',
 )
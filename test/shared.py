@@ -7,6 +7,19 @@ import ccd.app as app
 log = app.logging.getLogger(__name__)
 
 
+def assert_same_segments(actual, expected):
+    """ Compare two structured arrays of segments, e.g. of two engines """
+    assert list(actual['start_day']) == list(expected['start_day'])
+    assert list(actual['end_day']) == list(expected['end_day'])
+    assert list(actual['observation_count']) == \
+        list(expected['observation_count'])
+    assert np.allclose(actual['rmse'], expected['rmse'])
+    assert np.allclose(actual['magnitude'], expected['magnitude'],
+                       equal_nan=True)
+    assert np.allclose(actual['coefficients'], expected['coefficients'])
+    assert np.allclose(actual['intercept'], expected['intercept'])
+
+
 def two_change_data():
     """ Generate sample data that has two changes in it.  The qa data is not
     correct at all so this data cannot be used during filtering """
@@ -0,0 +1,153 @@
+""" Tests for lockstep batch detection """
+import numpy as np
+import pytest
+
+from shared import assert_same_segments
+from shared import read_data
+from shared import sample_line
+
+from ccd import app
+from ccd.models import lasso
+import ccd
+import ccd.batch as batch
+import ccd.change as change
+
+
+def assert_same_results(actual, expected):
+    assert len(actual) == len(expected)
+    assert actual.dtype == expected.dtype
+    for a, e in zip(actual, expected):
+        assert a['start_day'] == e['start_day']
+        assert a['end_day'] == e['end_day']
+        assert a['observation_count'] == e['observation_count']
+        assert a['rmse'] == pytest.approx(e['rmse'])
+        assert np.allclose(a['magnitude'], e['magnitude'], equal_nan=True)
+        assert np.allclose(a['coefficients'], e['coefficients'])
+        assert np.allclose(a['intercept'], e['intercept'])
+
+
+def test_pack():
+    times = np.array([[1, 2, 3, 4]])
+    observations = np.array([[[10, 20, 30, 40]]])
+    criteria = np.array([[False, True, False, True]])
+    times, observations, counts = batch.pack(times, observations, criteria)
+    assert counts[0] == 2
+    assert list(times[0, :2]) == [2, 4]
+    assert list(observations[0, 0, :2]) == [20, 40]
+
+
+def test_find_time_index():
+    times = np.array([[0, 100, 200, 400, 500],
+                      [0, 100, 200, 300, 0]])
+    found = batch.find_time_index(times, np.array([5, 4]), np.array([0, 0]),
+                                  meow_size=2)
+    assert list(found) == [3, -1]
+
+
+def test_lines_match_change_detect():
+    times, observations = sample_line('R100/2000-01-01/P16D')
+    changed = observations.copy()
+    changed[0, 50:] += 500
+    short = observations.copy()
+
+    # The third pixel only has 16 valid observations, the rest is padding.
+    results = batch.detect(np.array([times, times, times]),
+                           np.array([observations, changed, short]),
+                           np.array([100, 100, 16]),
+                           lasso.fitted_model)
+
+    assert_same_results(results[0], change.detect(times, observations,
+                                                  lasso.fitted_model))
+    assert_same_results(results[1], change.detect(times, changed,
+                                                  lasso.fitted_model))
+    assert_same_results(results[2], change.detect(times[:16],
+                                                  observations[:, :16],
+                                                  lasso.fitted_model))
+
+
+def test_incremental_matches_change_detect():
+    times, observations = sample_line('R100/2000-01-01/P16D')
+    changed = observations.astype(float)
+    changed[:, ::2] += 0.01
+    changed[0, 50:] += 500
+
+    results = batch.detect(np.array([times, times]),
+                           np.array([observations, changed]),
+                           np.array([100, 60]),
+                           lasso.fitted_model, incremental=True)
+
+    assert_same_results(results[0], change.detect(times, observations,
+                                                  lasso.fitted_model,
+                                                  incremental=True))
+    assert_same_results(results[1], change.detect(times[:60],
+                                                  changed[:, :60],
+                                                  lasso.fitted_model,
+                                                  incremental=True))
+
+
+def test_sample_2_detect_batch():
+    data = read_data("test/resources/sample_2.csv")
+    cloudy = data.copy()
+    cloudy[8, ::5] = 4
+    results = ccd.detect_batch(np.array([data, cloudy]))
+    for actual, expected in zip(results, [ccd.detect(*data),
+                                          ccd.detect(*cloudy)]):
+        assert len(actual) == len(expected)
+        for a, e in zip(actual, expected):
+            assert a['start_day'] == e['start_day']
+            assert a['end_day'] == e['end_day']
+            assert a['red']['rmse'] == pytest.approx(e['red']['rmse'])
+            assert a['nir']['magnitude'] == pytest.approx(
+                e['nir']['magnitude'])
+            assert a['nir']['coefficients'] == pytest.approx(
+                e['nir']['coefficients'])
+            assert a['nir']['intercept'] == pytest.approx(
+                e['nir']['intercept'])
+    results = ccd.detect_batch(np.array([data, cloudy]), output='array')
+    for actual, pixel in zip(results, [data, cloudy]):
+        assert_same_segments(actual, ccd.detect(*pixel, output='array'))
+
+
+def test_detect_batch_skips_undetectable_pixels():
+    data = read_data("test/resources/sample_2.csv")
+    filled = data.copy()
+    filled[8] = 255
+    results = ccd.detect_batch(np.array([filled, data, filled]),
+                               output='array')
+    assert len(results[0]) == len(results[2]) == 0
+    assert list(results[1]['end_day']) == list(
+        ccd.detect(*data, output='array')['end_day'])
+
+
+def test_detect_batch_incremental(monkeypatch):
+    data = read_data("test/resources/sample_2.csv")
+    calls = []
+
+    def spy(*args, **kwargs):
+        calls.append(kwargs.get('incremental'))
+        return batch.detect(*args, **kwargs)
+
+    monkeypatch.setattr(ccd, '__detect_batch', spy)
+    monkeypatch.setattr(app, 'INCREMENTAL_FIT', True)
+    results = ccd.detect_batch(np.array([data]), output='array')
+    assert calls == [True]
+    assert_same_results(results[0], ccd.detect(*data, output='array'))
+
+
+def test_detect_batch_float32(monkeypatch):
+    data = read_data("test/resources/sample_2.csv")
+    cloudy = data.copy()
+    cloudy[8, ::5] = 4
+    expected = [ccd.detect(*pixel, output='array')
+                for pixel in (data, cloudy)]
+    monkeypatch.setattr(app, 'PRECISION', 'float32')
+    results = ccd.detect_batch(np.array([data, cloudy]), output='array')
+    for actual, wanted in zip(results, expected):
+        assert list(actual['end_day']) == list(wanted['end_day'])
+        assert np.allclose(actual['rmse'], wanted['rmse'], rtol=1e-3)
+        assert np.allclose(actual['coefficients'][..., 2],
+                           wanted['coefficients'][..., 2], rtol=1e-2)
+        assert np.allclose(actual['coefficients'], wanted['coefficients'],
+                           rtol=1e-3, atol=1e-3)
+        assert np.allclose(actual['intercept'], wanted['intercept'],
+                           rtol=1e-3, atol=1)
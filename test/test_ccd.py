@@ -1,10 +1,17 @@
 import numpy as np
+import pytest
 
 from shared import acquisition_delta
+from shared import read_data
 from shared import sinusoid
 from shared import sample_line, sample_sinusoid
 
+from ccd import app
+from ccd import data
+from ccd import instrument
+from ccd.filter import preprocess
 from ccd.models import lasso
+from ccd.models import native
 import ccd.change as change
 
 
@@ -72,3 +79,222 @@ def test_three_changes_during_time():
     # TODO (jmorton) Figure out how to generate sample data
     #      that doesn't confuse change detection.
     # assert len(models) == 3, len(models)
+
+
+def test_incremental_extension():
+    times, observations = sample_line('R200/2000-01-01/P16D')
+    observations = observations.astype(float)
+    observations[:, ::2] += 0.01
+    observations[0, 120:] += 500
+    fitter_fn = lasso.fitted_model
+    expected = change.detect(times, observations, fitter_fn)
+    models = change.detect(times, observations, fitter_fn, incremental=True)
+    assert list(models['start_day']) == list(expected['start_day'])
+    assert list(models['end_day']) == list(expected['end_day'])
+    assert np.allclose(models['magnitude'], expected['magnitude'],
+                       equal_nan=True)
+
+
+def test_resume_matches_detect():
+    times, observations = sample_line('R200/2000-01-01/P16D')
+    observations = observations.astype(float)
+    observations[:, ::2] += 0.01
+    observations[0, 120:] += 500
+    fitter_fn = lasso.fitted_model
+    for incremental in (False, True):
+        expected = change.detect(times, observations, fitter_fn,
+                                 incremental=incremental)
+        for split in (10, 60, 121, 150, 199):
+            state = change.start(times[:split], observations[:, :split],
+                                 fitter_fn, incremental=incremental)
+            state = change.resume(state, times[split:split + 20],
+                                  observations[:, split:split + 20],
+                                  fitter_fn)
+            state = change.resume(state, times[split + 20:],
+                                  observations[:, split + 20:], fitter_fn)
+            resumed = change.segments(state)
+            assert list(resumed['start_day']) == list(expected['start_day'])
+            assert list(resumed['end_day']) == list(expected['end_day'])
+            assert np.allclose(resumed['rmse'], expected['rmse'])
+            assert np.allclose(resumed['magnitude'], expected['magnitude'],
+                               equal_nan=True)
+
+
+def test_resume_keeps_only_the_open_part():
+    times, observations = sample_line('R200/2000-01-01/P16D')
+    observations = observations.astype(float)
+    observations[:, ::2] += 0.01
+    observations[0, 120:] += 500
+    state = change.start(times, observations, lasso.fitted_model)
+    assert len(state.segments) == 2
+    assert state.times[0] == state.segments['end_day'][-1]
+    assert len(state.times) < len(times) - 100
+    with pytest.raises(ValueError):
+        change.resume(state, times[-5:], observations[:, -5:],
+                      lasso.fitted_model)
+
+
+def test_screened_initialization_matches(monkeypatch):
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    times, observations = data[0], data[1:7].astype(float)
+    results, counts = [], []
+    for size in (0, 32, 5):
+        monkeypatch.setattr(app, 'INITIALIZE_SCREEN', size)
+        stats = instrument.Stats()
+        results.append(change.detect(times, observations,
+                                     native.fitted_models, stats=stats))
+        counts.append(stats.counts)
+    expected = results[0]
+    for screened in results[1:]:
+        for name in expected.dtype.names:
+            assert np.array_equal(screened[name], expected[name],
+                                  equal_nan=True)
+    assert 'screened' not in counts[0]
+    assert counts[1]['fits'] < counts[0]['fits']
+    assert counts[1]['shifts'] == counts[0]['shifts']
+
+
+def test_screened_initialization_matches_float32(monkeypatch):
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    times, observations = data[0], data[1:7].astype(float)
+    monkeypatch.setattr(app, 'PRECISION', 'float32')
+    results = []
+    for size in (0, 32):
+        monkeypatch.setattr(app, 'INITIALIZE_SCREEN', size)
+        for fitter_fn in (lasso.fitted_model, native.fitted_models):
+            results.append(change.detect(times, observations, fitter_fn))
+    for screened, expected in zip(results[2:], results[:2]):
+        for name in expected.dtype.names:
+            assert np.array_equal(screened[name], expected[name],
+                                  equal_nan=True)
+    assert change.screen_margin(np.float32) > change.screen_margin(np.float64)
+
+
+def test_time_index_matches_find_time_index():
+    times = np.array([0, 10, 100, 200, 370, 380, 500, 740, 750, 760])
+    # The second series isn't ascending, as detect may be given.
+    for series in (times, times[[0, 2, 1, 3, 4, 6, 5, 7, 8, 9]]):
+        for meow_size in (1, 3, 12):
+            ends = change.time_index(series, meow_size)
+            assert len(ends) == max(len(series) - meow_size + 1, 0)
+            for ix in range(len(ends)):
+                found = change.find_time_index(series, ix, meow_size)
+                assert ends[ix] == (-1 if found is None else found)
+                assert change.find_time_index(series, ix, meow_size,
+                                              ends=ends) == found
+                assert (change.enough_time(series, ix, ends=ends) ==
+                        change.enough_time(series, ix))
+            assert not change.enough_samples(series, len(ends), meow_size,
+                                             ends)
+
+
+def test_fit_from_matrix_rows():
+    times, observations = sample_line('R50/2000-01-01/P16D')
+    matrix = lasso.coefficient_matrix(times)
+    calls = []
+
+    def fitter_fn(dates, spectra):
+        calls.append('dates')
+        return native.fitted_models(dates, spectra)
+
+    def from_matrix(rows, spectra):
+        calls.append(rows)
+        return native.matrix_models(rows, spectra)
+    from_matrix.vectorized = fitter_fn.vectorized = True
+    fitter_fn.from_matrix = from_matrix
+
+    models = change.fit(fitter_fn, times[5:30], observations[:, 5:30],
+                        matrix[5:30])
+    assert calls[0].base is matrix
+    expected = change.fit(fitter_fn, times[5:30], observations[:, 5:30])
+    assert calls[1] == 'dates'
+    for model, wanted in zip(models, expected):
+        assert np.array_equal(model.coef_, wanted.coef_)
+    sklearn_models = change.fit(lasso.fitted_model, times[5:30],
+                                observations[:, 5:30], matrix[5:30])
+    assert np.allclose(sklearn_models[0].coef_,
+                       lasso.fitted_model(times[5:30],
+                                          observations[0, 5:30]).coef_)
+
+
+def test_stacked_models_match_each_model():
+    times, observations = sample_line('R50/2000-01-01/P16D')
+    observations = observations.astype(float)
+    observations[:, ::3] += 5
+    matrix = lasso.coefficient_matrix(times)
+    fitted = change.fit(lasso.fitted_model, times, observations)
+    models = data.models(fitted)
+    assert models.coefficients.shape == (len(observations), 4)
+    assert data.models(models) is models
+
+    predicted = data.predict(models, matrix)
+    for ix, model in enumerate(fitted):
+        assert np.allclose(predicted[ix], model.predict(matrix))
+    expected = [np.linalg.norm(model.predict(matrix) - observed)
+                for model, observed in zip(fitted, observations)]
+    assert np.allclose(change.magnitudes(models, matrix, observations),
+                       expected)
+    assert np.allclose(change.rmse(fitted, matrix, observations),
+                       np.array(expected) / np.sqrt(len(times)))
+
+
+def assert_within_tolerance(actual, expected, times):
+    """float32 segments against float64 ones: the same periods, errors and
+    predictions within the lasso solver's tolerance."""
+    assert list(actual['start_day']) == list(expected['start_day'])
+    assert list(actual['end_day']) == list(expected['end_day'])
+    assert np.allclose(actual['rmse'], expected['rmse'], rtol=1e-3,
+                       atol=0.01)
+    assert np.allclose(actual['magnitude'], expected['magnitude'],
+                       rtol=1e-3, atol=0.1, equal_nan=True)
+    for a, e in zip(actual, expected):
+        days = times[(times >= e['start_day']) & (times <= e['end_day'])]
+        matrix = lasso.coefficient_matrix(days, np.float64)
+        predicted = [data.predict(data.Models(s['coefficients'],
+                                              s['intercept']), matrix)
+                     for s in (a, e)]
+        assert np.allclose(predicted[0], predicted[1], rtol=1e-3, atol=0.5)
+
+
+def test_float32_matches_float64(monkeypatch):
+    sample = preprocess(read_data("test/resources/sample_2.csv"))
+    changed = sample_sinusoid('R400/2000-01-01/P8D')
+    changed = (changed[0], changed[1] + np.linspace(0, 1, 400))
+    changed[1][:, 200:] += 300
+
+    def detect(times, observations, fitter_fn, incremental):
+        state = change.start(times[:300], observations[:, :300], fitter_fn,
+                             incremental=incremental)
+        state = change.resume(state, times[300:], observations[:, 300:],
+                              fitter_fn)
+        return (change.detect(times, observations, fitter_fn,
+                              incremental=incremental),
+                change.segments(state))
+
+    for fitter_fn in (lasso.fitted_model, native.fitted_models):
+        for incremental in (False, True):
+            for times, observations in ((sample[0], sample[1:7]), changed):
+                expected = detect(times, observations, fitter_fn,
+                                  incremental)
+                monkeypatch.setattr(app, 'PRECISION', 'float32')
+                actual = detect(times, observations, fitter_fn, incremental)
+                monkeypatch.setattr(app, 'PRECISION', 'float64')
+                assert len(expected[0]) > 1
+                for a, e in zip(actual, expected):
+                    assert_within_tolerance(a, e, times)
+
+
+def test_float32_design_matrix(monkeypatch):
+    times = np.arange(730000, 730400, 16)
+    expected = lasso.coefficient_matrix(times)
+    monkeypatch.setattr(app, 'PRECISION', 'float32')
+    matrix = lasso.coefficient_matrix(times)
+    assert matrix.dtype == np.float32
+    assert list(matrix[:, 2]) == list(times - lasso.ORIGIN)
+    assert np.allclose(matrix[:, :2], expected[:, :2], atol=1e-6)
+    assert np.allclose(lasso.ordinal_intercepts([[0, 0, 2, 0]], [5]),
+                       [5 - 2 * lasso.ORIGIN])
+    assert lasso.ordinal_intercepts([[0, 0, 2, 0]], [5], np.float64) == [5]
+    intercepts = np.array([5.0])
+    assert lasso.ordinal_intercepts([[0, 0, 2, 0]], intercepts,
+                                    np.float64) is not intercepts
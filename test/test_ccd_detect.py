@@ -37,3 +37,29 @@ def test_validate_sample_2_algorithm_field():
     msg = "reported algorithm {0} did not match actual {1}".format(reported,
                                                                    actual)
     assert reported == actual, msg
+
+
+def test_sample_2_array_output():
+    """The structured array holds the same values as the detection dicts"""
+    data = read_data("test/resources/sample_2.csv")
+    segments = ccd.detect(*data, output='array')
+    results = ccd.detect(*data)
+    assert len(segments) == len(results)
+    for segment, result in zip(segments, results):
+        assert segment['start_day'] == result['start_day']
+        assert segment['end_day'] == result['end_day']
+        assert segment['observation_count'] == result['observation_count']
+        assert result['observation_count'] > 0
+        assert tuple(segment['coefficients'][3]) == \
+            result['nir']['coefficients']
+        assert segment['intercept'][0] == result['red']['intercept']
+
+
+def test_fitter_is_resolved_once(monkeypatch):
+    monkeypatch.setattr(ccd.app, 'FITTER_FN',
+                        'ccd.models.native.fitted_models')
+    first = ccd.fitter()
+    assert first is ccd.fitter()
+    assert first.from_matrix is not None
+    monkeypatch.setattr(ccd.app, 'FITTER_FN', 'ccd.models.lasso.fitted_model')
+    assert ccd.fitter() is not first
@@ -0,0 +1,98 @@
+""" Tests for checkpointed chip runs """
+import json
+import os
+import numpy as np
+import pytest
+
+from shared import assert_same_segments
+from shared import read_data
+
+import ccd
+import ccd.checkpoint as checkpoint
+import ccd.instrument as instrument
+import ccd.sink as sink
+import ccd.store as store
+from ccd import app
+
+
+def chip(path, pixels=5):
+    data = read_data("test/resources/sample_2.csv")
+    cube = np.array([data] * pixels)
+    cube[1:, 1:7] += np.arange(1, pixels)[:, None, None]
+    cube[3, 8] = 255
+    chips = store.create(path, pixels=pixels)
+    chips.append(cube)
+    return cube
+
+
+def test_resume(tmp_path):
+    path, output = str(tmp_path / 'chip'), str(tmp_path / 'output')
+    cube = chip(path)
+    assert checkpoint.run(path, output, size=2, limit=2) == 2
+    manifest = checkpoint.read_manifest(output)
+    assert manifest['blocks'] == [[0, 2], [2, 4]]
+    assert manifest['config']['MEOW_SIZE'] == app.MEOW_SIZE
+    with open(os.path.join(output, checkpoint.MANIFEST)) as f:
+        assert 'blocks' not in json.load(f)
+
+    stats = instrument.Stats()
+    assert checkpoint.run(path, output, size=2, stats=stats) == 1
+    assert stats.counts['skipped_blocks'] == 2
+    assert stats.counts['blocks'] == 1
+    assert checkpoint.run(path, output, size=2) == 0
+
+    pixels, segments, empty = sink.read_blocks(output)
+    assert list(empty) == [3]
+    for pixel in (0, 1, 2, 4):
+        assert_same_segments(segments[pixels == pixel],
+                             ccd.detect(*cube[pixel], output='array'))
+
+
+def test_block_outside_the_manifest_is_kept(tmp_path):
+    path, output = str(tmp_path / 'chip'), str(tmp_path / 'output')
+    cube = chip(path)
+    checkpoint.run(path, output, size=2, limit=1)
+    # Interrupted after writing a block, while recording it.
+    with open(os.path.join(output, checkpoint.COMPLETED), 'w') as f:
+        f.write('0 ')
+
+    assert checkpoint.run(path, output, size=2) == 3
+    pixels, _, _ = sink.read_blocks(output)
+    expected = ccd.detect_batch(cube, output='array')
+    assert [np.sum(pixels == pixel) for pixel in range(5)] == \
+        [len(segments) for segments in expected]
+    assert sorted(os.listdir(output)) == ['00000000-00000002',
+                                          '00000002-00000004',
+                                          '00000004-00000005',
+                                          checkpoint.COMPLETED,
+                                          checkpoint.MANIFEST]
+
+
+def test_compact(tmp_path):
+    output = str(tmp_path)
+    with open(os.path.join(output, checkpoint.COMPLETED), 'w') as f:
+        f.write('2 4\n0 2\n2 4\n4 ')
+    assert checkpoint.completed(output) == [[2, 4], [0, 2], [2, 4]]
+    assert checkpoint.compact(output) == [[0, 2], [2, 4]]
+    with open(os.path.join(output, checkpoint.COMPLETED)) as f:
+        assert f.read() == '0 2\n2 4\n'
+
+
+def test_refuses_changed_parameters(tmp_path, monkeypatch):
+    path, output = str(tmp_path / 'chip'), str(tmp_path / 'output')
+    chip(path)
+    checkpoint.run(path, output, size=2, limit=1)
+
+    # Chip runs detect blocks with ccd.batch whatever the backend.
+    monkeypatch.setattr(app, 'DETECT_BACKEND', 'numba')
+    assert checkpoint.run(path, output, size=2, limit=0) == 0
+    monkeypatch.setattr(app, 'MEOW_SIZE', 12)
+    with pytest.raises(ValueError) as error:
+        checkpoint.run(path, output, size=2)
+    assert 'MEOW_SIZE (16 -> 12)' in str(error.value)
+    monkeypatch.undo()
+
+    with pytest.raises(ValueError) as error:
+        checkpoint.run(path, output, size=3)
+    assert 'input size' in str(error.value)
+    assert checkpoint.read_manifest(output)['blocks'] == [[0, 2]]
@@ -0,0 +1,62 @@
+""" Tests for running detection over many pixels """
+import numpy as np
+import pytest
+from cachetools import cached
+
+from shared import sample_line
+from shared import two_change_data
+
+import ccd
+from ccd import app
+from ccd import executor
+
+
+def pixels():
+    times, observations = sample_line('R50/2000-01-01/P16D')
+    line = np.vstack((times, observations, observations[:2]))
+    changed = line.copy()
+    changed[1, 25:] += 500
+    return [line, two_change_data(), changed, line]
+
+
+def test_chunked():
+    chunks = list(executor.chunked('abcde', 2))
+    assert chunks == [[(0, 'a'), (1, 'b')], [(2, 'c'), (3, 'd')], [(4, 'e')]]
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        executor.run(len, [], backend='gpu')
+
+
+@pytest.mark.parametrize('backend', ['serial', 'thread', 'process'])
+def test_backends_match_detect(backend):
+    expected = [ccd.detect(*pixel, preprocess=False) for pixel in pixels()]
+    results = list(ccd.detect_many(pixels(), preprocess=False,
+                                   executor=backend, workers=2, chunksize=1))
+    assert [ix for ix, _ in results] == [0, 1, 2, 3]
+    assert [detections for _, detections in results] == expected
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_unordered(backend):
+    results = ccd.detect_many(pixels(), preprocess=False, executor=backend,
+                              workers=2, chunksize=3, ordered=False)
+    assert sorted(ix for ix, _ in results) == [0, 1, 2, 3]
+
+
+def test_app_cache_under_threads():
+    calls = []
+
+    @cached(cache=app.cache, lock=app.cache_lock,
+            key=lambda value: ('test_app_cache', value))
+    def square(value):
+        calls.append(value)
+        return value * value
+
+    results = list(executor.run(square, list(range(50)) * 4, 'thread',
+                                workers=8))
+    assert sorted(result for _, result in results) == \
+        sorted(value * value for value in list(range(50)) * 4)
+    assert set(calls) == set(range(50))
+    assert all(('test_app_cache', value) in app.cache for value in range(50))
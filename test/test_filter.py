@@ -1,3 +1,4 @@
+import numpy as np
 import shared
 import pytest
 from ccd.filter import *
@@ -98,3 +99,35 @@ def test_sample_2_preprocessing():
     data = shared.read_data("test/resources/sample_2.csv")
     meow = preprocess(data)
     assert meow.shape == (9,477), meow.shape
+
+
+def test_chip_counts_match_pixel_counts():
+    qas = np.array([shared.read_data("test/resources/sample_1.csv")[8, :69],
+                    shared.read_data("test/resources/sample_2.csv")[8, :69],
+                    np.full(69, 255)])
+    counts = chip_counts(qas)
+    for ix, qa in enumerate(qas):
+        assert counts.clear[ix] == count_clear_or_water(qa)
+        assert counts.snow[ix] == count_snow(qa)
+        assert counts.fill[ix] == count_fill(qa)
+        assert counts.total[ix] == count_total(qa)
+
+
+def test_categorize():
+    sample_1 = shared.read_data("test/resources/sample_1.csv")[8]
+    snowy = np.full(40, 4)
+    snowy[:5] = 0
+    qas = np.array([sample_1[:40], snowy, np.full(40, 2), np.full(40, 255)])
+    assert list(categorize(qas)) == [STANDARD, SNOW, INSUFFICIENT,
+                                     INSUFFICIENT]
+    assert categorize(sample_1) == STANDARD
+
+
+def test_detectable():
+    data = shared.read_data("test/resources/sample_2.csv")
+    cube = np.array([data, data, data])
+    cube[1, 8, 20:] = 4
+    cube[2, 0] = cube[2, 0, 0] + np.arange(cube.shape[2]) // 10
+    index = chip_index(cube)
+    assert (index[0] == preprocess_index(data)).all()
+    assert list(detectable(cube[:, 0], index)) == [True, False, False]
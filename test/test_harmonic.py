@@ -0,0 +1,68 @@
+""" Tests for the shared harmonic terms """
+import numpy as np
+import pytest
+
+from shared import acquisition_delta
+
+from ccd.models import harmonic
+from ccd.models import lasso
+import ccd.tmask as tmask
+
+
+def test_annual_matches_direct_computation():
+    dates = np.array(acquisition_delta('R50/2000-01-01/P16D'))
+    sin, cos = harmonic.annual(dates)
+    assert sin == pytest.approx(np.sin(2 * np.pi * dates / 365.25))
+    assert cos == pytest.approx(np.cos(2 * np.pi * dates / 365.25))
+
+
+def test_annual_table_grows_both_ways():
+    late = np.array([736000, 736010])
+    early = np.array([720000, 720001])
+    harmonic.annual(late)
+    sin, cos = harmonic.annual(early)
+    assert sin == pytest.approx(np.sin(2 * np.pi * early / 365.25))
+    sin, cos = harmonic.annual(late)
+    assert cos == pytest.approx(np.cos(2 * np.pi * late / 365.25))
+
+
+def test_annual_table_size(monkeypatch):
+    monkeypatch.setattr(harmonic, 'TABLE_SIZE', 1000)
+    for dates in (np.array([730000, 730000 + 5000]),
+                  np.array([1e15, 3e15]),
+                  np.array([740000, 740999]),
+                  np.array([730000, 730010])):
+        sin, cos = harmonic.annual(dates)
+        assert sin == pytest.approx(np.sin(2 * np.pi * dates / 365.25))
+        assert cos == pytest.approx(np.cos(2 * np.pi * dates / 365.25))
+    _, table, _ = vars(harmonic)['__table']
+    assert table.size <= 1000
+
+
+def test_annual_float_dates():
+    dates = np.array([730000.5, 730001.25])
+    sin, _ = harmonic.annual(dates)
+    assert sin == pytest.approx(np.sin(2 * np.pi * dates / 365.25))
+
+
+def test_annual_integral_float_dates():
+    dates = np.array(acquisition_delta('R50/2000-01-01/P16D'))
+    expected = harmonic.annual(dates)
+    for dtype in (np.float64, np.float32):
+        sin, cos = harmonic.annual(dates.astype(dtype))
+        assert np.array_equal(sin, expected[0])
+        assert np.array_equal(cos, expected[1])
+
+
+def test_coefficient_matrices():
+    dates = np.array(acquisition_delta('R20/2000-01-01/P1M'))
+    matrix = lasso.coefficient_matrix(dates)
+    assert matrix.shape == (20, 4)
+    assert matrix[:, 2] == pytest.approx(dates)
+    assert matrix[:, 3] == pytest.approx(np.ones(20))
+
+    cycle = 2 * np.pi / 365.25 / 20
+    matrix = tmask.robust_fit_coefficient_matrix(dates)
+    assert matrix[:, 0] == pytest.approx(np.cos(2 * np.pi * dates / 365.25))
+    assert matrix[:, 3] == pytest.approx(np.sin(cycle * dates))
+    assert matrix[:, 4] == pytest.approx(dates)
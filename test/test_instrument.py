@@ -0,0 +1,42 @@
+""" Tests for hot path instrumentation """
+from shared import sample_line
+
+from ccd import app
+from ccd import instrument
+from ccd.models import lasso
+import ccd.change as change
+
+
+def test_stats_per_call():
+    times, observations = sample_line('R100/2000-01-01/P16D')
+    stats = instrument.Stats()
+    results = change.detect(times, observations, lasso.fitted_model,
+                            stats=stats)
+    counts = stats.counts
+    assert counts['segments'] == len(results) == 1
+    assert counts['tmask'] >= 1
+    assert counts['extensions'] > 0
+    assert counts['fits'] >= counts['extensions'] + 1
+    for phase in ('detect', 'initialize', 'extend', 'fit', 'tmask'):
+        assert stats.seconds[phase] > 0
+    assert stats.seconds['detect'] >= stats.seconds['initialize']
+
+
+def test_process_totals():
+    times, observations = sample_line('R50/2000-01-01/P16D')
+    instrument.reset()
+    change.detect(times, observations, lasso.fitted_model)
+    assert not instrument.totals().counts
+
+    stats = instrument.Stats()
+    change.detect(times, observations, lasso.fitted_model, stats=stats)
+    change.detect(times, observations, lasso.fitted_model, stats=stats)
+    assert instrument.totals().counts == stats.counts
+    assert stats.counts['segments'] == 2
+
+    app.INSTRUMENT = True
+    try:
+        change.detect(times, observations, lasso.fitted_model)
+    finally:
+        app.INSTRUMENT = False
+    assert instrument.totals().counts['segments'] == 3
@@ -0,0 +1,52 @@
+""" Tests for the compiled per-pixel kernel """
+import numpy as np
+import pytest
+
+from shared import assert_same_segments
+from shared import read_data
+from shared import sample_line
+
+from ccd import app
+from ccd.filter import preprocess
+from ccd.models import native
+import ccd
+import ccd.change as change
+import ccd.kernel as kernel
+
+
+def test_find_time_index():
+    times = np.array([0, 100, 200, 400, 500])
+    assert kernel.find_time_index(times, 0, 2, 365) == 3
+    assert kernel.find_time_index(times, 2, 2, 365) == -1
+
+
+def test_lines_match_change_detect():
+    times, observations = sample_line('R100/2000-01-01/P16D')
+    observations = observations.astype(float)
+    observations[:, ::2] += 0.01
+    observations[0, 50:] += 500
+    for length in (15, 30, 100):
+        assert_same_segments(
+            kernel.detect(times[:length], observations[:, :length]),
+            change.detect(times[:length], observations[:, :length],
+                          native.fitted_models))
+
+
+def test_sample_2_matches_change_detect():
+    pytest.importorskip('numba')
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    assert_same_segments(kernel.detect(data[0], data[1:7]),
+                         change.detect(data[0], data[1:7],
+                                       native.fitted_models))
+
+
+def test_backend_switch():
+    data = read_data("test/resources/sample_2.csv")
+    fitter, backend = app.FITTER_FN, app.DETECT_BACKEND
+    app.FITTER_FN = 'ccd.models.native.fitted_models'
+    try:
+        expected = ccd.detect(*data, output='array')
+        app.DETECT_BACKEND = 'numba'
+        assert_same_segments(ccd.detect(*data, output='array'), expected)
+    finally:
+        app.FITTER_FN, app.DETECT_BACKEND = fitter, backend
@@ -0,0 +1,174 @@
+""" Tests for the NumPy lasso solver """
+import numpy as np
+import pytest
+
+from shared import read_data
+from shared import sample_line
+
+from ccd import app
+from ccd import instrument
+from ccd.filter import preprocess
+from ccd.models import lasso
+from ccd.models import native
+import ccd.change as change
+
+
+def test_agrees_with_sklearn():
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    for start, stop in [(0, 16), (50, 90), (300, 320), (100, 400)]:
+        dates, spectra = data[0, start:stop], data[1:7, start:stop]
+        matrix = lasso.coefficient_matrix(dates)
+        models = native.fitted_models(dates, spectra)
+        for model, spectrum in zip(models, spectra):
+            expected = lasso.fitted_model(dates, spectrum)
+            assert model.coef_ == pytest.approx(expected.coef_, rel=1e-6)
+            assert model.intercept_ == pytest.approx(expected.intercept_,
+                                                     rel=1e-6)
+            assert model.predict(matrix) == pytest.approx(
+                expected.predict(matrix), rel=1e-6)
+            assert model.n_iter_ == expected.n_iter_
+
+
+def test_constant_spectrum_stops_early():
+    times, observations = sample_line('R20/2000-01-01/P1M')
+    models = native.fitted_models(times, observations)
+    for model in models:
+        assert model.n_iter_ == 1
+        assert model.intercept_ == pytest.approx(1000)
+        assert not np.any(model.coef_)
+
+
+def test_stacked_problems():
+    times, observations = sample_line('R20/2000-01-01/P1M')
+    matrix = lasso.coefficient_matrix(times)
+    x_centered = matrix - matrix.mean(axis=0)
+    y = observations[0] + np.arange(20) * 10.0
+    y_centered = y - y.mean()
+    gram = np.dot(x_centered.T, x_centered)
+    covariance = np.dot(x_centered.T, y_centered)
+    norm = np.dot(y_centered, y_centered)
+
+    stacked, _ = native.coordinate_descent(
+        np.array([gram, gram]), np.array([covariance, 0 * covariance]),
+        np.array([norm, 0.0]), 20)
+    single, _ = native.coordinate_descent(gram, covariance, norm, 20)
+    assert stacked[0] == pytest.approx(single)
+    assert not np.any(stacked[1])
+
+
+def test_detect_with_native_fitter():
+    times, observations = sample_line('R100/2000-01-01/P16D')
+    observations[0, 50:100] += 500
+    expected = change.detect(times, observations, lasso.fitted_model)
+    results = change.detect(times, observations, native.fitted_models)
+    assert list(results['start_day']) == list(expected['start_day'])
+    assert list(results['end_day']) == list(expected['end_day'])
+
+
+def test_statistics_match_fit():
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    matrix = lasso.coefficient_matrix(data[0, 100:160])
+    spectra = data[1:7, 100:160].astype(float)
+
+    stats = native.statistics(matrix[:20], spectra[:, :20])
+    stats = native.update(stats, matrix[20:], spectra[:, 20:])
+    coefficients, intercepts, _ = native.fit_statistics(stats)
+    expected = native.fit(matrix, spectra)
+    assert coefficients == pytest.approx(expected[0], rel=1e-6, abs=1e-9)
+    assert intercepts == pytest.approx(expected[1], rel=1e-6)
+
+    residuals = (np.dot(coefficients, matrix.T) + intercepts[:, None] -
+                 spectra)
+    assert native.residual_norms(stats, coefficients, intercepts) == \
+        pytest.approx((residuals ** 2).sum(axis=1), rel=1e-6)
+
+
+def test_prefix_window_matches_statistics():
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    matrix = lasso.coefficient_matrix(data[0])
+    spectra = data[1:7].astype(float)
+    prefix = native.prefix_statistics(matrix, spectra)
+
+    stats = native.window(prefix, 200, 260)
+    expected = native.statistics(matrix[200:260], spectra[:, 200:260])
+    coefficients, intercepts, _ = native.fit_statistics(stats)
+    wanted = native.fit_statistics(expected)
+    assert stats.samples == 60
+    assert coefficients == pytest.approx(wanted[0], rel=1e-6, abs=1e-9)
+    assert intercepts == pytest.approx(wanted[1], rel=1e-6)
+    assert native.residual_norms(stats, coefficients, intercepts) == \
+        pytest.approx(native.residual_norms(expected, coefficients,
+                                            intercepts), rel=1e-6)
+
+
+def test_stacked_prefix_windows():
+    data = preprocess(read_data("test/resources/sample_2.csv"))[:, :100]
+    matrix = lasso.coefficient_matrix(data[0])
+    spectra = data[1:7].astype(float)
+    prefix = native.prefix_statistics(np.array([matrix, matrix]),
+                                       np.array([spectra, spectra[::-1]]))
+    stats = native.window(prefix, np.array([10, 20]), np.array([40, 60]),
+                          (np.array([0, 1]),))
+    coefficients, intercepts, _ = native.fit_statistics(stats)
+    assert coefficients[0] == pytest.approx(
+        native.fit(matrix[10:40], spectra[:, 10:40])[0], rel=1e-6, abs=1e-9)
+    assert intercepts[1] == pytest.approx(
+        native.fit(matrix[20:60], spectra[::-1, 20:60])[1], rel=1e-6)
+
+
+def test_least_squares_norms():
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    matrix = lasso.coefficient_matrix(data[0])
+    spectra = data[1:7].astype(float)
+    prefix = native.prefix_statistics(matrix, spectra)
+    stats = native.window(prefix, np.array([100, 300]), np.array([130, 360]))
+    squares = native.least_squares_norms(stats)
+    for ix, (start, stop) in enumerate(((100, 130), (300, 360))):
+        _, expected, _, _ = np.linalg.lstsq(matrix[start:stop],
+                                            spectra[:, start:stop].T,
+                                            rcond=None)
+        assert squares[ix] == pytest.approx(expected, rel=1e-6)
+        lasso_fit = native.fit(matrix[start:stop], spectra[:, start:stop])
+        window = native.window(prefix, start, stop)
+        assert (squares[ix] <=
+                native.residual_norms(window, *lasso_fit[:2])).all()
+
+
+def test_warm_start():
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    matrix = lasso.coefficient_matrix(data[0, 100:161])
+    spectra = data[1:7, 100:161].astype(float)
+    previous, _, _ = native.fit(matrix[:-1], spectra[:, :-1])
+    cold = native.fit(matrix, spectra)
+    warm = native.fit(matrix, spectra, initial=previous)
+    assert warm[0] == pytest.approx(cold[0], rel=1e-3, abs=1e-6)
+    assert warm[2].sum() < cold[2].sum()
+
+    models = change.fit(lasso.fitted_model, data[0, 100:161], spectra,
+                        matrix, initial=previous)
+    iterations = np.array([m.n_iter_ for m in models])
+    assert np.all(iterations <= cold[2])
+    assert iterations.sum() < cold[2].sum()
+    assert models[0].coef_ == pytest.approx(cold[0][0], rel=1e-3, abs=1e-6)
+
+
+def test_detect_warm_start(monkeypatch):
+    times, observations = sample_line('R200/2000-01-01/P16D')
+    # A trend, so models have coefficients for a warm start to reuse.
+    observations = observations + 0.01 * (times - times[0])
+    observations[:, ::2] += 0.01
+    observations[0, 120:] += 500
+    for incremental in (False, True):
+        counts = []
+        for warm_start in (False, True):
+            monkeypatch.setattr(app, 'WARM_START', warm_start)
+            stats = instrument.Stats()
+            results = change.detect(times, observations,
+                                    native.fitted_models,
+                                    incremental=incremental, stats=stats)
+            counts.append(stats.counts['extension_iterations'])
+            if not warm_start:
+                expected = results
+        assert list(results['end_day']) == list(expected['end_day'])
+        assert np.allclose(results['rmse'], expected['rmse'])
+        assert 0 < counts[1] < counts[0]
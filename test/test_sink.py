@@ -0,0 +1,95 @@
+""" Tests for bulk result sinks """
+import numpy as np
+import pytest
+
+from shared import read_data
+from shared import sample_line
+
+import ccd
+import ccd.change as change
+import ccd.sink as sink
+from ccd.models import lasso
+
+
+def results():
+    times, observations = sample_line('R200/2000-01-01/P16D')
+    observations = observations.astype(float)
+    observations[0, 120:] += 500
+    segments = change.detect(times, observations, lasso.fitted_model)
+    return [segments, segments[:0], segments[1:], segments[:0], segments]
+
+
+def assert_written(read, expected):
+    pixels, segments, empty = read
+    assert list(empty) == [1, 3]
+    assert list(pixels) == [0] * len(expected[0]) + [2] * len(expected[2]) \
+        + [4] * len(expected[4])
+    wanted = np.concatenate(expected)
+    for name in wanted.dtype.names:
+        assert np.array_equal(segments[name], wanted[name], equal_nan=True)
+
+
+def test_columns():
+    names = [column for column, _, _ in sink.columns(
+        ccd.data.segment_dtype(2, 3))]
+    assert names[:4] == ['start_day', 'end_day', 'observation_count',
+                         'magnitude_0']
+    assert 'coefficients_1_2' in names
+    assert len(names) == 3 + 2 + 2 + 6 + 2
+
+
+@pytest.mark.parametrize('flush_size', [1, 2, 100])
+def test_npz_sink(tmp_path, flush_size):
+    expected = results()
+    with sink.NpzSink(str(tmp_path), flush_size=flush_size) as written:
+        written.write_many(range(5), expected)
+    assert len(sink.parts(str(tmp_path))) == written.batches
+    assert written.batches == (1 if flush_size == 100 else 3)
+    assert_written(sink.read_npz(str(tmp_path)), expected)
+
+
+def test_incomplete_sink():
+    with pytest.raises(TypeError):
+        sink.Sink()
+
+
+def test_npz_sink_appends_parts(tmp_path):
+    expected = results()
+    with sink.NpzSink(str(tmp_path), compress=True) as written:
+        written.write_many(range(3), expected[:3])
+    with sink.NpzSink(str(tmp_path)) as written:
+        written.write_many(range(3, 5), expected[3:])
+    assert len(sink.parts(str(tmp_path))) == 2
+    assert_written(sink.read_npz(str(tmp_path)), expected)
+
+
+def test_memory_ceiling(tmp_path):
+    expected = results()
+    written = sink.NpzSink(str(tmp_path), memory=expected[0].nbytes)
+    written.write(0, expected[0])
+    assert written.batches == 1
+    written.write(1, expected[1])
+    assert written.batches == 1 and written.bytes == 8
+    written.close()
+    assert written.batches == 2
+
+
+def test_sqlite_sink(tmp_path):
+    expected = results()
+    path = str(tmp_path / 'results.db')
+    with sink.SqliteSink(path, flush_size=2) as written:
+        written.write_many(range(5), expected)
+    assert_written(sink.read_sqlite(path), expected)
+
+
+def test_detect_batch_into_sink(tmp_path):
+    data = read_data("test/resources/sample_2.csv")
+    filled = data.copy()
+    filled[8] = 255
+    detected = ccd.detect_batch(np.array([data, filled]), output='array')
+    with sink.NpzSink(str(tmp_path)) as written:
+        written.write_many([7, 8], detected)
+    pixels, segments, empty = sink.read_npz(str(tmp_path))
+    assert list(empty) == [8]
+    assert set(pixels) == {7}
+    assert list(segments['end_day']) == list(detected[0]['end_day'])
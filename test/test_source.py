@@ -0,0 +1,116 @@
+""" Tests for data sources and prefetching """
+import threading
+import time
+import numpy as np
+import pytest
+
+from shared import assert_same_segments
+from shared import read_data
+
+import ccd
+import ccd.instrument as instrument
+import ccd.source as source
+import ccd.store as store
+
+
+def chip(pixels=3):
+    data = read_data("test/resources/sample_2.csv")
+    cube = np.array([data] * pixels)
+    cube[1:, 1:7] += np.arange(1, pixels)[:, None, None]
+    return cube
+
+
+class Recorded(source.Source):
+    """Blocks of integers, recording reads and allowing them as asked."""
+
+    def __init__(self, count):
+        self.count = count
+        self.started, self.reads = [], []
+        self.allowed = threading.Semaphore(0)
+
+    def keys(self):
+        return list(range(self.count))
+
+    def read(self, key):
+        self.started.append(key)
+        self.allowed.acquire()
+        self.reads.append(key)
+        return np.full((1, 9, 1), key)
+
+
+def test_incomplete_source():
+    class Keys(source.Source):
+        def keys(self):
+            return []
+
+    with pytest.raises(TypeError):
+        Keys()
+
+
+def test_directory_source(tmp_path):
+    cube = chip()
+    np.save(str(tmp_path / 'b.npy'), cube[1:])
+    np.save(str(tmp_path / 'a.npy'), cube[:1])
+    (tmp_path / 'notes.txt').write_text('not a block')
+    blocks = source.DirectorySource(str(tmp_path))
+    assert blocks.keys() == ['a.npy', 'b.npy']
+    assert (blocks.read('b.npy') == cube[1:]).all()
+
+
+def test_store_source(tmp_path):
+    cube = chip(5)
+    chips = store.create(str(tmp_path / 'chip'), pixels=5, chunk=100)
+    chips.append(cube)
+    blocks = source.StoreSource(chips, size=2, stop=cube[0, 0, 149])
+    assert blocks.keys() == [(0, 2), (2, 4), (4, 5)]
+    block = blocks.read((2, 4))
+    assert not isinstance(block, np.memmap)
+    assert (block == cube[2:4, :, :150]).all()
+
+
+@pytest.mark.parametrize('depth', [0, 1, 3])
+def test_prefetch_reads_ahead(depth):
+    blocks = Recorded(6)
+    stats = instrument.Stats()
+    blocks.allowed.release(depth + 1)
+    results = source.prefetch(blocks, depth, workers=2, stats=stats)
+
+    key, cube = next(results)
+    assert key == 0 and cube[0, 0, 0] == 0
+    # Readers run ahead of the caller by depth blocks, no further.
+    for _ in range(100):
+        if len(blocks.started) > depth:
+            break
+        time.sleep(0.01)
+    time.sleep(0.01)
+    assert sorted(blocks.started) == list(range(depth + 1))
+    blocks.allowed.release(100)
+    received = [key] + [key for key, _ in results]
+    assert received == list(range(6))
+    assert sorted(blocks.reads) == list(range(6))
+    assert stats.counts['blocks'] == 6
+    assert stats.seconds['io_wait'] > 0
+
+
+def test_prefetch_stops_reading_with_the_caller():
+    blocks = Recorded(10)
+    blocks.allowed.release(10)
+    results = source.prefetch(blocks, depth=2)
+    next(results)
+    results.close()
+    assert len(blocks.reads) <= 4
+
+
+def test_detect_source(tmp_path):
+    cube = chip()
+    np.save(str(tmp_path / 'a.npy'), cube[:2])
+    np.save(str(tmp_path / 'b.npy'), cube[2:])
+    stats = instrument.Stats()
+    results = list(ccd.detect_source(source.DirectorySource(str(tmp_path)),
+                                     output='array', stats=stats))
+    assert [key for key, _ in results] == ['a.npy', 'b.npy']
+    detected = results[0][1] + results[1][1]
+    for actual, pixel in zip(detected, cube):
+        assert_same_segments(actual, ccd.detect(*pixel, output='array'))
+    assert stats.counts['blocks'] == 2
+    assert set(stats.seconds) == {'io_wait', 'detect_block'}
@@ -0,0 +1,120 @@
+""" Tests for the work spool """
+import multiprocessing
+import os
+import time
+import numpy as np
+import pytest
+
+from shared import assert_same_segments
+from shared import read_data
+
+import ccd
+import ccd.spool as spool
+import ccd.store as store
+
+
+def record(payload):
+    """Task writing the claiming process to a file named by the task."""
+    path = os.path.join(payload['output'], str(payload['n']))
+    with open(path, 'a') as f:
+        f.write('{0}\n'.format(os.getpid()))
+    time.sleep(0.01)
+
+
+def workers(target, args, count=3):
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=target, args=args)
+                 for _ in range(count)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    return [process.exitcode for process in processes]
+
+
+def test_claim_and_complete(tmp_path):
+    path = str(tmp_path / 'spool')
+    assert spool.create(path, [{'n': 0}, {'n': 1}]) == 2
+    with pytest.raises(ValueError):
+        spool.create(path, [])
+
+    first, second = spool.Spool(path, 'a'), spool.Spool(path, 'b')
+    task = first.claim()
+    assert task.payload == {'n': 0}
+    assert second.claim().payload == {'n': 1}
+    assert second.claim() is None
+    assert first.status() == {'pending': 0, 'claimed': 2, 'done': 0}
+
+    assert first.complete(task)
+    assert first.status()['done'] == 1
+
+
+def test_stale_claims_are_reclaimed(tmp_path):
+    path = str(tmp_path / 'spool')
+    spool.create(path, [{'n': 0}])
+    dead, alive = spool.Spool(path, 'dead', 60), spool.Spool(path, 'alive',
+                                                             60)
+    task = dead.claim()
+    assert alive.claim() is None
+
+    old = time.time() - 120
+    os.utime(task.claim, (old, old))
+    reclaimed = alive.claim()
+    assert reclaimed.payload == task.payload
+
+    with pytest.raises(spool.Lost):
+        dead.heartbeat(task)
+    assert not dead.complete(task)
+    assert alive.complete(reclaimed)
+    assert alive.status() == {'pending': 0, 'claimed': 0, 'done': 1}
+
+
+def test_failed_tasks_are_released(tmp_path):
+    path = str(tmp_path / 'spool')
+    spool.create(path, [{'n': 0}])
+
+    def fail(payload):
+        raise RuntimeError('failed')
+
+    with pytest.raises(RuntimeError):
+        spool.work(path, fail)
+    assert spool.Spool(path).status()['pending'] == 1
+
+
+def test_processes_share_a_spool(tmp_path):
+    path, output = str(tmp_path / 'spool'), tmp_path / 'output'
+    output.mkdir()
+    spool.create(path, [{'n': n, 'output': str(output)} for n in range(40)])
+    assert workers(spool.work, (path, record)) == [0, 0, 0]
+
+    assert spool.Spool(path).status() == {'pending': 0, 'claimed': 0,
+                                          'done': 40}
+    # Every task ran exactly once, spread over the workers.
+    runs = [(output / str(n)).read_text().split() for n in range(40)]
+    assert all(len(pids) == 1 for pids in runs)
+    assert len(set(pid for pid, in runs)) > 1
+
+
+def test_chip_job(tmp_path):
+    data = read_data("test/resources/sample_2.csv")
+    cube = np.array([data] * 5)
+    cube[1:, 1:7] += np.arange(1, 5)[:, None, None]
+    cube[3, 8] = 255
+    chips = store.create(str(tmp_path / 'chip'), pixels=5)
+    chips.append(cube)
+
+    path, output = str(tmp_path / 'spool'), str(tmp_path / 'output')
+    spool.create(path, spool.chip_tasks(str(tmp_path / 'chip'), output,
+                                        size=2))
+    assert workers(spool.work, (path, spool.detect_task), 2) == [0, 0]
+
+    pixels, segments, empty = spool.chip_results(output)
+    assert list(empty) == [3]
+    for pixel in (0, 1, 2, 4):
+        assert_same_segments(segments[pixels == pixel],
+                             ccd.detect(*cube[pixel], output='array'))
+
+    # A task run again leaves the results as they are.
+    spool.detect_task(spool.chip_tasks(str(tmp_path / 'chip'), output,
+                                       size=2)[0])
+    assert len(os.listdir(output)) == 3
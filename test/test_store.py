@@ -0,0 +1,66 @@
+""" Tests for the on-disk chip store """
+import numpy as np
+import pytest
+
+from shared import read_data
+
+import ccd
+import ccd.store as store
+
+
+def chip(pixels=3):
+    data = read_data("test/resources/sample_2.csv")
+    cube = np.array([data] * pixels)
+    cube[1:, 1:7] += np.arange(1, pixels)[:, None, None]
+    return cube
+
+
+def test_append_and_read(tmp_path):
+    cube = chip()
+    chips = store.create(str(tmp_path / 'chip'), pixels=3, chunk=100)
+    chips.append(cube[:, :, :250])
+    chips.append(cube[:, :, 250:])
+
+    reopened = store.open_store(str(tmp_path / 'chip'))
+    assert reopened.shape == cube.shape
+    assert (reopened.dates() == cube[0, 0]).all()
+    assert (reopened.read() == cube).all()
+    assert (reopened.read(pixels=slice(1, 2)) == cube[1:2]).all()
+
+
+def test_read_date_range(tmp_path):
+    cube = chip()
+    chips = store.create(str(tmp_path / 'chip'), pixels=3, chunk=100)
+    chips.append(cube)
+    dates = cube[0, 0]
+
+    within = chips.read(start=dates[110], stop=dates[150])
+    assert isinstance(within, np.memmap)
+    assert (within == cube[:, :, 110:151]).all()
+
+    spanning = chips.read(start=dates[50] + 1, stop=dates[420])
+    assert (spanning == cube[:, :, 51:421]).all()
+    assert chips.read(start=dates[-1] + 1).shape == (3, 9, 0)
+
+
+def test_append_checks(tmp_path):
+    cube = chip()
+    chips = store.create(str(tmp_path / 'chip'), pixels=3, chunk=100)
+    chips.append(cube[:, :, :100])
+    with pytest.raises(ValueError):
+        chips.append(cube[:, :, 50:150])
+    with pytest.raises(ValueError):
+        chips.append(cube[:2, :, 100:])
+    with pytest.raises(ValueError):
+        store.open_store(str(tmp_path / 'chip')).append(cube[:, :, 100:])
+    with pytest.raises(ValueError):
+        store.create(str(tmp_path / 'chip'), pixels=3)
+    assert len(store.open_store(str(tmp_path / 'chip'))) == 100
+
+
+def test_detect_batch_from_store(tmp_path):
+    cube = chip(2)
+    chips = store.create(str(tmp_path / 'chip'), pixels=2)
+    chips.append(cube)
+    results = ccd.detect_batch(chips.read())
+    assert [len(r) for r in results] == [len(ccd.detect(*p)) for p in cube]
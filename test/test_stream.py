@@ -0,0 +1,99 @@
+""" Tests for streaming many pixels through the command line """
+import io
+import json
+import subprocess
+import sys
+
+from click.testing import CliRunner
+import pytest
+
+from shared import read_data
+
+import ccd
+import ccd.stream as stream
+from ccd.cli import cli
+
+
+def long_format(pixels):
+    """Long format CSV of (pixel id, (9, n) matrix) pairs, dates reversed
+    so the reader has to sort them."""
+    lines = [','.join(('pixel',) + stream.COLUMNS)]
+    for pixel_id, matrix in pixels:
+        for column in matrix.T[::-1]:
+            lines.append(','.join([pixel_id] + [str(v) for v in column]))
+    return '\n'.join(lines) + '\n'
+
+
+def by_date(matrix):
+    return matrix[:, matrix[0].argsort(kind='mergesort')]
+
+
+def test_pixels_group_and_sort():
+    data = by_date(read_data("test/resources/sample_1.csv"))
+    rows = stream.csv_rows(io.StringIO(long_format([('a', data),
+                                                    ('b', data[:, :30])])))
+    grouped = list(stream.pixels(rows))
+    assert [pixel_id for pixel_id, _ in grouped] == ['a', 'b']
+    assert (grouped[0][1] == data).all()
+    assert grouped[1][1].shape == (9, 30)
+
+
+def test_pixels_not_contiguous():
+    data = read_data("test/resources/sample_1.csv")[:, :3]
+    rows = stream.csv_rows(io.StringIO(long_format([('a', data),
+                                                    ('b', data),
+                                                    ('a', data)])))
+    with pytest.raises(ValueError):
+        list(stream.pixels(rows))
+
+
+def test_missing_columns():
+    with pytest.raises(ValueError):
+        list(stream.csv_rows(io.StringIO('pixel,date\n1,2\n')))
+    with pytest.raises(ValueError):
+        list(stream.ndjson_rows(io.StringIO('{"pixel": 1}\n')))
+
+
+def test_stream_command_matches_detect():
+    data = read_data("test/resources/sample_2.csv")
+    cloudy = data.copy()
+    cloudy[8, ::5] = 4
+    source = long_format([('12', data), ('13', cloudy)])
+
+    result = CliRunner().invoke(cli, ['stream', '--format', 'csv', '-'],
+                                input=source)
+    assert result.exit_code == 0, result.output
+    lines = [json.loads(line) for line in result.output.splitlines()
+             if line.startswith('{')]
+    assert [line['pixel'] for line in lines] == ['12', '13']
+    for line, pixel in zip(lines, [data, cloudy]):
+        expected = ccd.detect(*pixel)
+        assert len(line['results']) == len(expected)
+        for actual, wanted in zip(line['results'], expected):
+            assert actual['start_day'] == wanted['start_day']
+            assert actual['end_day'] == wanted['end_day']
+            assert actual['red']['rmse'] == pytest.approx(
+                wanted['red']['rmse'])
+
+
+def test_stream_stdout_is_ndjson():
+    data = read_data("test/resources/sample_2.csv")
+    source = long_format([('12', data)])
+    result = subprocess.run([sys.executable, '-m', 'ccd.cli', 'stream',
+                             '--format', 'csv', '-'], input=source,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    lines = result.stdout.splitlines()
+    assert [json.loads(line)['pixel'] for line in lines] == ['12']
+    assert result.stderr
+
+
+def test_ndjson_input():
+    data = by_date(read_data("test/resources/sample_1.csv"))
+    lines = [json.dumps(dict(zip(('pixel',) + stream.COLUMNS,
+                                 [7] + [int(v) for v in column])))
+             for column in data.T]
+    rows = stream.ndjson_rows(io.StringIO('\n'.join(lines) + '\n\n'))
+    [(pixel_id, matrix)] = list(stream.pixels(rows))
+    assert pixel_id == 7
+    assert (matrix == data).all()
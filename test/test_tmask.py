@@ -0,0 +1,66 @@
+""" Tests for tmask outlier filtering """
+import numpy as np
+import sklearn.linear_model as lm
+
+from shared import read_data
+
+from ccd.filter import preprocess
+import ccd.tmask as tmask
+
+
+def sample_window(start, stop):
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    matrix = tmask.robust_fit_coefficient_matrix(data[0])
+    adjusted_rmse = np.median(np.absolute(data[1:7]), 1) * 4.89
+    return (data[0, start:stop], data[1:7, start:stop],
+            matrix[start:stop], adjusted_rmse)
+
+
+def test_tmask_index_matches_linear_regression():
+    for start, stop in [(0, 20), (120, 160), (300, 340)]:
+        times, observations, matrix, adjusted_rmse = sample_window(start,
+                                                                   stop)
+        outliers = np.zeros(len(times), dtype=bool)
+        for band, threshold in zip((1, 4), adjusted_rmse):
+            actual = observations[band]
+            predicted = lm.LinearRegression().fit(matrix,
+                                                  actual).predict(matrix)
+            outliers |= np.abs(predicted - actual) > threshold
+        index = tmask.tmask_index(observations, matrix, adjusted_rmse)
+        assert np.array_equal(index, ~outliers)
+
+
+def test_tmask_index_finds_outliers():
+    times, observations, matrix, adjusted_rmse = sample_window(0, 30)
+    observations = observations.copy()
+    observations[4, 7] += 10 * adjusted_rmse[1]
+    index = tmask.tmask_index(observations, matrix, adjusted_rmse)
+    assert not index[7]
+
+
+def test_basis_is_orthonormal():
+    _, _, matrix, _ = sample_window(10, 40)
+    q = tmask.basis(matrix)
+    assert q.shape == (30, 6)
+    assert np.allclose(np.dot(q.T, q), np.eye(6))
+
+
+def test_basis_is_shared_by_key():
+    data = preprocess(read_data("test/resources/sample_2.csv"))
+    series = tmask.series_key(data[0], np.float64)
+    _, _, matrix, _ = sample_window(10, 40)
+    q = tmask.basis(matrix, (series, 10, 40))
+    assert tmask.basis(matrix.copy(), (series, 10, 40)) is q
+    assert tmask.basis(matrix, (series, 11, 40)) is not q
+    assert np.allclose(tmask.basis(matrix), q)
+    assert series != tmask.series_key(data[0, 1:], np.float64)
+    assert series != tmask.series_key(data[0], np.float32)
+
+
+def test_tmask_filters_times_and_observations():
+    times, observations, matrix, adjusted_rmse = sample_window(0, 30)
+    index = tmask.tmask_index(observations, matrix, adjusted_rmse)
+    times_, observations_ = tmask.tmask(times, observations, matrix,
+                                        adjusted_rmse)
+    assert np.array_equal(times_, times[index])
+    assert observations_.shape == (6, index.sum())